@@ -12,5 +12,10 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'blogservice.settings')
+os.environ.setdefault('BLOGSERVICE_URLCONF', 'blogservice.asgi_urls')
 
 application = get_asgi_application()
+
+from blogserviceapp.template_registry import warm_templates  # noqa: E402
+
+warm_templates()
@@ -0,0 +1,31 @@
+"""
+URL configuration served under ASGI.
+
+Same routes as ``blogservice.urls``, with the read views swapped for their
+native async implementations so they do not occupy a worker thread each.
+"""
+from django.urls import URLPattern
+
+from blogservice.urls import urlpatterns as sync_urlpatterns
+from blogserviceapp.views.PostViews import posts_by_category_view_async, posts_readed_view_async
+from blogserviceapp.views.CommentViews import comments_by_post_view_async
+from blogserviceapp.views.MessageViews import message_to_sender_view_async
+from blogserviceapp.views.CategoryViews import category_view_async
+
+ASYNC_VIEWS = {
+    'index': posts_readed_view_async,
+    'posts_by_category': posts_by_category_view_async,
+    'comments_by_post': comments_by_post_view_async,
+    'read_message': message_to_sender_view_async,
+    'categories': category_view_async,
+}
+
+
+def _swap(pattern):
+    view = ASYNC_VIEWS.get(getattr(pattern, 'name', None))
+    if view is None:
+        return pattern
+    return URLPattern(pattern.pattern, view, pattern.default_args, pattern.name)
+
+
+urlpatterns = [_swap(pattern) for pattern in sync_urlpatterns]
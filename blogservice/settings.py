@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,7 +24,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-jopd#qgn88ndt(i8#m5iaml(on@ydd-57kwyrwv4k7%z-knh26'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = ['*']
 
@@ -49,6 +50,9 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'blogserviceapp.instrumentation.RequestMetricsMiddleware',
+    # Before the session and auth middleware, whose reads it routes.
+    'blogserviceapp.routers.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,14 +62,21 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'blogservice.urls'
+# asgi.py points this at blogservice.asgi_urls to serve the async read views.
+ROOT_URLCONF = os.environ.get('BLOGSERVICE_URLCONF', 'blogservice.urls')
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, with render times in the request metrics.
+        'BACKEND': 'blogserviceapp.instrumentation.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / 'template'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -78,6 +89,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'blogservice.wsgi.application'
 
+LOGIN_URL = 'login'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -90,7 +103,43 @@ DATABASES = {
         'PASSWORD': 'postgres',  
         'HOST': 'localhost', 
         'PORT': '5432', 
+        # Seconds a worker keeps its connection between requests; manage.py serve opens it before
+        # the first one. Leave at 0 under runserver, which starts a thread per request.
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Read replicas of default, e.g. DATABASE_REPLICA_HOSTS=db-replica-1,db-replica-2.
+# Other setups (two SQLite files locally) can add aliases and list them here.
+DATABASE_REPLICAS = []
+for index, host in enumerate(h.strip() for h in os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',') if h.strip()):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+# Databases holding messages. A conversation's messages live on one shard, picked by hashing
+# its user pair and recorded in Conversation.shard; users and conversations stay on default.
+# e.g. MESSAGE_SHARD_DATABASES=blog_messages_1,blog_messages_2 on the default server, or SQLite
+# file paths. Migrate each shard (migrate --database messages_0) and run rebalance_message_shards
+# after changing the list.
+MESSAGE_SHARDS = ['default']
+for index, name in enumerate(n.strip() for n in os.environ.get('MESSAGE_SHARD_DATABASES', '').split(',') if n.strip()):
+    DATABASES[f'messages_{index}'] = {**DATABASES['default'], 'NAME': name}
+    MESSAGE_SHARDS.append(f'messages_{index}')
+
+DATABASE_ROUTERS = ['blogserviceapp.routers.MessageShardRouter', 'blogserviceapp.routers.ReplicaRouter']
+
+REPLICA_ROUTING = {
+    # How long a client's reads stay on the primary after one of its requests writes.
+    'STICKY_SECONDS': 5,
+    # How long a replica that failed to connect is skipped.
+    'COOLDOWN_SECONDS': 30,
+    'COOKIE': 'db_pin',
 }
 
 
@@ -133,18 +182,129 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# How MEDIA_URL is served. 'file' sends the file from the app through the WSGI server's
+# file wrapper (os.sendfile() under manage.py serve); 'x-accel-redirect' (nginx) and
+# 'x-sendfile' (Apache, lighttpd) answer the request's headers and leave the body to the proxy.
+
+MEDIA_SERVING = {
+    'BACKEND': os.environ.get('MEDIA_SERVING_BACKEND', 'file'),
+    # nginx's internal location aliasing MEDIA_ROOT, for x-accel-redirect.
+    'ACCEL_REDIRECT_PREFIX': '/protected-media/',
+    # Cache lifetime in seconds of media without a content hash in its name; those are immutable.
+    'MAX_AGE': 3600,
+}
+
+# Resized copies of Post.image, generated on the background worker pool.
+# Formats the installed Pillow cannot write are skipped.
+
+POST_IMAGE_VARIANTS = {
+    'thumbnail': {'size': (320, 320), 'format': 'WEBP', 'quality': 75},
+    'medium': {'size': (1280, 1280), 'format': 'WEBP', 'quality': 80},
+    'medium_avif': {'size': (1280, 1280), 'format': 'AVIF', 'quality': 60},
+}
+
+# Limits enforced while a post image is still streaming in (see blogserviceapp.uploads).
+
+POST_IMAGE_UPLOAD = {
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'MAX_PIXELS': 40_000_000,
+    'HEADER_BYTES': 256 * 1024,
+}
+
+# In-process worker pool for work that must not run inside a request.
+# EAGER runs tasks inline after commit, which is what the tests use.
+
+BACKGROUND_TASKS = {
+    'WORKERS': 4,
+    'EAGER': False,
+}
+
+# Rows deleted per transaction when a deleted account's data is removed in the background.
+ACCOUNT_DELETION = {
+    'BATCH_SIZE': 500,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Keyset (cursor) pagination used by the feed and list views
+
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+
+# Categories are kept in memory by every worker and reloaded after TIMEOUT
+# seconds. SHARED_CACHE can name a CACHES alias the workers share (Redis,
+# Memcached) holding the version key that makes them all reload at once after
+# a change; a process-local cache such as the default locmem is refused.
+CATEGORY_CACHE = {
+    'SHARED_CACHE': None,
+    'TIMEOUT': 5,
+}
+
+HOME_TIMELINE = {
+    # Users who have not opened the home page for this long drop out of fan-out.
+    'ACTIVE_DAYS': 14,
+    # Posts copied into a timeline when it is first built or refilled.
+    'BACKFILL': 500,
+    # Authors above this many posts a day are merged in on read instead.
+    'PROLIFIC_POSTS_PER_DAY': 50,
+    'BATCH_SIZE': 1000,
+}
+
+# Server-Timing header, per-route aggregates and query budgets (URL name -> max
+# queries). Over budget logs a warning, or raises when RAISE_ON_BUDGET is set
+# (the test suite sets it).
+REQUEST_METRICS = {
+    'SERVER_TIMING': True,
+    'RAISE_ON_BUDGET': False,
+    'QUERY_BUDGETS': {
+        'index': 12,
+        'search_posts': 6,
+        'searched_user': 6,
+        'request_user': 5,
+        'categories': 5,
+        'posts_by_category': 7,
+        'comments_by_post': 7,
+        'read_message': 10,
+        'inbox': 5,
+        'read_blocked_user': 5,
+    },
+}
+
+# Upper bound on the ids accepted by one bulk block/unblock request.
+BULK_BLOCK_MAX_IDS = 1000
+
+# In-process LRU of per-user block edges, reloaded after TIMEOUT seconds, so a
+# block made in another worker takes at most that long to reach this one. Set
+# SHARED_CACHE to a CACHES alias the workers share (Redis, Memcached) to share
+# the edges and make invalidations reach every worker at once; a process-local
+# cache such as the default locmem is refused.
+BLOCK_GRAPH_CACHE = {
+    'MAX_USERS': 10000,
+    'SHARED_CACHE': None,
+    'TIMEOUT': 5,
+}
+
+# Handlers run on a background listener thread; request threads only enqueue.
+LOGGING_CONFIG = 'blogserviceapp.logpipeline.configure_logging'
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'blogserviceapp.logpipeline.SamplingFilter',
+            # Fraction of INFO-and-below records kept per logger.
+            'rates': {
+                'blogserviceapp.views': 0.1,
+            },
+        },
+    },
     'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {message}',
-            'style': '{',
+        'json': {
+            '()': 'blogserviceapp.logpipeline.JsonFormatter',
         },
         'simple': {
             'format': '{levelname} {message}',
@@ -156,12 +316,14 @@ LOGGING = {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
+            'filters': ['sampling'],
         },
         'file': {
             'level': 'WARNING',
             'class': 'logging.FileHandler',
             'filename': 'django_app.log',
-            'formatter': 'verbose',
+            'formatter': 'json',
+            'filters': ['sampling'],
         },
     },
     'loggers': {
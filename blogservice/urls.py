@@ -14,9 +14,10 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.urls import path
+import re
+
+from django.urls import path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from blogserviceapp.views.AccountViews import (
     SignUpView,
@@ -32,7 +33,8 @@ from blogserviceapp.views.PostViews import (
     posts_by_category_view,
     posts_readed_view,
     posts_by_request_user,
-    posts_by_searched_user
+    posts_by_searched_user,
+    search_posts_view,
 )
 from blogserviceapp.views.CommentViews import (
     AddCommentView,
@@ -44,17 +46,21 @@ from blogserviceapp.views.MessageViews import (
     AddMessageView,
     UpdateMessageView,
     DeleteMessageView,
-    message_to_sender_view
+    message_to_sender_view,
+    inbox_view,
 )
 from blogserviceapp.views.BlockedUserViews import (
     AddBlockedUserView,
     UpdateBlockedUserView,
     DeleteBlockedUserView,
+    BulkBlockUsersView,
+    BulkUnblockUsersView,
     blocked_users_view
 )
 from blogserviceapp.views.CategoryViews import (
     category_view,
 )
+from blogserviceapp.views.MediaViews import media_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -62,6 +68,7 @@ urlpatterns = [
     path('', posts_readed_view, name='index'),
     path('posts_pk/<int:user_pk>', posts_by_searched_user, name='searched_user'),
     path('posts_request/', posts_by_request_user, name='request_user'),
+    path('search/', search_posts_view, name='search_posts'),
 
     path('signup/', SignUpView.as_view(), name='signup'),
     path('login/', CustomLoginView.as_view(), name='login'),
@@ -77,11 +84,14 @@ urlpatterns = [
     path('update-message/<int:user_pk>/', UpdateMessageView.as_view(), name='update_message'),
     path('delete-message/<int:user_pk>/', DeleteMessageView.as_view(), name='delete_message'),
     path('read-message/<int:user_pk>/', message_to_sender_view, name='read_message'),
+    path('inbox/', inbox_view, name='inbox'),
 
     path('add-blocked-user/<int:user_pk>', AddBlockedUserView.as_view(), name='add_blocked_user'),
     path('update-blocked-user/<int:user_pk>', UpdateBlockedUserView.as_view(), name='update_blocked_user'),
     path('delete-blocked-user/<int:user_pk>', DeleteBlockedUserView.as_view(), name='delete_blocked_user'),
     path('read-blocked-user/', blocked_users_view, name='read_blocked_user'),
+    path('bulk-block-users/', BulkBlockUsersView.as_view(), name='bulk_block_users'),
+    path('bulk-unblock-users/', BulkUnblockUsersView.as_view(), name='bulk_unblock_users'),
 
     path('categories/', category_view, name='categories'),
     path('categories/<int:category_pk>/posts/', posts_by_category_view, name='posts_by_category'),
@@ -89,4 +99,7 @@ urlpatterns = [
     path('categories/<int:category_pk>/posts/<int:post_pk>/add-comment/', AddCommentView.as_view(), name='add_comment'),
     path('categories/<int:category_pk>/posts/<int:post_pk>/update-comment/<int:pk>/', UpdateCommentView.as_view(), name='update_comment'),
     path('categories/<int:category_pk>/posts/<int:post_pk>/delete-comment/<int:pk>/', DeleteCommentView.as_view(), name='delete_comment'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+
+    # Served in production too; MEDIA_SERVING picks whether the app or the front proxy sends the file.
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_view, name='media'),
+]
\ No newline at end of file
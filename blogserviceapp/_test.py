@@ -1,7 +1,57 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import queue
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
 import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings as django_settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.core.servers.basehttp import WSGIServer, get_internal_wsgi_application
+from django.db import IntegrityError
+from django.http import HttpResponse
+from django.template.backends.django import Template as DjangoTemplate
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
 from django.contrib.auth.models import User
-from .models import Category, Post, Comment, Message, BlockedUser
+from .models import (
+    Category, Post, Comment, Message, BlockedUser, Conversation, ConversationParticipant, HomeTimeline, TimelineEntry,
+    UserCounters, AccountDeletion,
+)
+from . import blocks
+from .blocks import EMPTY_BLOCK_SETS, BlockGraphCache, get_block_sets, invalidate_blocks, is_blocked_between
+from . import template_registry
+from .timeline import backfill_timeline, fan_out_post
+from .counters import comment_created, post_created
+from .conversations import open_conversation, record_message
+from .sharding import place
+from .accounts import delete_account, request_account_deletion
+from . import categories
+from .categories import CategoryCache, category_cache, get_categories
+from .serializers import PostSerializer
+from .images import generate_post_derivatives
+from .logpipeline import QueueHandler, configure_logging, stop_pipelines
+from .instrumentation import QueryBudgetExceeded, reset_route_stats, route_stats
+from . import routers, tasks
+from .management.commands import serve
+from django.contrib.sessions.models import Session
+from django.db import DatabaseError, connections
 
 @pytest.fixture
 def category(db):
@@ -112,4 +162,1150 @@ def test_blocked_user_creation(user):
         id_user=user
     )
     assert blocked_user.blocked_user == other_user
-    assert blocked_user.id_user == user
\ No newline at end of file
+    assert blocked_user.id_user == user
+
+@pytest.mark.django_db
+def test_index_keyset_pagination(logged_in_client, user, category, settings):
+    settings.FEED_PAGE_SIZE = 2
+    posts = [
+        Post.objects.create(title=f'Post {i}', description='Body', category_id=category, user_id=user)
+        for i in range(5)
+    ]
+
+    response = logged_in_client.get(reverse('index'), {'format': 'json'})
+    data = response.json()
+    assert [p['id'] for p in data['results']] == [posts[4].pk, posts[3].pk]
+    assert data['previous_cursor'] is None
+
+    response = logged_in_client.get(reverse('index'), {'format': 'json', 'cursor': data['next_cursor']})
+    data = response.json()
+    assert [p['id'] for p in data['results']] == [posts[2].pk, posts[1].pk]
+
+    response = logged_in_client.get(reverse('index'), {'format': 'json', 'cursor': data['previous_cursor']})
+    data = response.json()
+    assert [p['id'] for p in data['results']] == [posts[4].pk, posts[3].pk]
+    assert data['previous_cursor'] is None
+
+@pytest.mark.django_db
+def test_comments_pagination_is_chronological(logged_in_client, user, post, category, settings):
+    settings.FEED_PAGE_SIZE = 2
+    comments = [Comment.objects.create(description=f'Comment {i}', post_id=post, user_id=user) for i in range(3)]
+
+    url = reverse('comments_by_post', args=[category.pk, post.pk])
+    data = logged_in_client.get(url, {'format': 'json'}).json()
+    assert [c['id'] for c in data['results']] == [comments[0].pk, comments[1].pk]
+
+    data = logged_in_client.get(url, {'format': 'json', 'cursor': data['next_cursor']}).json()
+    assert [c['id'] for c in data['results']] == [comments[2].pk]
+    assert data['next_cursor'] is None
+
+@pytest.mark.django_db
+def test_invalid_cursor_is_rejected(logged_in_client):
+    response = logged_in_client.get(reverse('index'), {'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+
+@pytest.mark.django_db
+def test_block_graph_cache_serves_both_directions_without_queries(user, django_assert_num_queries):
+    other_user = User.objects.create_user(username='blocker', password='testpassword')
+    BlockedUser.objects.create(id_user=other_user, blocked_user=user)
+    invalidate_blocks(other_user, user)
+
+    assert get_block_sets(user).blocked_by == {other_user.pk}
+    with django_assert_num_queries(0):
+        assert is_blocked_between(user, other_user)
+        assert get_block_sets(user).blocking == set()
+
+    BlockedUser.objects.filter(id_user=other_user).delete()
+    invalidate_blocks(other_user, user)
+    assert not is_blocked_between(user, other_user)
+
+@pytest.mark.django_db
+def test_block_graph_caches_sharing_a_database_see_each_others_blocks(user, settings, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(blocks.time, 'monotonic', lambda: clock[0])
+    other_user = User.objects.create_user(username='blocker', password='testpassword')
+    this_worker, other_worker = BlockGraphCache(timeout=5), BlockGraphCache(timeout=5)
+    assert this_worker.get(user.pk) == EMPTY_BLOCK_SETS
+
+    BlockedUser.objects.create(id_user=other_user, blocked_user=user)
+    other_worker.invalidate(other_user.pk, user.pk)
+    assert this_worker.get(user.pk) == EMPTY_BLOCK_SETS
+    clock[0] += 5
+    assert this_worker.get(user.pk).blocked_by == {other_user.pk}
+
+    # With a shared cache the invalidation reaches the other worker at once.
+    shared = LocMemCache('blockgraph-test', {})
+    this_worker, other_worker = (BlockGraphCache(shared_cache=shared, timeout=5) for _ in range(2))
+    assert this_worker.get(user.pk).blocked_by == {other_user.pk}
+    BlockedUser.objects.all().delete()
+    other_worker.invalidate(other_user.pk, user.pk)
+    assert this_worker.get(user.pk) == EMPTY_BLOCK_SETS
+
+    settings.BLOCK_GRAPH_CACHE = {'SHARED_CACHE': 'default', 'TIMEOUT': 5}
+    with pytest.raises(ImproperlyConfigured):
+        BlockGraphCache.from_settings()
+
+@pytest.mark.django_db
+def test_block_graph_cache_does_not_keep_a_load_an_invalidation_overlapped(user):
+    other_user = User.objects.create_user(username='blocker', password='testpassword')
+    cache = BlockGraphCache()
+    load = cache._load
+
+    def load_then_block(user_id, version):
+        block_sets = load(user_id, version)
+        BlockedUser.objects.create(id_user=other_user, blocked_user=user)
+        cache.invalidate(other_user.pk, user.pk)
+        return block_sets
+
+    cache._load = load_then_block
+    assert cache.get(user.pk) == EMPTY_BLOCK_SETS
+    cache._load = load
+    assert cache.get(user.pk).blocked_by == {other_user.pk}
+
+@pytest.mark.django_db
+def test_blocked_user_cannot_read_messages(logged_in_client, user):
+    other_user = User.objects.create_user(username='blocker', password='testpassword')
+    response = logged_in_client.get(reverse('read_message', args=[other_user.pk]))
+    assert response.status_code == 200
+
+    BlockedUser.objects.create(id_user=other_user, blocked_user=user)
+    invalidate_blocks(other_user, user)
+    response = logged_in_client.get(reverse('read_message', args=[other_user.pk]))
+    assert response.status_code == 403
+
+@pytest.mark.django_db
+def test_visible_to_hides_both_block_directions(user, category):
+    blocked = User.objects.create_user(username='blocked', password='testpassword')
+    blocker = User.objects.create_user(username='blocker', password='testpassword')
+    friend = User.objects.create_user(username='friend', password='testpassword')
+    BlockedUser.objects.create(id_user=user, blocked_user=blocked)
+    BlockedUser.objects.create(id_user=blocker, blocked_user=user)
+    for author in (blocked, blocker, friend):
+        post = Post.objects.create(title='Post', description='Body', category_id=category, user_id=author)
+        Comment.objects.create(description='Comment', post_id=post, user_id=author)
+
+    assert set(Post.objects.visible_to(user).values_list('user_id', flat=True)) == {friend.pk}
+    assert set(Comment.objects.visible_to(user).values_list('user_id', flat=True)) == {friend.pk}
+    Post.objects.create(title='Post', description='Body', category_id=category, user_id=user)
+    assert user.pk not in set(Post.objects.visible_to(blocked).values_list('user_id', flat=True))
+
+@pytest.mark.django_db
+def test_duplicate_block_rows_are_rejected(user):
+    other_user = User.objects.create_user(username='blockeduser', password='testpassword')
+    BlockedUser.objects.create(id_user=user, blocked_user=other_user)
+    with pytest.raises(IntegrityError):
+        BlockedUser.objects.create(id_user=user, blocked_user=other_user)
+
+@pytest.mark.django_db
+def test_explain_views_command(post, user, capsys):
+    call_command('explain_views', 'index', 'posts_by_category', 'comments_by_post')
+    output = capsys.readouterr().out
+    assert 'index' in output and 'comments_by_post' in output
+
+    # With a materialized timeline the feed is read from its entries, and messages by conversation.
+    HomeTimeline.objects.create(user=user, active_at=timezone.now(), backfilled_at=timezone.now())
+    open_conversation(user, User.objects.create_user(username='other', password='pw'))
+    call_command('explain_views', 'index', 'read_message', '--user', str(user.pk))
+    output = capsys.readouterr().out
+    assert 'timelineentry' in output.lower()
+    assert 'conversation' in output.lower()
+
+def test_template_registry_reports_missing_templates(monkeypatch):
+    assert template_registry.find_template_errors() == []
+
+    monkeypatch.setattr(template_registry, 'REQUIRED_TEMPLATES', ('read_posts.html', 'missing.html'))
+    errors = template_registry.find_template_errors()
+    assert [error.id for error in errors] == ['blogserviceapp.E001']
+    assert 'missing.html' in errors[0].msg
+
+@pytest.mark.django_db
+def test_sending_messages_maintains_conversation_and_inbox(logged_in_client, client, user):
+    other_user = User.objects.create_user(username='recipient', password='testpassword')
+    for text in ('Hello', 'Are you there?'):
+        response = logged_in_client.post(reverse('add_message', args=[other_user.pk]), {'description': text})
+        assert response.status_code == 201
+
+    conversation = Conversation.objects.get()
+    assert (conversation.user_low_id, conversation.user_high_id) == tuple(sorted((user.pk, other_user.pk)))
+    assert conversation.message_count == 2
+    assert conversation.last_message.description == 'Are you there?'
+
+    client.login(username='recipient', password='testpassword')
+    inbox = client.get(reverse('inbox'), {'format': 'json'}).json()['results']
+    assert [(c['other_user']['id'], c['unread_count']) for c in inbox] == [(user.pk, 2)]
+
+    messages = client.get(reverse('read_message', args=[user.pk]), {'format': 'json'}).json()['results']
+    assert [m['description'] for m in messages] == ['Are you there?', 'Hello']
+    assert ConversationParticipant.objects.get(user=other_user).unread_count == 0
+
+@pytest.mark.django_db
+def test_inbox_leaves_out_conversations_blocked_in_either_direction(logged_in_client, user):
+    blocked, blocker, friend = (User.objects.create_user(username=name, password='pw') for name in ('blocked', 'blocker', 'friend'))
+    for other in (blocked, blocker, friend):
+        conversation = open_conversation(other, user)
+        message = Message.objects.create(author=other, description='Hi', conversation=conversation)
+        message.sender.set([user])
+        record_message(message, user)
+    BlockedUser.objects.create(id_user=user, blocked_user=blocked)
+    BlockedUser.objects.create(id_user=blocker, blocked_user=user)
+
+    inbox = logged_in_client.get(reverse('inbox'), {'format': 'json'}).json()['results']
+    assert [c['other_user']['id'] for c in inbox] == [friend.pk]
+
+@pytest.mark.django_db
+def test_search_posts_ranks_matches_and_respects_blocks(logged_in_client, user, category, settings):
+    settings.FEED_PAGE_SIZE = 1
+    blocked = User.objects.create_user(username='blocked', password='testpassword')
+    BlockedUser.objects.create(id_user=user, blocked_user=blocked)
+    title_hit = Post.objects.create(title='Sourdough baking', description='Flour and water', category_id=category, user_id=user)
+    body_hit = Post.objects.create(title='Weekend', description='Some sourdough experiments', category_id=category, user_id=user)
+    Post.objects.create(title='Sourdough from a blocked user', description='', category_id=category, user_id=blocked)
+    Post.objects.create(title='Gardening', description='Tomatoes', category_id=category, user_id=user)
+
+    data = logged_in_client.get(reverse('search_posts'), {'q': 'sourdough', 'format': 'json'}).json()
+    assert [p['id'] for p in data['results']] == [title_hit.pk]
+
+    data = logged_in_client.get(reverse('search_posts'), {'q': 'sourdough', 'format': 'json', 'cursor': data['next_cursor']}).json()
+    assert [p['id'] for p in data['results']] == [body_hit.pk]
+    assert data['next_cursor'] is None
+
+    body_hit.title = 'Sourdough weekend'
+    body_hit.save()
+    Post.objects.filter(pk=title_hit.pk).delete()
+    response = logged_in_client.get(reverse('search_posts'), {'q': 'weekend sourdough'})
+    assert list(response.context['posts']) == [body_hit]
+
+def make_image_upload(name='photo.png', size=(1600, 1200), image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffer, format=image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{image_format.lower()}')
+
+@pytest.mark.django_db
+def test_add_post_generates_image_variants_after_commit(logged_in_client, category, settings, tmp_path, django_capture_on_commit_callbacks):
+    settings.MEDIA_ROOT = tmp_path
+    settings.BACKGROUND_TASKS = {'WORKERS': 1, 'EAGER': True}
+
+    with django_capture_on_commit_callbacks(execute=False) as callbacks:
+        response = logged_in_client.post(reverse('add_post'), {
+            'title': 'Sunset', 'description': 'Orange sky', 'category_id': category.pk, 'image': make_image_upload(),
+        })
+    assert response.status_code == 201
+    post = Post.objects.get()
+    assert post.image_variants == {}
+    assert post.image_url() == post.image.url
+
+    for callback in callbacks:
+        callback()
+    post.refresh_from_db()
+    assert set(post.image_variants) == set(settings.POST_IMAGE_VARIANTS)
+    with Image.open(tmp_path / post.image_variants['thumbnail']) as thumbnail:
+        assert thumbnail.format == 'WEBP'
+        assert max(thumbnail.size) == 320
+    assert post.image_url('thumbnail').endswith('.thumbnail.webp')
+
+    # Resizing a variant gives it a new name rather than reusing the old, immutable one.
+    old_variants = post.image_variants
+    settings.POST_IMAGE_VARIANTS = {**settings.POST_IMAGE_VARIANTS, 'thumbnail': {'size': (160, 160), 'format': 'WEBP'}}
+    generate_post_derivatives(post.pk)
+    post.refresh_from_db()
+    assert post.image_variants['thumbnail'] != old_variants['thumbnail']
+    assert post.image_variants['medium'] == old_variants['medium']
+    assert not (tmp_path / old_variants['thumbnail']).exists()
+    with Image.open(tmp_path / post.image_variants['thumbnail']) as thumbnail:
+        assert max(thumbnail.size) == 160
+
+    # A new image drops the old image's variants, and their files once the update commits.
+    old_variants = post.image_variants
+    with django_capture_on_commit_callbacks(execute=True):
+        response = logged_in_client.patch(
+            reverse('update_post', args=[post.pk]),
+            encode_multipart(BOUNDARY, {'image': make_image_upload(name='dawn.png')}),
+            content_type=MULTIPART_CONTENT,
+        )
+    assert response.status_code == 200
+    post.refresh_from_db()
+    assert set(post.image_variants) == set(settings.POST_IMAGE_VARIANTS)
+    assert not set(post.image_variants.values()) & set(old_variants.values())
+    assert not any((tmp_path / path).exists() for path in old_variants.values())
+    assert all((tmp_path / path).exists() for path in post.image_variants.values())
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('upload, limits, status_code', [
+    (SimpleUploadedFile('notes.png', b'#!/bin/sh\necho not an image\n' * 10), {}, 415),
+    (make_image_upload(size=(3000, 3000)), {'MAX_PIXELS': 1_000_000}, 413),
+    (make_image_upload(size=(800, 800), image_format='WEBP'), {'MAX_PIXELS': 100_000}, 413),
+    (make_image_upload(size=(800, 800), image_format='JPEG'), {'MAX_BYTES': 1024}, 413),
+])
+def test_add_post_rejects_uploads_while_streaming(logged_in_client, category, settings, tmp_path, upload, limits, status_code):
+    settings.MEDIA_ROOT = tmp_path
+    settings.POST_IMAGE_UPLOAD = {**settings.POST_IMAGE_UPLOAD, **limits}
+    response = logged_in_client.post(reverse('add_post'), {
+        'title': 'Upload', 'description': 'Body', 'category_id': category.pk, 'image': upload,
+    })
+    assert response.status_code == status_code
+    assert not Post.objects.exists()
+
+
+@pytest.fixture
+def logged_in_async_client(async_client, logged_in_client):
+    async_client.cookies = logged_in_client.cookies
+    return async_client
+
+@async_to_sync
+async def async_get(client, path, data=None):
+    return await client.get(path, data)
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.urls('blogservice.asgi_urls')
+def test_async_read_views_match_sync(logged_in_async_client, logged_in_client, user, post, category):
+    other = User.objects.create_user(username='other', password='pw')
+    Comment.objects.create(description='Async comment', post_id=post, user_id=user)
+    paths = [
+        reverse('index'),
+        reverse('categories'),
+        reverse('posts_by_category', args=[category.pk]),
+        reverse('comments_by_post', args=[category.pk, post.pk]),
+        reverse('read_message', args=[other.pk]),
+    ]
+    for path in paths:
+        async_response = async_get(logged_in_async_client, path, {'format': 'json'})
+        sync_response = logged_in_client.get(path, {'format': 'json'})
+        assert async_response.status_code == sync_response.status_code == 200
+        assert async_response.content == sync_response.content
+    response = async_get(logged_in_async_client, reverse('posts_by_category', args=[category.pk]))
+    assert re.search(rb'\(\d+ comments?\)', response.content)
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.urls('blogservice.asgi_urls')
+def test_async_read_views_respect_blocks_and_missing_objects(logged_in_async_client, user, category):
+    blocker = User.objects.create_user(username='blocker', password='pw')
+    Post.objects.create(title='Hidden', description='', category_id=category, user_id=blocker)
+    BlockedUser.objects.create(id_user=blocker, blocked_user=user)
+
+    response = async_get(logged_in_async_client, reverse('index'), {'format': 'json'})
+    assert response.json()['results'] == []
+    response = async_get(logged_in_async_client, reverse('read_message', args=[blocker.pk]))
+    assert response.status_code == 403
+    response = async_get(logged_in_async_client, reverse('posts_by_category', args=[category.pk + 100]))
+    assert response.status_code == 404
+
+@pytest.mark.django_db
+def test_bulk_block_and_unblock_report_per_id_results(logged_in_client, user):
+    first = User.objects.create_user(username='first', password='pw')
+    second = User.objects.create_user(username='second', password='pw')
+    BlockedUser.objects.create(id_user=user, blocked_user=second)
+    get_block_sets(user)
+
+    response = logged_in_client.post(
+        reverse('bulk_block_users'),
+        {'user_ids': [first.pk, second.pk, user.pk, 999999, first.pk]},
+        content_type='application/json',
+    )
+    assert response.status_code == 200
+    assert response.json()['results'] == [
+        {'user_id': first.pk, 'status': 'blocked'},
+        {'user_id': second.pk, 'status': 'already_blocked'},
+        {'user_id': user.pk, 'status': 'self'},
+        {'user_id': 999999, 'status': 'not_found'},
+    ]
+    assert BlockedUser.objects.filter(id_user=user).count() == 2
+    assert is_blocked_between(user, first)
+
+    response = logged_in_client.post(
+        reverse('bulk_unblock_users'),
+        {'user_ids': [first.pk, second.pk, user.pk, 999999]},
+        content_type='application/json',
+    )
+    assert response.json()['results'] == [
+        {'user_id': first.pk, 'status': 'unblocked'},
+        {'user_id': second.pk, 'status': 'unblocked'},
+        {'user_id': user.pk, 'status': 'not_blocked'},
+        {'user_id': 999999, 'status': 'not_found'},
+    ]
+    assert not BlockedUser.objects.filter(id_user=user).exists()
+    assert not is_blocked_between(user, first)
+
+@pytest.mark.django_db
+def test_add_blocked_user_blocks_once_and_invalidates_the_block_cache(logged_in_client, user):
+    other = User.objects.create_user(username='other', password='pw')
+    assert get_block_sets(user).blocking == frozenset()
+    assert get_block_sets(other).blocked_by == frozenset()
+
+    response = logged_in_client.post(reverse('add_blocked_user', args=[other.pk]))
+    assert response.status_code == 201
+    assert BlockedUser.objects.filter(id_user=user, blocked_user=other).exists()
+    assert get_block_sets(user).blocking == {other.pk}
+    assert get_block_sets(other).blocked_by == {user.pk}
+
+    response = logged_in_client.post(reverse('add_blocked_user', args=[other.pk]))
+    assert response.status_code == 400
+    assert BlockedUser.objects.filter(id_user=user).count() == 1
+
+@pytest.mark.django_db
+def test_bulk_block_rejects_empty_and_oversized_lists(logged_in_client):
+    response = logged_in_client.post(reverse('bulk_block_users'), {'user_ids': []}, content_type='application/json')
+    assert response.status_code == 400
+    response = logged_in_client.post(
+        reverse('bulk_block_users'), {'user_ids': list(range(1, 1003))}, content_type='application/json'
+    )
+    assert response.status_code == 400
+
+
+def _home_feed_ids(client, **params):
+    response = client.get(reverse('index'), {'format': 'json', **params})
+    assert response.status_code == 200
+    return [item['id'] for item in response.json()['results']], response.json()['next_cursor']
+
+@pytest.mark.django_db
+def test_home_timeline_is_built_on_first_visit_and_filled_on_write(logged_in_client, user, category, settings, django_capture_on_commit_callbacks):
+    settings.BACKGROUND_TASKS = {'WORKERS': 1, 'EAGER': True}
+    author = User.objects.create_user(username='author', password='pw')
+    old = Post.objects.create(title='Old', description='', category_id=category, user_id=author)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert _home_feed_ids(logged_in_client)[0] == [old.pk]
+    timeline = HomeTimeline.objects.get(user=user)
+    assert timeline.backfilled_at is not None
+    assert TimelineEntry.objects.filter(user=user, post=old).exists()
+
+    new = Post.objects.create(title='New', description='', category_id=category, user_id=author)
+    assert _home_feed_ids(logged_in_client)[0] == [new.pk, old.pk]
+    fan_out_post(new.pk)
+    new.refresh_from_db()
+    assert new.fanned_out
+    assert TimelineEntry.objects.filter(user=user, post=new, author=author).exists()
+    assert _home_feed_ids(logged_in_client)[0] == [new.pk, old.pk]
+
+@pytest.mark.django_db
+def test_home_timeline_merges_prolific_authors_on_read(logged_in_client, user, category, settings):
+    settings.HOME_TIMELINE = {**settings.HOME_TIMELINE, 'PROLIFIC_POSTS_PER_DAY': 1}
+    author = User.objects.create_user(username='author', password='pw')
+    HomeTimeline.objects.create(user=user, active_at=timezone.now())
+    backfill_timeline(user.pk)
+
+    posts = []
+    for i in range(3):
+        posts.append(Post.objects.create(title=f'Post {i}', description='', category_id=category, user_id=author))
+        fan_out_post(posts[-1].pk)
+    assert TimelineEntry.objects.filter(user=user).count() == 1
+    assert Post.objects.filter(fanned_out=False).count() == 2
+
+    seen, cursor = _home_feed_ids(logged_in_client, page_size=1)
+    while cursor:
+        ids, cursor = _home_feed_ids(logged_in_client, page_size=1, cursor=cursor)
+        seen += ids
+    assert seen == [post.pk for post in reversed(posts)]
+
+@pytest.mark.django_db
+def test_blocking_prunes_home_timeline_entries(logged_in_client, user, category, settings, django_capture_on_commit_callbacks):
+    settings.BACKGROUND_TASKS = {'WORKERS': 1, 'EAGER': True}
+    author = User.objects.create_user(username='author', password='pw')
+    post = Post.objects.create(title='Post', description='', category_id=category, user_id=author)
+    HomeTimeline.objects.create(user=user, active_at=timezone.now())
+    backfill_timeline(user.pk)
+    assert TimelineEntry.objects.filter(user=user, author=author).exists()
+
+    logged_in_client.post(reverse('bulk_block_users'), {'user_ids': [author.pk]}, content_type='application/json')
+    assert not TimelineEntry.objects.filter(user=user, author=author).exists()
+    assert _home_feed_ids(logged_in_client)[0] == []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        logged_in_client.post(reverse('bulk_unblock_users'), {'user_ids': [author.pk]}, content_type='application/json')
+    assert _home_feed_ids(logged_in_client)[0] == [post.pk]
+
+@pytest.mark.django_db
+def test_category_listing_answers_304_until_a_post_changes(logged_in_client, user, category, django_assert_max_num_queries):
+    url = reverse('posts_by_category', args=[category.pk])
+    response = logged_in_client.get(url)
+    assert response.status_code == 200
+    etag = response['ETag']
+
+    with django_assert_max_num_queries(3):
+        response = logged_in_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    Post.objects.create(title='New', description='', category_id=category, user_id=user)
+    response = logged_in_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+    # The listing differs per viewer and page, so a date alone never revalidates it.
+    assert not response.has_header('Last-Modified')
+    assert logged_in_client.get(url, HTTP_IF_MODIFIED_SINCE=http_date()).status_code == 200
+
+@pytest.mark.django_db
+def test_listing_etag_depends_on_viewer_blocks_and_format(logged_in_client, user, post, category):
+    url = reverse('comments_by_post', args=[category.pk, post.pk])
+    etag = logged_in_client.get(url)['ETag']
+    assert logged_in_client.get(url, {'format': 'json'})['ETag'] != etag
+
+    other = User.objects.create_user(username='other', password='pw')
+    BlockedUser.objects.create(id_user=user, blocked_user=other)
+    invalidate_blocks(user, other)
+    assert logged_in_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+@pytest.mark.django_db
+def test_block_made_in_another_worker_changes_the_listing_etag(logged_in_client, user, post, category, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(blocks.time, 'monotonic', lambda: clock[0])
+    this_worker, other_worker = BlockGraphCache(timeout=5), BlockGraphCache(timeout=5)
+    url = reverse('comments_by_post', args=[category.pk, post.pk])
+    monkeypatch.setattr(blocks, '_block_graph', this_worker)
+    etag = logged_in_client.get(url)['ETag']
+
+    monkeypatch.setattr(blocks, '_block_graph', other_worker)
+    other = User.objects.create_user(username='other', password='pw')
+    response = logged_in_client.post(reverse('bulk_block_users'), {'user_ids': [other.pk]}, content_type='application/json')
+    assert response.status_code == 200
+
+    monkeypatch.setattr(blocks, '_block_graph', this_worker)
+    clock[0] += 5
+    response = logged_in_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+@pytest.mark.django_db
+def test_comment_and_category_changes_bump_their_listings(logged_in_client, user, post, category):
+    comments_url = reverse('comments_by_post', args=[category.pk, post.pk])
+    comments_etag = logged_in_client.get(comments_url)['ETag']
+    categories_etag = logged_in_client.get(reverse('categories'))['ETag']
+
+    Comment.objects.create(description='New', post_id=post, user_id=user)
+    Category.objects.create(name='Another')
+    assert logged_in_client.get(comments_url, HTTP_IF_NONE_MATCH=comments_etag).status_code == 200
+    assert logged_in_client.get(reverse('categories'), HTTP_IF_NONE_MATCH=categories_etag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_category_cache_serves_from_memory_until_a_category_changes(category, django_assert_num_queries):
+    assert [c.pk for c in get_categories()] == [category.pk]
+    with django_assert_num_queries(0):
+        assert category_cache().get(category.pk).name == 'Test Category'
+
+    other = Category.objects.create(name='Other')
+    assert [c.pk for c in get_categories()] == [category.pk, other.pk]
+    other.delete()
+    assert category_cache().get(other.pk) is None
+
+@pytest.mark.django_db
+def test_category_cache_expires_and_looks_up_unknown_pks(category, settings, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(categories.time, 'monotonic', lambda: clock[0])
+    cache = CategoryCache(timeout=5)
+    assert [c.pk for c in cache.all()] == [category.pk]
+
+    # Changes made by another worker send no signal to this one.
+    Category.objects.filter(pk=category.pk).update(name='Renamed')
+    assert cache.get(category.pk).name == 'Test Category'
+    clock[0] += 5
+    assert cache.get(category.pk).name == 'Renamed'
+    [other] = Category.objects.bulk_create([Category(name='Other')])
+    assert cache.get(other.pk) == other
+
+    settings.CATEGORY_CACHE = {'SHARED_CACHE': 'default', 'TIMEOUT': 5}
+    with pytest.raises(ImproperlyConfigured):
+        CategoryCache.from_settings()
+
+def test_post_in_a_category_another_worker_deleted_is_rejected(logged_in_client, transactional_db, settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    settings.BACKGROUND_TASKS = {'WORKERS': 1, 'EAGER': True}
+    category, doomed = Category.objects.create(name='Kept'), Category.objects.create(name='Doomed')
+    get_categories()
+    # A raw delete sends no signal, as if another worker had deleted it.
+    Category.objects.filter(pk=doomed.pk)._raw_delete('default')
+
+    response = logged_in_client.post(reverse('add_post'), {
+        'title': 'T', 'description': 'D', 'category_id': doomed.pk, 'image': make_image_upload(),
+    })
+    assert response.status_code == 400
+    assert 'category_id' in response.json()
+    assert not Post.objects.exists()
+    assert category_cache().get(doomed.pk) is None
+    response = logged_in_client.post(reverse('add_post'), {
+        'title': 'T', 'description': 'D', 'category_id': category.pk, 'image': make_image_upload(),
+    })
+    assert response.status_code == 201
+
+@pytest.mark.django_db
+def test_post_serializer_validates_category_from_cache(category, django_assert_num_queries):
+    get_categories()
+    field = PostSerializer().fields['category_id']
+    with django_assert_num_queries(0):
+        assert field.run_validation(category.pk) == category
+
+    serializer = PostSerializer(data={'title': 'T', 'description': 'D', 'category_id': category.pk + 1})
+    assert not serializer.is_valid()
+    assert 'category_id' in serializer.errors
+
+
+@pytest.mark.django_db
+def test_counters_follow_post_and_comment_views(logged_in_client, user, category, settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    response = logged_in_client.post(reverse('add_post'), {
+        'title': 'Counted', 'description': 'D', 'category_id': category.pk, 'image': make_image_upload(),
+    })
+    assert response.status_code == 201
+    post = Post.objects.get(title='Counted')
+    url_kwargs = {'category_pk': category.pk, 'post_pk': post.pk}
+    logged_in_client.post(reverse('add_comment', kwargs=url_kwargs), {'description': 'First'})
+    logged_in_client.post(reverse('add_comment', kwargs=url_kwargs), {'description': 'Second'})
+
+    post.refresh_from_db()
+    category.refresh_from_db()
+    assert (category.post_count, post.comment_count) == (1, 2)
+    assert UserCounters.objects.filter(user=user, post_count=1, comment_count=2).exists()
+
+    comment = Comment.objects.filter(post_id=post).first()
+    logged_in_client.delete(reverse('delete_comment', kwargs={**url_kwargs, 'pk': comment.pk}))
+    post.refresh_from_db()
+    assert post.comment_count == 1
+
+    logged_in_client.delete(reverse('delete_post', args=[post.pk]))
+    category.refresh_from_db()
+    assert category.post_count == 0
+    assert UserCounters.objects.filter(user=user, post_count=0, comment_count=0).exists()
+
+@pytest.mark.django_db
+def test_reconcile_counters_fixes_drift(user, post):
+    Comment.objects.create(description='Unseen', post_id=post, user_id=user)
+    Category.objects.filter(pk=post.category_id_id).update(post_count=7)
+
+    out = io.StringIO()
+    call_command('reconcile_counters', '--dry-run', stdout=out)
+    assert 'Post.comment_count: would fix 1 rows.' in out.getvalue()
+    post.refresh_from_db()
+    assert post.comment_count == 0
+
+    call_command('reconcile_counters', '--batch-size', '1', stdout=io.StringIO())
+    post.refresh_from_db()
+    assert post.comment_count == 1
+    assert Category.objects.get(pk=post.category_id_id).post_count == 1
+    assert UserCounters.objects.filter(user=user, post_count=1, comment_count=1).exists()
+
+
+def test_logging_pipeline_samples_and_writes_json_from_the_listener(tmp_path, settings):
+    path = tmp_path / 'app.log'
+    config = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'filters': {'sampling': {'()': 'blogserviceapp.logpipeline.SamplingFilter', 'rates': {'pipeline.noisy': 0}}},
+        'formatters': {'json': {'()': 'blogserviceapp.logpipeline.JsonFormatter'}},
+        'handlers': {
+            'file': {'class': 'logging.FileHandler', 'filename': str(path), 'formatter': 'json', 'filters': ['sampling']},
+        },
+        'loggers': {'pipeline': {'handlers': ['file'], 'level': 'INFO', 'propagate': False}},
+    }
+    try:
+        configure_logging(config)
+        handler, = logging.getLogger('pipeline').handlers
+        assert isinstance(handler, QueueHandler)
+        assert handler.filters
+
+        logging.getLogger('pipeline.noisy').info('dropped %s', 1)
+        logging.getLogger('pipeline.noisy').warning('kept %s', 2)
+        logging.getLogger('pipeline').info('hello %s', 'world')
+        stop_pipelines()
+
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [(line['level'], line['message']) for line in lines] == [('WARNING', 'kept 2'), ('INFO', 'hello world')]
+    finally:
+        configure_logging(settings.LOGGING)
+
+def test_queue_handler_drops_instead_of_blocking_when_full():
+    handler = QueueHandler(queue.Queue(1))
+    record = logging.LogRecord('pipeline', logging.INFO, __file__, 1, 'message %s', ('arg',), None)
+    handler.handle(record)
+    handler.handle(record)
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().msg == 'message arg'
+
+
+@pytest.mark.django_db
+def test_request_metrics_header_and_route_aggregates(logged_in_client, post, category, monkeypatch):
+    reset_route_stats()
+    response = logged_in_client.get(reverse('posts_by_category', args=[category.pk]))
+    timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+    assert set(timing) == {'db', 'tpl', 'view', 'total'}
+    assert 'queries' in timing['db']
+
+    logged_in_client.get(reverse('posts_by_category', args=[category.pk]), {'format': 'json'})
+    stats = route_stats()['posts_by_category']
+    assert stats['requests'] == 2
+    assert 0 < stats['max_queries'] <= 7
+
+    # The view's time leaves out the DB and template time spent inside it.
+    render = DjangoTemplate.render
+    monkeypatch.setattr(DjangoTemplate, 'render', lambda *args: time.sleep(0.05) or render(*args))
+    response = logged_in_client.get(reverse('posts_by_category', args=[category.pk]))
+    timing = {
+        name: float(value.split(';')[0].split('=')[1])
+        for name, value in (part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+    }
+    assert timing['tpl'] >= 50
+    assert timing['view'] + timing['tpl'] + timing['db'] <= timing['total'] + 0.2
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.urls('blogservice.asgi_urls')
+def test_request_metrics_stay_async_under_asgi(logged_in_async_client, category, settings, caplog):
+    settings.DEBUG = True  # adapted handlers are only logged in debug
+    with caplog.at_level(logging.DEBUG, logger='django.request'):
+        ASGIHandler().load_middleware(is_async=True)
+    assert not [r for r in caplog.records if 'blogserviceapp' in r.getMessage()]
+
+    reset_route_stats()
+    response = async_get(logged_in_async_client, reverse('categories'))
+    timing = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+    assert float(timing['tpl'].split('=')[1]) > 0
+    # The queries run in a worker thread under the async view still count.
+    assert route_stats()['categories']['max_queries'] > 0
+
+@pytest.mark.django_db
+def test_query_budget_raises_in_tests_and_warns_otherwise(logged_in_client, settings, caplog):
+    settings.REQUEST_METRICS = {**settings.REQUEST_METRICS, 'QUERY_BUDGETS': {'categories': 0}}
+    with pytest.raises(QueryBudgetExceeded):
+        logged_in_client.get(reverse('categories'))
+
+    settings.REQUEST_METRICS = {**settings.REQUEST_METRICS, 'RAISE_ON_BUDGET': False}
+    logger = logging.getLogger('blogserviceapp.instrumentation')
+    logger.addHandler(caplog.handler)
+    try:
+        assert logged_in_client.get(reverse('categories')).status_code == 200
+    finally:
+        logger.removeHandler(caplog.handler)
+    assert 'over its budget of 0' in caplog.text
+
+@pytest.mark.django_db(transaction=True)
+def test_benchmark_command_reports_latency_per_app_and_mix(user, post):
+    User.objects.create_user(username='peer', password='pw')
+    out = io.StringIO()
+    call_command(
+        'benchmark', '--app', 'wsgi', 'asgi', '--mix', 'feed', 'messaging', 'commenting',
+        '--concurrency', '1', '--requests', '6', '--warmup', '0', '--username', 'testuser', stdout=out,
+    )
+    report = json.loads(out.getvalue())
+    runs = {(run['app'], run['mix']): run for run in report['runs']}
+    assert len(runs) == 6
+    for run in runs.values():
+        assert run['requests'] == 6 and run['errors'] == 0
+        assert run['rps'] > 0
+        assert run['latency_ms']['p50'] <= run['latency_ms']['p95'] <= run['latency_ms']['p99']
+    assert runs['wsgi', 'messaging']['routes'].keys() <= {'inbox', 'read_message', 'add_message'}
+    assert report['environment']['username'] == 'testuser'
+
+@pytest.mark.django_db
+def test_seed_command_is_reproducible_and_keeps_denormalized_columns_exact(monkeypatch):
+    options = ['--users', '30', '--categories', '3', '--posts', '200', '--comments', '500',
+               '--conversations', '20', '--messages', '120', '--seed', '5']
+    call_command('seed', *options, '--prefix', 'a', stdout=io.StringIO())
+    reset = []
+    sequence_reset_sql = connections['default'].ops.sequence_reset_sql
+    monkeypatch.setattr(connections['default'].ops, 'sequence_reset_sql',
+                        lambda style, models: reset.extend(models) or sequence_reset_sql(style, models))
+    call_command('seed', *options, '--prefix', 'b', '--method', 'bulk', stdout=io.StringIO())
+    assert {User, Post, Message, Conversation} <= set(reset)
+    assert User.objects.filter(username__startswith='a5-').count() == 30
+    first = Post.objects.filter(user_id__username__startswith='a5-').order_by('pk')
+    second = Post.objects.filter(user_id__username__startswith='b5-').order_by('pk')
+    assert list(first.values_list('title', 'comment_count')) == list(second.values_list('title', 'comment_count'))
+    assert Message.objects.count() == 240
+    for conversation in Conversation.objects.all():
+        messages = Message.objects.filter(conversation=conversation).order_by('send_data', 'id')
+        assert conversation.message_count == messages.count()
+        assert conversation.last_message_id == messages.last().pk
+
+    out = io.StringIO()
+    call_command('reconcile_counters', '--dry-run', stdout=out)
+    assert out.getvalue().count('would fix 0 rows') == 3
+
+    # Rows created the usual way after seeding take ids after the seeded ones.
+    user = User.objects.create_user(username='after-seed', password='pw')
+    post = Post.objects.create(title='After', description='', category_id=Category.objects.first(), user_id=user)
+    assert post.pk > Post.objects.exclude(pk=post.pk).order_by('-pk').values_list('pk', flat=True).first()
+
+
+def seed_account(user, category):
+    other = User.objects.create_user(username='other', password='pw')
+    own_post = Post.objects.create(title='Mine', description='', category_id=category, user_id=user)
+    other_post = Post.objects.create(title='Theirs', description='', category_id=category, user_id=other)
+    post_created(own_post)
+    post_created(other_post)
+    for author, target in [(user, other_post), (other, own_post), (user, own_post)]:
+        comment_created(Comment.objects.create(description='C', post_id=target, user_id=author))
+    conversation = open_conversation(user, other)
+    for author, recipient in [(user, other), (other, user)]:
+        message = Message.objects.create(author=author, description='M', conversation=conversation)
+        message.sender.set([recipient])
+        record_message(message, recipient)
+    BlockedUser.objects.create(id_user=other, blocked_user=User.objects.create_user(username='third', password='pw'))
+    BlockedUser.objects.create(id_user=user, blocked_user=User.objects.get(username='third'))
+    return other, own_post, other_post
+
+@pytest.mark.django_db
+def test_account_deletion_hides_content_at_once_and_deletes_it_in_batches(
+    logged_in_client, user, category, settings, django_capture_on_commit_callbacks,
+):
+    settings.BACKGROUND_TASKS = {'WORKERS': 1, 'EAGER': True}
+    settings.ACCOUNT_DELETION = {'BATCH_SIZE': 1}
+    other, own_post, other_post = seed_account(user, category)
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        response = logged_in_client.post(reverse('delete_account'))
+    assert response.status_code == 302 and response.url == reverse('login')
+    assert not User.objects.get(pk=user.pk).is_active
+    assert list(Post.objects.visible_to(other)) == [other_post]
+    assert list(Comment.objects.visible_to(other).values_list('user_id', flat=True)) == [other.pk]
+    assert not Message.objects.visible_to(other).filter(author=user).exists()
+    assert Post.objects.filter(user_id=user).exists()
+
+    for callback in callbacks:
+        callback()
+    deletion = AccountDeletion.objects.get(pk=user.pk)
+    assert deletion.step == 'done' and deletion.completed_at is not None and deletion.deleted_rows > 0
+    assert not User.objects.filter(pk=user.pk).exists()
+    assert not Conversation.objects.exists() and not Message.objects.exists()
+    assert list(BlockedUser.objects.values_list('id_user', flat=True)) == [other.pk]
+    assert list(Post.objects.all()) == [other_post]
+    other_post.refresh_from_db()
+    category.refresh_from_db()
+    assert (other_post.comment_count, category.post_count) == (0, 1)
+    assert UserCounters.objects.filter(user=other, post_count=1, comment_count=0).exists()
+
+@pytest.mark.django_db
+def test_account_deletion_invalidates_the_listings_showing_the_account(
+    client, user, category, settings, django_capture_on_commit_callbacks,
+):
+    settings.BACKGROUND_TASKS = {'WORKERS': 1, 'EAGER': True}
+    other, own_post, other_post = seed_account(user, category)
+    client.login(username='other', password='pw')
+    posts_url = reverse('posts_by_category', args=[category.pk])
+    comments_url = reverse('comments_by_post', args=[category.pk, other_post.pk])
+    etags = {url: client.get(url, {'format': 'json'})['ETag'] for url in (posts_url, comments_url)}
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        request_account_deletion(user)
+    responses = {url: client.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=etags[url]) for url in etags}
+    assert [response.status_code for response in responses.values()] == [200, 200]
+    assert [post['title'] for post in responses[posts_url].json()['results']] == ['Theirs']
+    assert [comment['user_id'] for comment in responses[comments_url].json()['results']] == []
+
+    etags = {url: response['ETag'] for url, response in responses.items()}
+    for callback in callbacks:
+        callback()
+    for url, etag in etags.items():
+        assert client.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+@pytest.mark.django_db
+def test_process_account_deletions_resumes_from_the_recorded_step(user, category):
+    other, own_post, other_post = seed_account(user, category)
+    # As if a worker had died during the comments step.
+    AccountDeletion.objects.create(user=user, step='comments')
+    Comment.objects.filter(user_id=user, post_id=other_post).delete()
+
+    out = io.StringIO()
+    call_command('process_account_deletions', '--status', stdout=out)
+    assert 'step comments' in out.getvalue()
+    call_command('process_account_deletions', '--batch-size', '1', stdout=out)
+    assert f'Account {user.pk} deleted' in out.getvalue()
+    assert not User.objects.filter(pk=user.pk).exists()
+    assert not Post.objects.filter(pk=own_post.pk).exists()
+    assert not Comment.objects.filter(user_id=other).exists()
+    assert AccountDeletion.objects.get(pk=user.pk).completed_at is not None
+
+
+class FakeReplica:
+    in_atomic_block = False
+    down = False
+
+    def ensure_connection(self):
+        if self.down:
+            raise DatabaseError("replica unreachable")
+
+@pytest.mark.django_db
+def test_replica_router_spreads_requests_and_pins_reads_after_writes(settings, rf, monkeypatch):
+    settings.DATABASE_REPLICAS = ['replica_a', 'replica_b']
+    replicas = {'replica_a': FakeReplica(), 'replica_b': FakeReplica()}
+    # The test's own transaction would otherwise keep every read on the primary.
+    primary = type('Primary', (), {'in_atomic_block': False})
+    replicas['default'] = primary()
+    monkeypatch.setattr(routers, 'connections', replicas)
+    router = routers.ReplicaRouter()
+    reads = []
+
+    def view(request):
+        reads.append(router.db_for_read(Post))
+        if request.method == 'POST':
+            Category.objects.create(name='Written', description='')
+            reads.append(router.db_for_read(Post))
+        reads.append(router.db_for_read(Session))
+        return HttpResponse()
+
+    middleware = routers.ReplicaPinMiddleware(view)
+    for _ in range(3):
+        middleware(rf.get('/'))
+    assert reads == ['replica_a', 'default', 'replica_b', 'default', 'replica_a', 'default']
+
+    reads.clear()
+    response = middleware(rf.post('/'))
+    assert reads == ['replica_b', 'default', 'default']
+    pin = response.cookies[settings.REPLICA_ROUTING['COOKIE']].value
+
+    reads.clear()
+    pinned = rf.get('/')
+    pinned.COOKIES[settings.REPLICA_ROUTING['COOKIE']] = pin
+    middleware(pinned)
+    forged = rf.get('/')
+    forged.COOKIES[settings.REPLICA_ROUTING['COOKIE']] = '99999999999'
+    middleware(forged)
+    assert reads[0] == 'default' and reads[2] != 'default'
+
+    replicas['replica_b'].down = True
+    reads.clear()
+    for _ in range(3):
+        middleware(rf.get('/'))
+    assert reads[::2] == ['replica_a'] * 3
+    assert router.db_for_read(Post) == 'default'
+    assert router.allow_migrate('replica_a', 'blogserviceapp') is False
+
+@pytest.mark.django_db
+def test_replica_pin_middleware_tracks_writes_from_async_views(settings, rf):
+    settings.DATABASE_REPLICAS = ['replica_a']
+
+    async def view(request):
+        await sync_to_async(Category.objects.create)(name='Written', description='')
+        return HttpResponse()
+
+    middleware = routers.ReplicaPinMiddleware(view)
+    assert asyncio.iscoroutinefunction(middleware)
+    response = async_to_sync(middleware)(rf.post('/'))
+    assert settings.REPLICA_ROUTING['COOKIE'] in response.cookies
+
+def test_place_only_moves_conversations_to_an_added_shard():
+    pairs = [(low, low + step) for low in range(1, 60) for step in range(1, 6)]
+    before = {pair: place(*pair, ['default', 'messages_0']) for pair in pairs}
+    after = {pair: place(*pair, ['default', 'messages_0', 'messages_1']) for pair in pairs}
+    moved = [pair for pair in pairs if before[pair] != after[pair]]
+    assert set(before.values()) == {'default', 'messages_0'}
+    assert moved and all(after[pair] == 'messages_1' for pair in moved)
+
+@pytest.fixture
+def message_shard(settings, transactional_db):
+    # A real second database, created the way the test runner creates its own.
+    alias = 'messages_test'
+    default = connections['default'].settings_dict
+    connections.settings[alias] = {
+        **default, 'NAME': f"{default['NAME']}_messages", 'TEST': {**default['TEST'], 'NAME': None, 'MIRROR': None},
+    }
+    creation = connections[alias].creation
+    old_name = connections[alias].settings_dict['NAME']
+    creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    settings.MESSAGE_SHARDS = ['default', alias]
+    yield alias
+    creation.destroy_test_db(old_name, verbosity=0)
+    del connections[alias]
+    del connections.settings[alias]
+
+def correspondent_on(shard, user):
+    for i in range(64):
+        other = User.objects.create_user(username=f'correspondent-{shard}-{i}', password='pw')
+        if place(*sorted((user.pk, other.pk))) == shard:
+            return other
+    raise AssertionError(f"No conversation hashed to {shard}.")
+
+@pytest.mark.django_db(transaction=True)
+def test_messages_live_on_the_shard_of_their_conversation_and_rebalance(logged_in_client, user, message_shard, settings):
+    other = correspondent_on(message_shard, user)
+    local = correspondent_on('default', user)
+    for recipient in (other, local, other):
+        response = logged_in_client.post(
+            reverse('add_message', args=[recipient.pk]), json.dumps({'description': f'to {recipient.username}'}),
+            content_type='application/json',
+        )
+        assert response.status_code == 201
+
+    conversation = Conversation.objects.get(user_high=max(user.pk, other.pk), user_low=min(user.pk, other.pk))
+    assert conversation.shard == message_shard and conversation.message_count == 2
+    sharded = Message.objects.using(message_shard)
+    assert sharded.filter(conversation=conversation).count() == 2 and not Message.objects.filter(conversation=conversation)
+    assert list(Message.sender.through.objects.using(message_shard).values_list('user_id', flat=True)) == [other.pk] * 2
+
+    response = logged_in_client.get(reverse('read_message', args=[other.pk]), HTTP_ACCEPT='application/json')
+    assert [row['description'] for row in response.json()['results']] == [f'to {other.username}'] * 2
+    response = logged_in_client.get(reverse('inbox'), HTTP_ACCEPT='application/json')
+    assert {row['conversation_id']: row['last_message'] for row in response.json()['results']} == {
+        conversation.pk: f'to {other.username}', Conversation.objects.get(shard='default').pk: f'to {local.username}',
+    }
+
+    # A copy left behind by an interrupted move is swept; draining the shard moves the rest home.
+    sent = list(sharded.order_by('pk').values_list('send_data', flat=True))
+    stray = Message.objects.using(message_shard).create(
+        author=user, description='stray', conversation=Conversation.objects.get(shard='default'),
+    )
+    settings.MESSAGE_SHARDS = ['default']
+    out = io.StringIO()
+    call_command('rebalance_message_shards', stdout=out)
+    assert 'Moved 1 conversations, 2 messages.' in out.getvalue()
+    assert not sharded.exists() and not Message.objects.filter(pk=stray.pk, description='stray').exists()
+    conversation.refresh_from_db()
+    moved = Message.objects.filter(conversation=conversation).order_by('pk')
+    assert conversation.shard == 'default' and conversation.last_message_id == moved.last().pk
+    assert list(moved.values_list('send_data', flat=True)) == sent
+    assert set(Message.sender.through.objects.filter(message__in=moved).values_list('user_id', flat=True)) == {other.pk}
+
+@pytest.mark.django_db(transaction=True)
+def test_account_deletion_reaches_every_message_shard(user, message_shard, settings):
+    settings.ACCOUNT_DELETION = {'BATCH_SIZE': 1}
+    for other in (correspondent_on(message_shard, user), correspondent_on('default', user)):
+        conversation = open_conversation(user, other)
+        with routers.shard_writes(conversation.shard):
+            message = Message.objects.create(author=other, description='M', conversation=conversation)
+            Message.sender.through.objects.create(message=message, user=user)
+        record_message(message, user)
+
+    AccountDeletion.objects.create(user=user)
+    delete_account(user.pk)
+    for shard in settings.MESSAGE_SHARDS:
+        assert not Message.objects.using(shard).exists()
+        assert not Message.sender.through.objects.using(shard).exists()
+    assert not Conversation.objects.exists()
+
+def test_serve_sizes_workers_to_the_cgroup_cpu_quota(tmp_path, monkeypatch):
+    cpu_max = tmp_path / 'cpu.max'
+    monkeypatch.setattr(serve, 'CGROUP_V2_CPU_MAX', str(cpu_max))
+    monkeypatch.setattr(serve, 'CGROUP_V1_CPU_QUOTA', str(tmp_path / 'missing'))
+    cpu_max.write_text('150000 100000\n')
+    assert serve.cgroup_cpu_quota() == 1.5
+    assert serve.default_workers(1.5) == 4
+    cpu_max.write_text('max 100000\n')
+    assert serve.cgroup_cpu_quota() is None
+    assert serve.cpu_limit() == len(os.sched_getaffinity(0))
+
+def test_serve_prefork_workers_answer_recycle_and_stop_gracefully():
+    process = subprocess.Popen(
+        [sys.executable, 'manage.py', 'serve', '--bind', '127.0.0.1:0', '--workers', '2',
+         '--max-requests', '2', '--max-requests-jitter', '0'],
+        cwd=django_settings.BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    try:
+        port = re.search(r':(\d+) with 2 workers', process.stdout.readline()).group(1)
+        for _ in range(6):
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/signup/', timeout=10) as response:
+                assert response.status == 200
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=20) == 0
+        assert 'Stopped.' in process.stdout.read()
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+
+def test_serve_worker_finishes_its_background_tasks_before_exiting(settings, tmp_path, monkeypatch):
+    settings.BACKGROUND_TASKS = {'WORKERS': 1, 'EAGER': False}
+    # No transaction to wait for: the task is queued as it is submitted.
+    monkeypatch.setattr(tasks.transaction, 'on_commit', lambda func: func())
+    done = tmp_path / 'done'
+
+    def slow_task():
+        time.sleep(0.5)
+        done.write_text('ran')
+
+    command = serve.Command()
+    command.options = {'graceful_timeout': 10}
+    command.work = lambda: tasks.submit(slow_task)
+    command.workers = {}
+    command.spawn()
+    [pid] = command.workers
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert done.read_text() == 'ran'
+
+def test_serve_backs_off_and_gives_up_when_workers_fail_to_start(monkeypatch):
+    monkeypatch.setattr(serve, 'RESPAWN_DELAY', 0.01)
+    monkeypatch.setattr(serve, 'MAX_FAILED_STARTS', 4)
+    command = serve.Command()
+    command.options = {'graceful_timeout': 10}
+    command.work = lambda: os._exit(3)
+    command.workers, command.failed_starts, command.respawn_at = {}, 0, 0
+    command.stopping = command.replacing = False
+    spawns = []
+    spawn = command.spawn
+    command.spawn = lambda: spawns.append(time.monotonic()) or spawn()
+
+    with pytest.raises(CommandError, match='4 times in a row'):
+        command.supervise(1)
+    assert len(spawns) == 4
+    # Each respawn waits twice as long as the one before.
+    assert spawns[3] - spawns[2] >= 0.08 and spawns[2] - spawns[1] >= 0.04
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+    (tmp_path / 'blog_images' / 'derivatives').mkdir(parents=True)
+    (tmp_path / 'blog_images' / 'photo.jpg').write_bytes(bytes(range(256)) * 4)
+    (tmp_path / 'blog_images' / 'derivatives' / 'photo.0123456789abcdef.89abcdef.thumbnail.webp').write_bytes(b'RIFF' * 8)
+    return tmp_path
+
+def test_media_view_serves_ranges_and_revalidates(client, media_root):
+    body = bytes(range(256)) * 4
+    response = client.get('/media/blog_images/photo.jpg')
+    assert response.status_code == 200
+    assert b''.join(response.streaming_content) == body
+    assert response['Content-Type'] == 'image/jpeg'
+    assert response['Accept-Ranges'] == 'bytes'
+    assert response['Cache-Control'] == 'public, max-age=3600'
+    etag = response['ETag']
+    assert not etag.startswith('W/')
+
+    assert client.get('/media/blog_images/photo.jpg', HTTP_IF_NONE_MATCH=etag).status_code == 304
+    response = client.get('/media/blog_images/photo.jpg', HTTP_RANGE='bytes=10-19')
+    assert response.status_code == 206
+    assert response['Content-Range'] == 'bytes 10-19/1024'
+    assert response['Content-Length'] == '10'
+    assert b''.join(response.streaming_content) == body[10:20]
+    response = client.get('/media/blog_images/photo.jpg', HTTP_RANGE='bytes=-4', HTTP_IF_RANGE=etag)
+    assert b''.join(response.streaming_content) == body[-4:]
+    # A stale If-Range or a multi-range request gets the whole file.
+    assert client.get('/media/blog_images/photo.jpg', HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"').status_code == 200
+    assert client.get('/media/blog_images/photo.jpg', HTTP_RANGE='bytes=0-1,4-5').status_code == 200
+    response = client.get('/media/blog_images/photo.jpg', HTTP_RANGE='bytes=1024-')
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */1024'
+
+    response = client.get('/media/blog_images/derivatives/photo.0123456789abcdef.89abcdef.thumbnail.webp')
+    assert response['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert response['Content-Type'] == 'image/webp'
+    assert client.get('/media/../secret.txt').status_code == 404
+    assert client.get('/media/blog_images/').status_code == 404
+    assert client.post('/media/blog_images/photo.jpg').status_code == 405
+
+def test_media_proxy_backends_leave_the_body_to_the_proxy(client, media_root, settings):
+    settings.MEDIA_SERVING = {**settings.MEDIA_SERVING, 'BACKEND': 'x-accel-redirect'}
+    response = client.get('/media/blog_images/photo.jpg', HTTP_RANGE='bytes=0-1')
+    assert response.status_code == 200
+    assert response['X-Accel-Redirect'] == '/protected-media/blog_images/photo.jpg'
+    assert response.content == b''
+    assert client.get('/media/blog_images/photo.jpg', HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+
+    settings.MEDIA_SERVING = {**settings.MEDIA_SERVING, 'BACKEND': 'x-sendfile'}
+    response = client.get('/media/blog_images/derivatives/photo.0123456789abcdef.89abcdef.thumbnail.webp')
+    assert response['X-Sendfile'] == str(media_root / 'blog_images' / 'derivatives' / 'photo.0123456789abcdef.89abcdef.thumbnail.webp')
+    assert response['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+def test_serve_sends_media_ranges_with_sendfile(media_root, monkeypatch):
+    calls = []
+    sendfile = os.sendfile
+    monkeypatch.setattr(os, 'sendfile', lambda *args: calls.append(args) or sendfile(*args))
+    server = WSGIServer(('127.0.0.1', 0), serve.RequestHandler)
+    server.set_app(get_internal_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{server.server_port}/media/blog_images/photo.jpg', headers={'Range': 'bytes=300-599'},
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            assert response.status == 206
+            assert response.read() == (bytes(range(256)) * 4)[300:600]
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert [args[2:] for args in calls] == [(300, 300)]
@@ -0,0 +1,157 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from blogserviceapp import counters
+from blogserviceapp.blocks import invalidate_blocks
+from blogserviceapp.models import (
+    AccountDeletion, BlockedUser, Comment, Conversation, HomeTimeline, Message, Post, TimelineEntry, User,
+)
+from blogserviceapp.routers import message_shards
+from blogserviceapp.stamps import bump, category_posts_key, post_comments_key
+from blogserviceapp.tasks import submit
+
+logger = logging.getLogger(__name__)
+
+
+def request_account_deletion(user):
+    """Tombstone ``user`` and schedule the deletion of everything they own.
+
+    The tombstone hides the account's posts, comments and messages straight
+    away; the rows themselves are deleted by ``delete_account`` in batches.
+    """
+    with transaction.atomic():
+        deletion, created = AccountDeletion.objects.get_or_create(user=user)
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        if created:
+            _bump_listings(user.pk)
+    if created:
+        submit(delete_account, user.pk)
+    return deletion
+
+
+def _bump_listings(user_id):
+    # The listings that showed the account's posts and comments. The batches bump them
+    # again as they delete those rows, through the post and comment delete signals.
+    posts = Post.objects.filter(Q(user_id=user_id) | Q(comment__user_id=user_id)).values_list('pk', 'category_id')
+    keys = set()
+    for post_id, category_id in posts.distinct().iterator():
+        keys.update((post_comments_key(post_id), category_posts_key(category_id)))
+    bump(*keys)
+
+
+def delete_account(user_id, batch_size=None, progress=None):
+    """Delete a tombstoned account's rows in keyset batches, then the user.
+
+    Each batch commits with the progress it made, so after a crash calling
+    this again picks up where it stopped. ``progress`` is called with the
+    deletion after every batch.
+    """
+    batch_size = batch_size or settings.ACCOUNT_DELETION['BATCH_SIZE']
+    deletion = AccountDeletion.objects.filter(pk=user_id, completed_at__isnull=True).first()
+    if deletion is None:
+        return None
+
+    names = [name for name, _ in STEPS]
+    start = names.index(deletion.step) if deletion.step in names else 0
+    for name, step in STEPS[start:]:
+        AccountDeletion.objects.filter(pk=user_id).update(step=name, updated_at=timezone.now())
+        deletion.step = name
+        logger.info("Deleting account %s: %s.", user_id, name)
+        for deleted in step(user_id, batch_size):
+            deletion.deleted_rows += deleted
+            if progress is not None:
+                progress(deletion)
+
+    with transaction.atomic():
+        deleted, _ = User.objects.filter(pk=user_id).delete()
+        deletion.deleted_rows += deleted
+        AccountDeletion.objects.filter(pk=user_id).update(
+            step='done', deleted_rows=F('deleted_rows') + deleted, completed_at=timezone.now(),
+        )
+    deletion.step = 'done'
+    logger.info("Account %s deleted: %s rows.", user_id, deletion.deleted_rows)
+    return deletion
+
+
+def _batches(user_id, queryset, batch_size, before_delete=None):
+    """Delete ``queryset`` ``batch_size`` primary keys at a time, yielding the rows each batch removed."""
+    last = 0
+    while True:
+        with transaction.atomic():
+            # Serializes the batches of a worker and a resumed command working on the same account.
+            AccountDeletion.objects.select_for_update().filter(pk=user_id).first()
+            ids = list(queryset.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return
+            batch = queryset.model.objects.using(queryset.db).filter(pk__in=ids)
+            if before_delete is not None:
+                before_delete(batch)
+            deleted, _ = batch.delete()
+            AccountDeletion.objects.filter(pk=user_id).update(
+                deleted_rows=F('deleted_rows') + deleted, updated_at=timezone.now(),
+            )
+        last = ids[-1]
+        yield deleted
+
+
+def _delete_timeline(user_id, batch_size):
+    # Entries of the user's posts in other timelines go first, so deleting the posts cascades to nothing.
+    yield from _batches(user_id, TimelineEntry.objects.filter(Q(user=user_id) | Q(author=user_id)), batch_size)
+    yield from _batches(user_id, HomeTimeline.objects.filter(user=user_id), batch_size)
+
+
+def _delete_blocks(user_id, batch_size):
+    def forget(batch):
+        edges = batch.values_list('id_user', 'blocked_user')
+        invalidate_blocks(user_id, *{other for edge in edges for other in edge})
+
+    edges = BlockedUser.objects.filter(Q(id_user=user_id) | Q(blocked_user=user_id))
+    yield from _batches(user_id, edges, batch_size, forget)
+
+
+def _delete_messages(user_id, batch_size):
+    conversations = Conversation.objects.filter(Q(user_low=user_id) | Q(user_high=user_id))
+    # Each shard is asked for its own conversations by id: a subquery would run on the shard,
+    # whose conversation table is empty.
+    by_shard = {}
+    for conversation_id, shard in conversations.values_list('pk', 'shard'):
+        by_shard.setdefault(shard, []).append(conversation_id)
+    for shard in dict.fromkeys([*message_shards(), *by_shard]):
+        ids = by_shard.get(shard, [])
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            yield from _batches(user_id, Message.objects.using(shard).filter(conversation__in=chunk), batch_size)
+        yield from _batches(user_id, Message.objects.using(shard).filter(author=user_id), batch_size)
+        # Older messages without a conversation only lose this user as a recipient.
+        yield from _batches(user_id, Message.sender.through.objects.using(shard).filter(user=user_id), batch_size)
+    yield from _batches(user_id, conversations, batch_size)
+
+
+def _comment_counts(batch):
+    counters.comments_deleted(list(batch.values_list('post_id', 'user_id')))
+
+
+def _delete_comments(user_id, batch_size):
+    yield from _batches(user_id, Comment.objects.filter(user_id=user_id), batch_size, _comment_counts)
+    # Other people's comments on the user's posts, so the posts can go without a cascade.
+    yield from _batches(user_id, Comment.objects.filter(post_id__user_id=user_id), batch_size, _comment_counts)
+
+
+def _delete_posts(user_id, batch_size):
+    def settle(batch):
+        counters.posts_deleted(list(batch.values_list('category_id', 'user_id')))
+
+    yield from _batches(user_id, Post.objects.filter(user_id=user_id), batch_size, settle)
+
+
+STEPS = [
+    ('timeline', _delete_timeline),
+    ('blocks', _delete_blocks),
+    ('messages', _delete_messages),
+    ('comments', _delete_comments),
+    ('posts', _delete_posts),
+]
@@ -2,6 +2,6 @@ from django.contrib import admin
 from .models import Category
 
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'description']
+    list_display = ['name', 'description', 'post_count']
 
 admin.site.register(Category, CategoryAdmin)
\ No newline at end of file
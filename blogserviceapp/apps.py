@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class BlogserviceappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blogserviceapp'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from blogserviceapp import signals  # noqa: F401 connects the change-stamp receivers
+        from blogserviceapp import template_registry  # noqa: F401 registers the template check
+        # Before any connection opens: they install their query wrappers on new connections.
+        from blogserviceapp import instrumentation, routers  # noqa: F401
+        from blogserviceapp.search import ensure_search_index
+
+        post_migrate.connect(ensure_search_index, sender=self)
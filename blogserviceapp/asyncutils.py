@@ -0,0 +1,11 @@
+from asgiref.sync import sync_to_async
+
+
+def _load_user(request):
+    # request.user is a lazy object backed by a session and a user query.
+    request.user.is_authenticated
+    return request.user
+
+
+async def aget_user(request):
+    return await sync_to_async(_load_user)(request)
@@ -0,0 +1,207 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Q
+
+from blogserviceapp.models import BlockedUser, User
+from blogserviceapp.timeline import prune_blocked, restore_unblocked
+
+BlockSets = namedtuple('BlockSets', ['blocking', 'blocked_by'])
+
+EMPTY_BLOCK_SETS = BlockSets(frozenset(), frozenset())
+
+
+class BlockGraphCache:
+    """Bounded LRU of each user's block edges in both directions, reloaded after ``timeout`` seconds.
+
+    With a shared cache configured, every invalidation writes a fresh
+    version token there so the other workers drop their local copy on the
+    next lookup, and the edge sets themselves are shared between workers.
+    Without one, a block made in another worker is seen here once the local
+    copy expires.
+    """
+
+    def __init__(self, max_users=10000, shared_cache=None, timeout=None):
+        self.max_users = max_users
+        self.shared_cache = shared_cache
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        # Bumped by invalidate(), so a load it overlapped is not stored.
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'BLOCK_GRAPH_CACHE', {})
+        alias = options.get('SHARED_CACHE')
+        shared_cache = caches[alias] if alias else None
+        if isinstance(shared_cache, (LocMemCache, DummyCache)):
+            raise ImproperlyConfigured(
+                f"BLOCK_GRAPH_CACHE['SHARED_CACHE'] is {alias!r}, which every process keeps to itself; "
+                "name a cache the workers share, or None to rely on TIMEOUT."
+            )
+        return cls(
+            max_users=options.get('MAX_USERS', 10000),
+            shared_cache=shared_cache,
+            timeout=options.get('TIMEOUT'),
+        )
+
+    def get(self, user_id):
+        version = self._shared_version(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version and not self._expired(entry[1]):
+                self._entries.move_to_end(user_id)
+                return entry[2]
+            generation = self._generations.get(user_id, 0)
+
+        loaded_at = time.monotonic()
+        block_sets = self._load(user_id, version)
+        with self._lock:
+            if self._generations.get(user_id, 0) == generation:
+                self._entries[user_id] = (version, loaded_at, block_sets)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+        return block_sets
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        if self.shared_cache is not None:
+            self.shared_cache.set_many(
+                {self._version_key(user_id): uuid.uuid4().hex for user_id in user_ids},
+                timeout=None,
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expired(self, loaded_at):
+        return self.timeout is not None and time.monotonic() - loaded_at >= self.timeout
+
+    def _load(self, user_id, version):
+        key = f'blockgraph:{user_id}:{version}'
+        if self.shared_cache is not None:
+            cached = self.shared_cache.get(key)
+            if cached is not None:
+                return BlockSets(frozenset(cached[0]), frozenset(cached[1]))
+
+        blocking, blocked_by = set(), set()
+        edges = BlockedUser.objects.filter(
+            Q(id_user_id=user_id) | Q(blocked_user_id=user_id)
+        ).values_list('id_user_id', 'blocked_user_id')
+        for blocker, blocked in edges:
+            if blocker == user_id:
+                blocking.add(blocked)
+            if blocked == user_id:
+                blocked_by.add(blocker)
+
+        if self.shared_cache is not None:
+            self.shared_cache.set(key, (list(blocking), list(blocked_by)), timeout=self.timeout)
+        return BlockSets(frozenset(blocking), frozenset(blocked_by))
+
+    def _shared_version(self, user_id):
+        if self.shared_cache is None:
+            return None
+        return self.shared_cache.get(self._version_key(user_id))
+
+    def _version_key(self, user_id):
+        return f'blockgraph:v:{user_id}'
+
+
+_block_graph = None
+_block_graph_lock = threading.Lock()
+
+
+def block_graph():
+    global _block_graph
+    if _block_graph is None:
+        with _block_graph_lock:
+            if _block_graph is None:
+                _block_graph = BlockGraphCache.from_settings()
+    return _block_graph
+
+
+def get_block_sets(user):
+    if not user.is_authenticated:
+        return EMPTY_BLOCK_SETS
+    return block_graph().get(user.pk)
+
+
+def is_blocked_between(user, other):
+    block_sets = get_block_sets(user)
+    return other.pk in block_sets.blocking or other.pk in block_sets.blocked_by
+
+
+def invalidate_blocks(*users):
+    block_graph().invalidate(*[getattr(user, 'pk', user) for user in users])
+
+
+def block_users(user, user_ids):
+    """Block every id in ``user_ids`` in one transaction; returns ``{user_id: status}``."""
+    user_ids = list(dict.fromkeys(user_ids))
+    with transaction.atomic():
+        existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+        already_blocked = set(
+            BlockedUser.objects.filter(id_user=user, blocked_user__in=existing)
+            .values_list('blocked_user_id', flat=True)
+        )
+        to_block = [
+            user_id for user_id in user_ids
+            if user_id in existing and user_id not in already_blocked and user_id != user.pk
+        ]
+        # A concurrent request may insert the same edge first; the unique constraint absorbs it.
+        BlockedUser.objects.bulk_create(
+            [BlockedUser(id_user=user, blocked_user_id=user_id) for user_id in to_block],
+            ignore_conflicts=True,
+        )
+    if to_block:
+        invalidate_blocks(user, *to_block)
+        prune_blocked(user, to_block)
+
+    results = {}
+    for user_id in user_ids:
+        if user_id == user.pk:
+            results[user_id] = 'self'
+        elif user_id not in existing:
+            results[user_id] = 'not_found'
+        elif user_id in already_blocked:
+            results[user_id] = 'already_blocked'
+        else:
+            results[user_id] = 'blocked'
+    return results
+
+
+def unblock_users(user, user_ids):
+    """Remove the blocks on ``user_ids`` with a single DELETE; returns ``{user_id: status}``."""
+    user_ids = list(dict.fromkeys(user_ids))
+    with transaction.atomic():
+        edges = BlockedUser.objects.filter(id_user=user, blocked_user__in=user_ids)
+        removed = set(edges.select_for_update().values_list('blocked_user_id', flat=True))
+        edges.filter(blocked_user__in=removed).delete()
+        existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    if removed:
+        invalidate_blocks(user, *removed)
+        restore_unblocked(user, removed)
+
+    results = {}
+    for user_id in user_ids:
+        if user_id in removed:
+            results[user_id] = 'unblocked'
+        elif user_id in existing:
+            results[user_id] = 'not_blocked'
+        else:
+            results[user_id] = 'not_found'
+    return results
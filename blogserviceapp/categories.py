@@ -0,0 +1,115 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from blogserviceapp.models import Category
+
+
+class CategoryCache:
+    """Process-local copy of every category, reloaded after ``timeout`` seconds.
+
+    With a shared cache configured, each lookup also reads a version key
+    there, which a save or delete in any worker replaces, so the others
+    reload at once instead of when the copy expires. A pk missing from the
+    copy is looked up in the database, so a category another worker has
+    just created is never rejected. ``post_count`` is as of the last
+    reload; read it from the database when it matters.
+    """
+
+    version_key = 'categories:v'
+
+    def __init__(self, shared_cache=None, timeout=None):
+        self.shared_cache = shared_cache
+        self.timeout = timeout
+        self._version = None
+        self._loaded_at = None
+        self._categories = None
+        self._by_pk = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = getattr(settings, 'CATEGORY_CACHE', {})
+        alias = options.get('SHARED_CACHE')
+        shared_cache = caches[alias] if alias else None
+        if isinstance(shared_cache, (LocMemCache, DummyCache)):
+            raise ImproperlyConfigured(
+                f"CATEGORY_CACHE['SHARED_CACHE'] is {alias!r}, which every process keeps to itself; "
+                "name a cache the workers share, or None to rely on TIMEOUT."
+            )
+        return cls(shared_cache=shared_cache, timeout=options.get('TIMEOUT'))
+
+    def all(self):
+        return self._current()[0]
+
+    def get(self, pk):
+        category = self._current()[1].get(pk)
+        if category is None:
+            category = Category.objects.filter(pk=pk).first()
+            if category is not None:
+                # Created since the copy was loaded; the next lookup reloads it.
+                self.clear()
+        return category
+
+    def invalidate(self):
+        with self._lock:
+            self._categories = None
+            self._by_pk = {}
+        if self.shared_cache is not None:
+            self.shared_cache.set(self.version_key, uuid.uuid4().hex, timeout=None)
+
+    def clear(self):
+        with self._lock:
+            self._categories = None
+            self._by_pk = {}
+
+    def _current(self):
+        version = self.shared_cache.get(self.version_key) if self.shared_cache is not None else None
+        with self._lock:
+            if self._categories is not None and self._version == version and not self._expired():
+                return self._categories, self._by_pk
+
+        loaded_at = time.monotonic()
+        categories = tuple(Category.objects.order_by('pk'))
+        by_pk = {category.pk: category for category in categories}
+        with self._lock:
+            self._version, self._loaded_at, self._categories, self._by_pk = version, loaded_at, categories, by_pk
+        return categories, by_pk
+
+    def _expired(self):
+        return self.timeout is not None and time.monotonic() - self._loaded_at >= self.timeout
+
+
+_category_cache = None
+_category_cache_lock = threading.Lock()
+
+
+def category_cache():
+    global _category_cache
+    if _category_cache is None:
+        with _category_cache_lock:
+            if _category_cache is None:
+                _category_cache = CategoryCache.from_settings()
+    return _category_cache
+
+
+def get_categories():
+    return category_cache().all()
+
+
+def get_category(pk):
+    return category_cache().get(pk)
+
+
+def invalidate_categories():
+    # Drop the copy now for this transaction, and again after commit so no
+    # worker keeps rows it reloaded before the change became visible.
+    category_cache().invalidate()
+    transaction.on_commit(category_cache().invalidate)
@@ -0,0 +1,105 @@
+from django.db import transaction
+from django.db.models import F
+
+from blogserviceapp.models import Conversation, ConversationParticipant, Message
+from blogserviceapp.sharding import place
+
+
+def ordered_pair(user, other):
+    return tuple(sorted((getattr(user, 'pk', user), getattr(other, 'pk', other))))
+
+
+def find_conversation(user, other):
+    low, high = ordered_pair(user, other)
+    return Conversation.objects.filter(user_low_id=low, user_high_id=high).first()
+
+
+def open_conversation(user, other):
+    """Return the conversation between the two users, creating it on its shard if needed.
+
+    The row stays locked until the caller's transaction ends, so a rebalance
+    cannot move the conversation while a message is written to its shard.
+    """
+    low, high = ordered_pair(user, other)
+    with transaction.atomic(savepoint=False):
+        conversation, created = Conversation.objects.select_for_update().get_or_create(
+            user_low_id=low, user_high_id=high, defaults={'shard': place(low, high)},
+        )
+    if created:
+        ConversationParticipant.objects.bulk_create(
+            [
+                ConversationParticipant(conversation=conversation, user_id=user_id, other_user_id=other_id)
+                for user_id, other_id in {(low, high), (high, low)}
+            ],
+            ignore_conflicts=True,
+        )
+    return conversation
+
+
+def conversation_messages(conversation):
+    """The messages of ``conversation``, read from the shard that holds them."""
+    return Message.objects.using(conversation.shard).filter(conversation=conversation)
+
+
+def attach_last_messages(conversations):
+    """Fetch the last message of each conversation with one query per shard.
+
+    ``select_related()`` cannot join them in: they live on the conversation's shard.
+    """
+    by_shard = {}
+    for conversation in conversations:
+        if conversation.last_message_id is not None:
+            by_shard.setdefault(conversation.shard, []).append(conversation.last_message_id)
+    # Message ids are only unique within a shard.
+    messages = {}
+    for shard, ids in by_shard.items():
+        messages.update(((shard, message.pk), message) for message in Message.objects.using(shard).filter(pk__in=ids))
+    field = Conversation._meta.get_field('last_message')
+    for conversation in conversations:
+        field.set_cached_value(conversation, messages.get((conversation.shard, conversation.last_message_id)))
+
+
+def record_message(message, recipient):
+    # Keeps the denormalized inbox columns in step with the new message in one transaction.
+    with transaction.atomic():
+        conversation = message.conversation
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_message=message,
+            last_message_at=message.send_data,
+            message_count=F('message_count') + 1,
+        )
+        participants = ConversationParticipant.objects.filter(conversation=conversation)
+        participants.update(last_message_at=message.send_data)
+        if recipient.pk != message.author_id:
+            participants.filter(user=recipient).update(unread_count=F('unread_count') + 1)
+
+
+def forget_message(message):
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().filter(pk=message.conversation_id).first()
+        if conversation is None:
+            return
+        latest = (
+            conversation_messages(conversation)
+            .exclude(pk=message.pk)
+            .order_by('-send_data', '-id')
+            .first()
+        )
+        Conversation.objects.filter(pk=conversation.pk, message_count__gt=0).update(
+            message_count=F('message_count') - 1
+        )
+        if conversation.last_message_id in (None, message.pk):
+            last_message_at = latest.send_data if latest else None
+            Conversation.objects.filter(pk=conversation.pk).update(
+                last_message=latest,
+                last_message_at=last_message_at,
+            )
+            ConversationParticipant.objects.filter(conversation=conversation).update(
+                last_message_at=last_message_at
+            )
+
+
+def mark_read(conversation, user):
+    ConversationParticipant.objects.filter(
+        conversation=conversation, user=user, unread_count__gt=0
+    ).update(unread_count=0)
@@ -0,0 +1,77 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from blogserviceapp.models import Category, Comment, Post, UserCounters
+
+
+def _adjust(queryset, field, delta):
+    if delta < 0:
+        # Never underflow; a counter that has drifted low is left to reconcile_counters.
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def _adjust_user(user_id, field, delta):
+    counters = UserCounters.objects.filter(user_id=user_id)
+    if not _adjust(counters, field, delta) and delta > 0:
+        UserCounters.objects.get_or_create(user_id=user_id)
+        _adjust(counters, field, delta)
+
+
+def post_created(post):
+    with transaction.atomic():
+        _adjust(Category.objects.filter(pk=post.category_id_id), 'post_count', 1)
+        _adjust_user(post.user_id_id, 'post_count', 1)
+
+
+def post_moved(post, previous_category_id):
+    if post.category_id_id == previous_category_id:
+        return
+    with transaction.atomic():
+        _adjust(Category.objects.filter(pk=previous_category_id), 'post_count', -1)
+        _adjust(Category.objects.filter(pk=post.category_id_id), 'post_count', 1)
+
+
+def post_deleted(post):
+    """Call before deleting ``post``; also settles the comments its deletion cascades to."""
+    with transaction.atomic():
+        _adjust(Category.objects.filter(pk=post.category_id_id), 'post_count', -1)
+        _adjust_user(post.user_id_id, 'post_count', -1)
+        commenters = (
+            Comment.objects.filter(post_id=post).order_by()
+            .values_list('user_id').annotate(n=Count('pk'))
+        )
+        for user_id, n in commenters:
+            _adjust_user(user_id, 'comment_count', -n)
+
+
+def comment_created(comment):
+    with transaction.atomic():
+        _adjust(Post.objects.filter(pk=comment.post_id_id), 'comment_count', 1)
+        _adjust_user(comment.user_id_id, 'comment_count', 1)
+
+
+def comment_deleted(comment):
+    with transaction.atomic():
+        _adjust(Post.objects.filter(pk=comment.post_id_id), 'comment_count', -1)
+        _adjust_user(comment.user_id_id, 'comment_count', -1)
+
+
+def posts_deleted(posts):
+    """Settle counters for a batch of ``(category_id, user_id)`` posts deleted without their comments."""
+    with transaction.atomic():
+        for category_id, n in Counter(category_id for category_id, _ in posts).items():
+            _adjust(Category.objects.filter(pk=category_id), 'post_count', -n)
+        for user_id, n in Counter(user_id for _, user_id in posts).items():
+            _adjust_user(user_id, 'post_count', -n)
+
+
+def comments_deleted(comments):
+    """Settle counters for a batch of ``(post_id, user_id)`` comments."""
+    with transaction.atomic():
+        for post_id, n in Counter(post_id for post_id, _ in comments).items():
+            _adjust(Post.objects.filter(pk=post_id), 'comment_count', -n)
+        for user_id, n in Counter(user_id for _, user_id in comments).items():
+            _adjust_user(user_id, 'comment_count', -n)
@@ -0,0 +1,104 @@
+import hashlib
+import io
+import json
+import logging
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from blogserviceapp.models import Post
+from blogserviceapp.tasks import submit
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR = 'blog_images/derivatives'
+
+MODES = {
+    'WEBP': ('RGB', 'RGBA'),
+    'AVIF': ('RGB', 'RGBA'),
+    'JPEG': ('RGB',),
+}
+
+
+def supported_format(image_format):
+    Image.init()
+    return image_format in Image.SAVE
+
+
+def schedule_post_derivatives(post):
+    if post.image:
+        submit(generate_post_derivatives, post.pk)
+
+
+def discard_post_derivatives(variants):
+    """Delete the files of ``variants``, a post's old image_variants, once the transaction commits."""
+    paths = list(variants.values())
+    if paths:
+        transaction.on_commit(lambda: _delete(paths))
+
+
+def _delete(paths):
+    for path in paths:
+        default_storage.delete(path)
+
+
+def generate_post_derivatives(post_id):
+    post = Post.objects.filter(pk=post_id).only('image', 'image_variants').first()
+    if post is None or not post.image:
+        return
+
+    source_name = post.image.name
+    with post.image.open('rb') as source:
+        digest = _digest(source)
+        source.seek(0)
+        with Image.open(source) as original:
+            original = ImageOps.exif_transpose(original)
+            variants = {}
+            for name, spec in settings.POST_IMAGE_VARIANTS.items():
+                if not supported_format(spec['format']):
+                    logger.warning("Skipping %s variant: Pillow cannot write %s.", name, spec['format'])
+                    continue
+                variants[name] = _save_variant(original, source_name, digest, name, spec)
+
+    # Only attach the variants if the post still points at the image they were made from.
+    updated = Post.objects.filter(pk=post_id, image=source_name).update(image_variants=variants)
+    stale = set(post.image_variants.values()) - set(variants.values())
+    if not updated:
+        stale = set(variants.values()) - set(post.image_variants.values())
+    _delete(stale)
+    logger.info("Generated %s image variants for post %s.", len(variants), post_id)
+
+
+def _save_variant(original, source_name, digest, name, spec):
+    image = original.copy()
+    image.thumbnail(spec['size'], Image.LANCZOS)
+    allowed_modes = MODES.get(spec['format'], ('RGB',))
+    if image.mode not in allowed_modes:
+        image = image.convert('RGBA' if 'A' in image.getbands() and 'RGBA' in allowed_modes else 'RGB')
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=spec['format'], quality=spec.get('quality', 80))
+    stem = posixpath.splitext(posixpath.basename(source_name))[0]
+    extension = spec['format'].lower()
+    # The hashes of the source and of the spec in the name make every variant URL
+    # immutable: resizing a variant in the settings gives it new names.
+    path = f"{DERIVATIVE_DIR}/{stem}.{digest}.{_spec_digest(spec)}.{name}.{extension}"
+    if default_storage.exists(path):
+        return path
+    return default_storage.save(path, ContentFile(buffer.getvalue()))
+
+
+def _digest(source):
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: source.read(1024 * 1024), b''):
+        sha.update(chunk)
+    return sha.hexdigest()[:16]
+
+
+def _spec_digest(spec):
+    spec = {'size': list(spec['size']), 'format': spec['format'], 'quality': spec.get('quality', 80)}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:8]
@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+
+_route_stats = {}
+_route_stats_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        # The DB and template time when the view started; theirs is not the view's own.
+        self.view_started_db_time = 0.0
+        self.view_started_template_time = 0.0
+        self.view_time = 0.0
+        self.query_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.query_count} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'view;dur={self.view_time * 1000:.1f};desc="excluding db and tpl"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.total_time = 0.0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.queries = 0
+        self.max_queries = 0
+
+    def add(self, metrics, total):
+        self.requests += 1
+        self.total_time += total
+        self.db_time += metrics.db_time
+        self.template_time += metrics.template_time
+        self.queries += metrics.query_count
+        self.max_queries = max(self.max_queries, metrics.query_count)
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            'requests': self.requests,
+            'avg_ms': self.total_time * 1000 / requests,
+            'avg_db_ms': self.db_time * 1000 / requests,
+            'avg_template_ms': self.template_time * 1000 / requests,
+            'avg_queries': self.queries / requests,
+            'max_queries': self.max_queries,
+        }
+
+
+def route_stats():
+    with _route_stats_lock:
+        return {route: stats.as_dict() for route, stats in _route_stats.items()}
+
+
+def reset_route_stats():
+    with _route_stats_lock:
+        _route_stats.clear()
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.query_count += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def _install_query_recorder(sender, connection, **kwargs):
+    # Installed on every connection rather than around each request: sync code under an
+    # async view queries on its worker thread's connection, with a copy of the request's
+    # context, so the wrapper finds that request's metrics wherever it runs.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None or metrics.template_depth:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+            metrics.template_depth -= 1
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates whose renders count towards the current request's template time.
+
+    Only the templates a view renders are timed; the ones they include or
+    extend are rendered inside them by the engine.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class RequestMetricsMiddleware:
+    """Count queries and time the DB, templates and view of every request.
+
+    The view's time is its own: the DB and template time spent inside it is
+    reported under those, so the header's parts do not overlap.
+
+    Adds a ``Server-Timing`` header, keeps per-route aggregates (see
+    ``route_stats()``) and checks the route's entry in ``QUERY_BUDGETS``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        if metrics.view_started is not None:
+            elapsed = time.perf_counter() - metrics.view_started
+            db_time = metrics.db_time - metrics.view_started_db_time
+            template_time = metrics.template_time - metrics.view_started_template_time
+            # Queries a view runs in parallel threads can add up to more than it took.
+            metrics.view_time = max(elapsed - db_time - template_time, 0.0)
+        total = time.perf_counter() - metrics.started
+        config = settings.REQUEST_METRICS
+        if config.get('SERVER_TIMING'):
+            response['Server-Timing'] = metrics.server_timing(total)
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.view_name if match else None
+        if route:
+            with _route_stats_lock:
+                _route_stats.setdefault(route, RouteStats()).add(metrics, total)
+            self.check_budget(route, metrics, config)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.view_started = time.perf_counter()
+            metrics.view_started_db_time = metrics.db_time
+            metrics.view_started_template_time = metrics.template_time
+
+    def check_budget(self, route, metrics, config):
+        budget = config.get('QUERY_BUDGETS', {}).get(route)
+        if budget is None or metrics.query_count <= budget:
+            return
+        message = f"{route} ran {metrics.query_count} queries, over its budget of {budget}."
+        if config.get('RAISE_ON_BUDGET'):
+            raise QueryBudgetExceeded(message)
+        logger.warning("%s ran %s queries, over its budget of %s.", route, metrics.query_count, budget)
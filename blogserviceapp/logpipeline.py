@@ -0,0 +1,158 @@
+import atexit
+import copy
+import json
+import logging
+import logging.config
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+
+QUEUE_SIZE = 10000
+
+_pipelines = []
+_pipelines_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the records at or below ``max_level``, per logger.
+
+    ``rates`` maps logger names to the fraction to keep; a logger inherits the
+    rate of its closest configured ancestor. Anything above ``max_level`` is
+    always kept.
+    """
+
+    def __init__(self, rates=None, max_level='INFO'):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+        self._rate = lru_cache(maxsize=1024)(self._lookup_rate)
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+    def _lookup_rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return self.rates.get('', 1)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records without ever blocking the caller; drops (and counts) records when full."""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Merge the %-args here, on the caller's thread: the arguments may be lazy
+        # objects (request.user) that must not be evaluated on the listener thread.
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _Pipeline:
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.handler = QueueHandler(queue.Queue(QUEUE_SIZE))
+        # Sampling on the sinks moves in front of the queue so dropped records cost nothing.
+        for sink in sinks:
+            for sampler in [f for f in sink.filters if isinstance(f, SamplingFilter)]:
+                if all(sampler in other.filters for other in sinks):
+                    sink.removeFilter(sampler)
+                    self.handler.addFilter(sampler)
+        self.listener = None
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(self.handler.queue, *self.sinks, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart_in_child(self):
+        # The listener thread does not survive fork(); give the child its own queue and thread.
+        self.handler.queue = queue.Queue(QUEUE_SIZE)
+        self.start()
+
+
+def configure_logging(logging_settings):
+    """``LOGGING_CONFIG`` entry point: apply ``LOGGING``, then move every logger's handlers behind a queue."""
+    stop_pipelines()
+    logging.config.dictConfig(logging_settings)
+
+    pipelines = {}
+    for name in ['', *logging_settings.get('loggers', {})]:
+        logger = logging.getLogger(name)
+        sinks = tuple(handler for handler in logger.handlers if not isinstance(handler, QueueHandler))
+        if not sinks:
+            continue
+        if sinks not in pipelines:
+            pipelines[sinks] = _Pipeline(sinks)
+        for sink in sinks:
+            logger.removeHandler(sink)
+        logger.addHandler(pipelines[sinks].handler)
+
+    with _pipelines_lock:
+        _pipelines.extend(pipelines.values())
+    for pipeline in pipelines.values():
+        pipeline.start()
+
+
+def stop_pipelines():
+    """Flush and stop every listener; records still queued are written first."""
+    with _pipelines_lock:
+        pipelines = list(_pipelines)
+        _pipelines.clear()
+    for pipeline in pipelines:
+        pipeline.stop()
+
+
+def _restart_after_fork():
+    for pipeline in _pipelines:
+        pipeline.restart_in_child()
+
+
+atexit.register(stop_pipelines)
+os.register_at_fork(after_in_child=_restart_after_fork)
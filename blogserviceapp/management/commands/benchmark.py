@@ -0,0 +1,243 @@
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from blogserviceapp.blocks import get_block_sets
+from blogserviceapp.instrumentation import reset_route_stats, route_stats
+from blogserviceapp.models import ConversationParticipant, Post, User
+
+URLCONFS = {
+    'wsgi': 'blogservice.urls',
+    'asgi': 'blogservice.asgi_urls',
+}
+
+# mix name -> [(route, weight)]
+MIXES = {
+    'feed': [('index', 6), ('posts_by_category', 2), ('comments_by_post', 1), ('categories', 1)],
+    'messaging': [('inbox', 2), ('read_message', 3), ('add_message', 1)],
+    'commenting': [('comments_by_post', 3), ('add_comment', 1), ('index', 1)],
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    summary = {f'p{pct}': _ms(percentile(timings, pct)) for pct in PERCENTILES}
+    summary['mean'] = _ms(sum(timings) / len(timings)) if timings else None
+    summary['max'] = _ms(timings[-1]) if timings else None
+    return summary
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class Targets:
+    """The posts and conversation partners the workload is drawn from, seen from ``user``."""
+
+    def __init__(self, user, pool_size=50):
+        block_sets = get_block_sets(user)
+        hidden = block_sets.blocking | block_sets.blocked_by
+        self.posts = list(
+            Post.objects.visible_to(user).order_by('-date', '-id').values('pk', 'category_id_id')[:pool_size]
+        )
+        partners = (
+            ConversationParticipant.objects.filter(user=user, last_message_at__isnull=False)
+            .order_by('-last_message_at').values_list('other_user_id', flat=True)[:pool_size * 4]
+        )
+        self.peers = [pk for pk in dict.fromkeys(partners) if pk not in hidden][:pool_size]
+        if not self.peers:
+            others = User.objects.exclude(pk=user.pk).exclude(pk__in=hidden).order_by('pk')
+            self.peers = list(others.values_list('pk', flat=True)[:pool_size])
+
+    def request(self, route, rng):
+        """Return ``(method, path, data)`` for one request to ``route``."""
+        if route in ('index', 'categories', 'inbox'):
+            return 'get', reverse(route), None
+        if route in ('read_message', 'add_message'):
+            peer = rng.choice(self.require(self.peers, route, "another user"))
+            if route == 'add_message':
+                return 'post', reverse(route, args=[peer]), {'description': "Benchmark message"}
+            return 'get', reverse(route, args=[peer]), None
+
+        post = rng.choice(self.require(self.posts, route, "a visible post"))
+        if route == 'posts_by_category':
+            return 'get', reverse(route, args=[post['category_id_id']]), None
+        kwargs = {'category_pk': post['category_id_id'], 'post_pk': post['pk']}
+        if route == 'add_comment':
+            return 'post', reverse(route, kwargs=kwargs), {'description': "Benchmark comment"}
+        return 'get', reverse(route, kwargs=kwargs), None
+
+    def require(self, pool, route, what):
+        if not pool:
+            raise CommandError(f"Route {route} needs {what}; seed the database first.")
+        return pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the WSGI and ASGI apps in-process with weighted route mixes and report "
+        "p50/p95/p99 latency and requests per second as JSON. Write routes change the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', nargs='+', choices=sorted(URLCONFS), default=['wsgi', 'asgi'])
+        parser.add_argument('--mix', nargs='+', choices=sorted(MIXES), default=['feed'])
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 16])
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--warmup', type=int, default=20, help="Unmeasured requests before each run.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--username', help="Log in as this user; defaults to the first user.")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or min(options['concurrency']) < 1:
+            raise CommandError("--requests and --concurrency must be at least 1.")
+        user = self.get_user(options['username'])
+        targets = Targets(user)
+        cookies = self.login_cookies(user)
+
+        runs = []
+        for app in options['app']:
+            with override_settings(ROOT_URLCONF=URLCONFS[app]):
+                for mix in options['mix']:
+                    for concurrency in options['concurrency']:
+                        rng = random.Random(f"{options['seed']}:{mix}")
+                        warmup = self.workload(targets, mix, options['warmup'], rng)
+                        workload = self.workload(targets, mix, options['requests'], rng)
+                        self.run_workload(app, warmup, concurrency, cookies)
+                        reset_route_stats()
+                        results, elapsed = self.run_workload(app, workload, concurrency, cookies)
+                        runs.append(self.report(app, mix, concurrency, results, elapsed))
+
+        report = json.dumps({'environment': self.environment(user), 'runs': runs}, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def get_user(self, username):
+        users = User.objects.order_by('pk')
+        user = users.filter(username=username).first() if username else users.first()
+        if user is None:
+            raise CommandError("No user to benchmark with; seed the database first.")
+        return user
+
+    def login_cookies(self, user):
+        # AsyncClient has no force_login in Django 4.2, so both clients share a session cookie.
+        client = Client()
+        client.force_login(user)
+        return client.cookies
+
+    def workload(self, targets, mix, count, rng):
+        routes, weights = zip(*MIXES[mix])
+        return [(route, *targets.request(route, rng)) for route in rng.choices(routes, weights, k=count)]
+
+    def run_workload(self, app, workload, concurrency, cookies):
+        if not workload:
+            return [], 0.0
+        if app == 'asgi':
+            return asyncio.run(self.run_asgi(workload, concurrency, cookies))
+        return self.run_wsgi(workload, concurrency, cookies)
+
+    def run_wsgi(self, workload, concurrency, cookies):
+        def fetch(item):
+            route, method, path, data = item
+            client = Client()
+            client.cookies = cookies
+            started = time.perf_counter()
+            response = self.send(client, method, path, data)
+            return route, time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(fetch, workload))
+        return results, time.perf_counter() - started
+
+    async def run_asgi(self, workload, concurrency, cookies):
+        client = AsyncClient()
+        client.cookies = cookies
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(item):
+            route, method, path, data = item
+            async with semaphore:
+                started = time.perf_counter()
+                response = await self.send(client, method, path, data)
+                return route, time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[fetch(item) for item in workload])
+        return results, time.perf_counter() - started
+
+    def send(self, client, method, path, data):
+        if method == 'post':
+            return client.post(path, json.dumps(data), content_type='application/json')
+        return client.get(path)
+
+    def report(self, app, mix, concurrency, results, elapsed):
+        queries = route_stats()
+        by_route = {}
+        for route, duration, status in results:
+            by_route.setdefault(route, []).append((duration, status))
+
+        routes = {}
+        for route, samples in sorted(by_route.items()):
+            routes[route] = {
+                'requests': len(samples),
+                'errors': sum(1 for _, status in samples if status >= 400),
+                'latency_ms': summarize([duration for duration, _ in samples]),
+                'avg_queries': queries.get(route, {}).get('avg_queries'),
+            }
+        return {
+            'app': app,
+            'mix': mix,
+            'concurrency': concurrency,
+            'requests': len(results),
+            'errors': sum(route['errors'] for route in routes.values()),
+            'elapsed_s': round(elapsed, 3),
+            'rps': round(len(results) / elapsed, 1) if elapsed else None,
+            'latency_ms': summarize([duration for _, duration, _ in results]),
+            'routes': routes,
+        }
+
+    def environment(self, user):
+        return {
+            'commit': self.git_commit(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'debug': settings.DEBUG,
+            'username': user.username,
+            'users': User.objects.count(),
+            'posts': Post.objects.count(),
+        }
+
+    def git_commit(self):
+        try:
+            result = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+                cwd=settings.BASE_DIR,
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return result.stdout.strip() or None
@@ -0,0 +1,90 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from blogserviceapp.models import BlockedUser, Category, Post, User
+
+
+class Command(BaseCommand):
+    help = "Compare the legacy NOT IN block filtering with the visible_to() anti-join on seeded data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--posts', type=int, default=50000)
+        parser.add_argument('--blocks-per-user', type=int, default=20)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded rows instead of rolling them back.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            viewer = self.seed(options)
+            self.compare(viewer, options['iterations'])
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        prefix = f"bench-visibility-{rng.getrandbits(32):08x}"
+        password = make_password(None)
+        users = User.objects.bulk_create(
+            [User(username=f"{prefix}-{i}", password=password) for i in range(options['users'])],
+            batch_size=1000,
+        )
+        category = Category.objects.create(name=prefix, description='')
+
+        Post.objects.bulk_create(
+            [
+                Post(title=f"Post {i}", description='', category_id=category, user_id=rng.choice(users))
+                for i in range(options['posts'])
+            ],
+            batch_size=1000,
+        )
+
+        blocks = set()
+        for user in users:
+            for other in rng.sample(users, min(options['blocks_per_user'], len(users))):
+                if other.pk != user.pk:
+                    blocks.add((user.pk, other.pk))
+        BlockedUser.objects.bulk_create(
+            [BlockedUser(id_user_id=blocker, blocked_user_id=blocked) for blocker, blocked in blocks],
+            batch_size=1000,
+        )
+        self.stdout.write(
+            f"Seeded {len(users)} users, {options['posts']} posts and {len(blocks)} blocks "
+            f"on {connection.vendor}."
+        )
+        return users[0]
+
+    def compare(self, viewer, iterations):
+        page_size = settings.FEED_PAGE_SIZE
+        blocked = BlockedUser.objects.filter(id_user=viewer).values_list('blocked_user', flat=True)
+        blocking = BlockedUser.objects.filter(blocked_user=viewer).values_list('id_user', flat=True)
+        variants = {
+            'not_in_one_direction': Post.objects.exclude(user_id__in=blocked),
+            'not_in_both_directions': Post.objects.exclude(user_id__in=blocked).exclude(user_id__in=blocking),
+            'not_exists_anti_join': Post.objects.visible_to(viewer),
+        }
+
+        for name, queryset in variants.items():
+            feed = queryset.order_by('-date', '-id')
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(feed[:page_size].explain())
+            first_page = self.measure(lambda: list(feed[:page_size]), iterations)
+            full_count = self.measure(queryset.count, iterations)
+            self.stdout.write(
+                f"first page median {first_page:.2f} ms, full count median {full_count:.2f} ms\n"
+            )
+
+    def measure(self, run, iterations):
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
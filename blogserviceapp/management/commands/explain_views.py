@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+
+from blogserviceapp.conversations import conversation_messages
+from blogserviceapp.models import BlockedUser, Category, Comment, Conversation, HomeTimeline, Message, Post, User
+from blogserviceapp.routers import message_shards
+from blogserviceapp.timeline import FEED_KEYS, feed_querysets
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the query plan of the queries behind each read view, to check which index they use. "
+        "Message queries run on the conversation's shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('routes', nargs='*', help="Route names to explain (default: all).")
+        parser.add_argument('--user', type=int, help="Viewer user id (default: the first user).")
+        parser.add_argument('--analyze', action='store_true', help="Run EXPLAIN ANALYZE (Postgres only).")
+
+    def handle(self, *args, **options):
+        viewer = self.get_viewer(options['user'])
+        plans = self.view_queries(viewer)
+        routes = options['routes'] or list(plans)
+
+        unknown = set(routes) - set(plans)
+        if unknown:
+            raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}. Choose from {', '.join(plans)}.")
+
+        for route in routes:
+            self.stdout.write(self.style.MIGRATE_HEADING(route))
+            queries = plans[route]()
+            for queryset in queries if isinstance(queries, list) else [queries]:
+                if queryset.db != DEFAULT_DB_ALIAS:
+                    self.stdout.write(f"-- on {queryset.db}")
+                analyze = options['analyze'] and connections[queryset.db].vendor == 'postgresql'
+                self.stdout.write(queryset.explain(**({'analyze': True} if analyze else {})))
+            self.stdout.write('')
+
+    def get_viewer(self, user_pk):
+        users = User.objects.order_by('pk')
+        viewer = users.filter(pk=user_pk).first() if user_pk else users.first()
+        if viewer is None:
+            raise CommandError("No user to explain the views for; seed the database first.")
+        return viewer
+
+    def view_queries(self, viewer):
+        # Mirrors the first page each read view fetches; sample keys come from existing rows.
+        page_size = settings.FEED_PAGE_SIZE
+        category = Category.objects.order_by('pk').first()
+        post = Post.objects.order_by('pk').first()
+        other = User.objects.exclude(pk=viewer.pk).order_by('pk').first() or viewer
+        category_pk = category.pk if category else 0
+        post_pk = post.pk if post else 0
+        # Read-only stand-in for the timeline check home_feed() makes, which may start a backfill.
+        materialized = HomeTimeline.objects.filter(user=viewer, backfilled_at__isnull=False).exists()
+        conversation = Conversation.objects.filter(Q(user_low=viewer) | Q(user_high=viewer)).order_by('pk').first()
+
+        def messages():
+            if conversation is None:
+                return Message.objects.using(message_shards()[0]).filter(conversation_id=0)
+            return conversation_messages(conversation)
+
+        return {
+            'index': lambda: [
+                posts.order_by(*[f'-{key}' for key in FEED_KEYS])[:page_size + 1]
+                for posts in feed_querysets(viewer, materialized)
+            ],
+            'request_user': lambda: Post.objects.filter(user_id=viewer).order_by('-date', '-id')[:page_size + 1],
+            'searched_user': lambda: (
+                Post.objects.visible_to(viewer).filter(user_id=other).order_by('-date', '-id')[:page_size + 1]
+            ),
+            'categories': lambda: Category.objects.all(),
+            'posts_by_category': lambda: (
+                Post.objects.visible_to(viewer).filter(category_id=category_pk)
+                .order_by('-date', '-id')[:page_size + 1]
+            ),
+            'comments_by_post': lambda: (
+                Comment.objects.visible_to(viewer).filter(post_id=post_pk).order_by('date', 'id')[:page_size + 1]
+            ),
+            'read_message': lambda: messages().order_by('-send_data', '-id')[:page_size + 1],
+            'read_blocked_user': lambda: BlockedUser.objects.filter(blocked_user=viewer),
+        }
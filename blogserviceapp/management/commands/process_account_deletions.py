@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blogserviceapp.accounts import delete_account
+from blogserviceapp.models import AccountDeletion
+
+
+class Command(BaseCommand):
+    help = "Finish pending account deletions, resuming each from the step it had reached."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help="Only this user id; repeatable.")
+        parser.add_argument('--batch-size', type=int, default=settings.ACCOUNT_DELETION['BATCH_SIZE'])
+        parser.add_argument('--status', action='store_true', help="List pending deletions without running them.")
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        pending = AccountDeletion.objects.filter(completed_at__isnull=True).order_by('requested_at')
+        if options['users']:
+            pending = pending.filter(pk__in=options['users'])
+
+        for deletion in pending:
+            if options['status']:
+                self.describe(deletion)
+                continue
+            self.stdout.write(f"Deleting account {deletion.pk} from step {deletion.step or 'start'}.")
+            finished = delete_account(deletion.pk, options['batch_size'], progress=self.progress)
+            if finished is not None:
+                self.stdout.write(f"Account {deletion.pk} deleted: {finished.deleted_rows} rows.")
+
+    def progress(self, deletion):
+        if self.verbosity > 1:
+            self.describe(deletion)
+
+    def describe(self, deletion):
+        self.stdout.write(
+            f"Account {deletion.pk}: step {deletion.step or 'pending'}, {deletion.deleted_rows} rows deleted, "
+            f"requested {deletion.requested_at:%Y-%m-%d %H:%M}."
+        )
@@ -0,0 +1,68 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from blogserviceapp.models import Conversation
+from blogserviceapp.routers import message_shards
+from blogserviceapp.sharding import move_conversation, place, sweep_strays
+
+
+class Command(BaseCommand):
+    help = (
+        "Move conversations to the shard their user pair hashes to under the current MESSAGE_SHARDS, "
+        "then delete the messages interrupted moves left behind. To drain a shard, drop it from "
+        "MESSAGE_SHARDS but keep its DATABASES entry until this has run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--limit', type=int, help="Move at most this many conversations.")
+        parser.add_argument('--dry-run', action='store_true', help="Report the moves without making them.")
+
+    def handle(self, *args, **options):
+        shards = message_shards()
+        unknown = [alias for alias in shards if alias not in connections]
+        if unknown:
+            raise CommandError(f"MESSAGE_SHARDS names databases that are not configured: {', '.join(unknown)}.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        conversations = Conversation.objects.only('pk', 'user_low', 'user_high', 'shard').order_by('pk')
+        placement = Counter()
+        moves = []
+        for conversation in conversations.iterator(chunk_size=options['batch_size']):
+            placement[conversation.shard] += 1
+            target = place(conversation.user_low_id, conversation.user_high_id, shards)
+            if target != conversation.shard:
+                moves.append((conversation.pk, conversation.shard, target))
+        if options['limit'] is not None:
+            moves = moves[:options['limit']]
+
+        for alias, count in sorted(placement.items()):
+            self.stdout.write(f"{alias}: {count} conversations.")
+        self.stdout.write(f"{len(moves)} conversations to move.")
+        if options['dry_run']:
+            for conversation_id, source, target in moves:
+                self.stdout.write(f"  conversation {conversation_id}: {source} -> {target}")
+            return
+
+        moved = messages = 0
+        for conversation_id, source, target in moves:
+            if source not in connections:
+                self.stderr.write(f"Conversation {conversation_id} is on {source}, which is not configured; skipped.")
+                continue
+            count = move_conversation(conversation_id, target, options['batch_size'])
+            if count is None:
+                continue
+            moved += 1
+            messages += count
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  conversation {conversation_id}: {source} -> {target}, {count} messages")
+        self.stdout.write(f"Moved {moved} conversations, {messages} messages.")
+
+        for alias in dict.fromkeys([*shards, *placement]):
+            if alias in connections:
+                swept = sweep_strays(alias, options['batch_size'])
+                if swept:
+                    self.stdout.write(f"Swept leftovers of {swept} conversations from {alias}.")
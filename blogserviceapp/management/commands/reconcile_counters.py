@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from blogserviceapp.models import Category, Comment, Post, User, UserCounters
+
+
+class Command(BaseCommand):
+    help = "Recount the denormalized post, comment and per-user counters in batches and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without writing.")
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.reconcile(Category, 'post_count', Post, 'category_id')
+        self.reconcile(Post, 'comment_count', Comment, 'post_id')
+        self.reconcile_users()
+
+    def batches(self, model):
+        last = 0
+        while True:
+            ids = list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+            if not ids:
+                return
+            yield ids
+            last = ids[-1]
+
+    def recount(self, model, field, ids):
+        rows = model.objects.filter(**{f'{field}__in': ids}).order_by().values_list(field).annotate(n=Count('pk'))
+        return dict(rows)
+
+    def reconcile(self, model, counter, counted_model, field):
+        fixed = 0
+        for ids in self.batches(model):
+            with transaction.atomic():
+                # Locking the batch makes concurrent F() updates wait until the recount is written.
+                stored = dict(model.objects.select_for_update().filter(pk__in=ids).values_list('pk', counter))
+                actual = self.recount(counted_model, field, ids)
+                for pk, value in stored.items():
+                    if value != actual.get(pk, 0):
+                        fixed += 1
+                        if not self.dry_run:
+                            model.objects.filter(pk=pk).update(**{counter: actual.get(pk, 0)})
+        self.report(f"{model.__name__}.{counter}", fixed)
+
+    def reconcile_users(self):
+        fixed = 0
+        for ids in self.batches(User):
+            with transaction.atomic():
+                stored = {
+                    pk: (posts, comments)
+                    for pk, posts, comments in UserCounters.objects.select_for_update()
+                    .filter(user_id__in=ids).values_list('user_id', 'post_count', 'comment_count')
+                }
+                posts = self.recount(Post, 'user_id', ids)
+                comments = self.recount(Comment, 'user_id', ids)
+                drifted = [
+                    UserCounters(user_id=pk, post_count=posts.get(pk, 0), comment_count=comments.get(pk, 0))
+                    for pk in ids
+                    if stored.get(pk, (0, 0)) != (posts.get(pk, 0), comments.get(pk, 0))
+                ]
+                fixed += len(drifted)
+                if drifted and not self.dry_run:
+                    UserCounters.objects.bulk_create(
+                        drifted,
+                        update_conflicts=True,
+                        unique_fields=['user'],
+                        update_fields=['post_count', 'comment_count'],
+                    )
+        self.report("UserCounters", fixed)
+
+    def report(self, label, fixed):
+        verb = "would fix" if self.dry_run else "fixed"
+        self.stdout.write(f"{label}: {verb} {fixed} rows.")
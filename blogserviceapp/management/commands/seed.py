@@ -0,0 +1,389 @@
+import io
+import json
+import math
+import random
+import time
+from array import array
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models import BooleanField, DateField, DateTimeField, JSONField
+from django.utils import timezone
+
+from blogserviceapp.categories import invalidate_categories
+from blogserviceapp.models import (
+    BlockedUser, Category, Comment, Conversation, ConversationParticipant, Message, Post, User, UserCounters,
+)
+from blogserviceapp.stamps import CATEGORIES_KEY, bump
+
+WORDS = (
+    "python django postgres cache index query latency budget feed timeline block message comment "
+    "category image search async worker queue batch shard replica deploy metric profile travel food "
+    "music garden winter summer city river mountain coffee book film code review release bug fix"
+).split()
+
+
+def zipf_sampler(rng, n, exponent):
+    """Return a function drawing ranks in ``range(n)`` with P(rank) ~ 1 / (rank + 1) ** exponent.
+
+    Inverse-transform sampling of the continuous bounded power law, so it needs
+    no table of n weights.
+    """
+    if exponent <= 0:
+        return lambda: rng.randrange(n)
+    if abs(exponent - 1) < 1e-9:
+        return lambda: min(n - 1, int(math.exp(rng.random() * math.log(n + 1))) - 1)
+    power = 1 - exponent
+    span = (n + 1) ** power - 1
+    return lambda: min(n - 1, int((span * rng.random() + 1) ** (1 / power)) - 1)
+
+
+def scatter(n):
+    """Return a bijection of ``range(n)`` so the highest power-law ranks land on unrelated ids."""
+    stride = max(1, int(n * 0.618))
+    while math.gcd(stride, n) != 1:
+        stride += 1
+    return lambda rank: rank * stride % n
+
+
+class CopyLoader:
+    """Postgres: stream rows with ``COPY ... FROM STDIN`` in text format."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def load(self, model, fields, rows):
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in fields)
+        encoders = [self.encoder(model._meta.get_field(name)) for name in fields]
+        sql = f"COPY {table} ({columns}) FROM STDIN"
+        count = 0
+        with connection.cursor() as cursor:
+            for batch in _batches(rows, self.batch_size):
+                buffer = io.StringIO()
+                for row in batch:
+                    buffer.write('\t'.join([encode(value) for encode, value in zip(encoders, row)]))
+                    buffer.write('\n')
+                self.copy(cursor.cursor, sql, buffer)
+                count += len(batch)
+        return count
+
+    def copy(self, raw_cursor, sql, buffer):
+        if hasattr(raw_cursor, 'copy'):
+            # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            buffer.seek(0)
+            raw_cursor.copy_expert(sql, buffer)
+
+    def encoder(self, field):
+        if isinstance(field, BooleanField):
+            convert = lambda value: 't' if value else 'f'
+        elif isinstance(field, JSONField):
+            convert = lambda value: _escape(json.dumps(value))
+        elif isinstance(field, (DateTimeField, DateField)):
+            convert = lambda value: value.isoformat()
+        else:
+            convert = lambda value: _escape(str(value))
+        return lambda value: '\\N' if value is None else convert(value)
+
+
+class SqliteLoader:
+    """SQLite: ``executemany`` of one prepared INSERT per batch, skipping model instances."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def load(self, model, fields, rows):
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in fields)
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(fields))})"
+        adapters = [self.adapter(model._meta.get_field(name)) for name in fields]
+        count = 0
+        with connection.cursor() as cursor:
+            for batch in _batches(rows, self.batch_size):
+                cursor.executemany(sql, [[adapt(value) for adapt, value in zip(adapters, row)] for row in batch])
+                count += len(batch)
+        return count
+
+    def adapter(self, field):
+        if isinstance(field, JSONField):
+            return json.dumps
+        if isinstance(field, DateTimeField):
+            return connection.ops.adapt_datetimefield_value
+        if isinstance(field, DateField):
+            return connection.ops.adapt_datefield_value
+        return lambda value: value
+
+
+class BulkCreateLoader:
+    """Any backend: ``bulk_create`` in batches."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def load(self, model, fields, rows):
+        attnames = [model._meta.get_field(name).attname for name in fields]
+        count = 0
+        for batch in _batches(rows, self.batch_size):
+            model.objects.bulk_create([model(**dict(zip(attnames, row))) for row in batch], batch_size=self.batch_size)
+            count += len(batch)
+        return count
+
+
+LOADERS = {
+    'copy': CopyLoader,
+    'sqlite': SqliteLoader,
+    'bulk': BulkCreateLoader,
+}
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a reproducible synthetic dataset: users, categories, posts, comments, blocks and "
+        "conversations, with power-law authors, hot posts and conversations. Rows get explicit ids, "
+        "so run it while nothing else writes to the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--conversations', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--blocks-per-user', type=float, default=2.0, help="Average block edges per user.")
+        parser.add_argument('--author-exponent', type=float, default=1.1, help="Power-law exponent of posts per author.")
+        parser.add_argument('--hot-post-exponent', type=float, default=1.2, help="Power-law exponent of comments per post.")
+        parser.add_argument('--conversation-exponent', type=float, default=1.0, help="Power-law exponent of messages per conversation.")
+        parser.add_argument('--days', type=int, default=365, help="Spread post dates over this many days up to today.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='seed', help="Username prefix; the seed is appended.")
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--method', choices=['auto', *LOADERS], default='auto')
+
+    def handle(self, *args, **options):
+        for name in ('users', 'categories', 'posts', 'days', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be at least 1.")
+        if min(options['comments'], options['conversations'], options['messages'], options['blocks_per_user']) < 0:
+            raise CommandError("Counts cannot be negative.")
+        if options['users'] < 2 and (options['conversations'] or options['blocks_per_user']):
+            raise CommandError("Conversations and blocks need at least two users.")
+
+        self.options = options
+        self.prefix = f"{options['prefix']}{options['seed']}-"
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(f"Users named {self.prefix}* already exist; pick another --seed or --prefix.")
+
+        method = options['method']
+        if method == 'auto':
+            method = {'postgresql': 'copy', 'sqlite': 'sqlite'}.get(connection.vendor, 'bulk')
+        if method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError("--method copy needs PostgreSQL.")
+        if method == 'sqlite' and connection.vendor != 'sqlite':
+            raise CommandError("--method sqlite needs SQLite.")
+        self.loader = LOADERS[method](options['batch_size'])
+        self.verbosity = options['verbosity']
+
+        started = time.perf_counter()
+        self.total = 0
+        with transaction.atomic():
+            self.seed()
+            # Every loader writes explicit ids, which leave PostgreSQL's sequences behind.
+            self.reset_sequences()
+        invalidate_categories()
+        bump(CATEGORIES_KEY)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Seeded {self.total} rows in {elapsed:.1f}s ({self.total / elapsed:.0f} rows/s) "
+            f"with {method} on {connection.vendor}."
+        )
+
+    def seed(self):
+        options = self.options
+        rng = random.Random(options['seed'])
+        n_users = options['users']
+
+        self.first_user = self.next_id(User)
+        self.first_category = self.next_id(Category)
+        self.first_post = self.next_id(Post)
+        self.first_message = self.next_id(Message)
+        self.first_conversation = self.next_id(Conversation)
+        self.user_posts = array('I', bytes(4 * n_users))
+        self.user_comments = array('I', bytes(4 * n_users))
+        self.author_of = zipf_sampler(rng, n_users, options['author_exponent'])
+        self.author_order = scatter(n_users)
+
+        self.load(User, ['id', 'username', 'password', 'is_superuser', 'is_staff', 'is_active',
+                         'first_name', 'last_name', 'email', 'date_joined'], self.user_rows())
+        self.load(Category, ['id', 'name', 'description', 'post_count'], self.category_rows())
+
+        # Comments per post are drawn up front so posts are written with their final count.
+        post_comments = self.distribute(rng, options['comments'], options['posts'], options['hot_post_exponent'])
+        category_posts = array('I', bytes(4 * options['categories']))
+        self.load(Post, ['id', 'title', 'description', 'image', 'image_variants', 'category_id', 'user_id',
+                         'date', 'fanned_out', 'comment_count'],
+                  self.post_rows(rng, post_comments, category_posts))
+        self.load(Comment, ['description', 'post_id', 'user_id', 'date'], self.comment_rows(rng, post_comments))
+        for index, count in enumerate(category_posts):
+            if count:
+                Category.objects.filter(pk=self.first_category + index).update(post_count=count)
+
+        self.load(BlockedUser, ['id_user', 'blocked_user'], self.block_rows(rng))
+        self.seed_conversations(rng)
+        self.load(UserCounters, ['user', 'post_count', 'comment_count'], (
+            (self.first_user + i, self.user_posts[i], self.user_comments[i]) for i in range(n_users)
+        ))
+
+    def load(self, model, fields, rows):
+        started = time.perf_counter()
+        count = self.loader.load(model, fields, rows)
+        self.total += count
+        if self.verbosity > 1:
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"  {model.__name__}: {count} rows in {elapsed:.1f}s")
+        return count
+
+    def next_id(self, model):
+        last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+        return (last or 0) + 1
+
+    def reset_sequences(self):
+        models = [User, Category, Post, Comment, BlockedUser, Message, Message.sender.through, Conversation,
+                  ConversationParticipant]
+        with connection.cursor() as cursor:
+            for statement in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(statement)
+
+    def distribute(self, rng, total, buckets, exponent, minimum=0):
+        """Spread ``total`` items over ``buckets`` by a scattered power law; each gets ``minimum`` first."""
+        counts = array('I', [minimum]) * buckets
+        draw, order = zipf_sampler(rng, buckets, exponent), scatter(buckets)
+        for _ in range(total - minimum * buckets):
+            counts[order(draw())] += 1
+        return counts
+
+    def random_author(self):
+        return self.author_order(self.author_of())
+
+    def text(self, rng, words):
+        return ' '.join(rng.choices(WORDS, k=words))
+
+    def user_rows(self):
+        password = make_password(None)
+        now = timezone.now()
+        for i in range(self.options['users']):
+            yield (self.first_user + i, f"{self.prefix}{i}", password, False, False, True, '', '', '', now)
+
+    def category_rows(self):
+        for i in range(self.options['categories']):
+            yield (self.first_category + i, f"{self.prefix}category-{i}", '', 0)
+
+    def post_rows(self, rng, post_comments, category_posts):
+        n_posts, days = self.options['posts'], self.options['days']
+        start = date.today() - timedelta(days=days - 1)
+        n_categories = len(category_posts)
+        for i in range(n_posts):
+            author = self.random_author()
+            category = rng.randrange(n_categories)
+            self.user_posts[author] += 1
+            category_posts[category] += 1
+            # Ids follow the dates, as they would for posts written over time.
+            posted = start + timedelta(days=i * days // n_posts)
+            yield (self.first_post + i, self.text(rng, 4), self.text(rng, 16), '', {},
+                   self.first_category + category, self.first_user + author, posted, True, post_comments[i])
+
+    def comment_rows(self, rng, post_comments):
+        n_posts, days = self.options['posts'], self.options['days']
+        today = date.today()
+        start = today - timedelta(days=days - 1)
+        for i, count in enumerate(post_comments):
+            posted = start + timedelta(days=i * days // n_posts)
+            for _ in range(count):
+                author = self.random_author()
+                self.user_comments[author] += 1
+                commented = min(today, posted + timedelta(days=int(rng.expovariate(0.5))))
+                yield (self.text(rng, 8), self.first_post + i, self.first_user + author, commented)
+
+    def block_rows(self, rng):
+        n_users = self.options['users']
+        wanted = min(int(n_users * self.options['blocks_per_user']), n_users * (n_users - 1))
+        edges = set()
+        attempts = 0
+        # Blockers are uniform; the prolific authors are the ones who get blocked.
+        while len(edges) < wanted and attempts < wanted * 10:
+            attempts += 1
+            blocker, blocked = rng.randrange(n_users), self.random_author()
+            if blocker != blocked:
+                edges.add((blocker, blocked))
+        for blocker, blocked in sorted(edges):
+            yield (self.first_user + blocker, self.first_user + blocked)
+
+    def seed_conversations(self, rng):
+        options = self.options
+        n_users = options['users']
+        wanted = min(options['conversations'], options['messages'], n_users * (n_users - 1) // 2)
+        pairs = {}
+        attempts = 0
+        while len(pairs) < wanted and attempts < wanted * 10:
+            attempts += 1
+            one, other = self.random_author(), rng.randrange(n_users)
+            if one != other:
+                pairs.setdefault(tuple(sorted((one, other))), None)
+        pairs = list(pairs)
+        if not pairs:
+            return
+
+        # Every conversation starts with a message; the rest go mostly to a few busy ones.
+        per_conversation = self.distribute(
+            rng, options['messages'], len(pairs), options['conversation_exponent'], minimum=1,
+        )
+        now = timezone.now()
+        window = timedelta(days=options['days']).total_seconds()
+        conversations, participants, senders, messages = [], [], [], []
+        message_id = self.first_message
+        for index, ((low, high), count) in enumerate(zip(pairs, per_conversation)):
+            conversation_id = self.first_conversation + index
+            low_id, high_id = self.first_user + low, self.first_user + high
+            sent = sorted(now - timedelta(seconds=rng.random() * window) for _ in range(count))
+            for sent_at in sent:
+                author, recipient = (low_id, high_id) if rng.random() < 0.5 else (high_id, low_id)
+                messages.append((message_id, author, self.text(rng, 10), sent_at, conversation_id))
+                senders.append((message_id, recipient))
+                message_id += 1
+            conversations.append((conversation_id, low_id, high_id, message_id - 1, sent[-1], count, DEFAULT_DB_ALIAS))
+            participants.append((conversation_id, low_id, high_id, 0, sent[-1]))
+            participants.append((conversation_id, high_id, low_id, 0, sent[-1]))
+            if len(messages) >= options['batch_size']:
+                self.flush_conversations(conversations, participants, senders, messages)
+                conversations, participants, senders, messages = [], [], [], []
+        self.flush_conversations(conversations, participants, senders, messages)
+
+    def flush_conversations(self, conversations, participants, senders, messages):
+        # Every conversation is written to default; rebalance_message_shards spreads them over the shards.
+        self.load(Message, ['id', 'author', 'description', 'send_data', 'conversation'], messages)
+        self.load(Message.sender.through, ['message', 'user'], senders)
+        self.load(Conversation, ['id', 'user_low', 'user_high', 'last_message', 'last_message_at', 'message_count',
+                                 'shard'], conversations)
+        self.load(ConversationParticipant, ['conversation', 'user', 'other_user', 'unread_count', 'last_message_at'],
+                  participants)
@@ -0,0 +1,317 @@
+import gc
+import logging
+import math
+import os
+import random
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers import basehttp
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer, get_internal_wsgi_application
+from django.db import DatabaseError, connections
+from django.urls import get_resolver
+
+from blogserviceapp import tasks
+from blogserviceapp.logpipeline import stop_pipelines
+
+logger = logging.getLogger(__name__)
+
+CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_CPU_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_V1_CPU_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+# A worker that fails within this many seconds of its fork failed to start. Its
+# replacement waits twice as long as the last one did, up to RESPAWN_MAX_DELAY,
+# and the server gives up after MAX_FAILED_STARTS of them in a row.
+STARTUP_SECONDS = 1
+RESPAWN_DELAY = 0.1
+RESPAWN_MAX_DELAY = 5
+MAX_FAILED_STARTS = 10
+
+
+def cgroup_cpu_quota():
+    """The container's CPU quota in CPUs, or None when it has none."""
+    try:
+        with open(CGROUP_V2_CPU_MAX) as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(CGROUP_V1_CPU_QUOTA) as f:
+            quota = int(f.read())
+        with open(CGROUP_V1_CPU_PERIOD) as f:
+            period = int(f.read())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def cpu_limit():
+    """CPUs this process can use: the cgroup quota, capped by the CPUs it may run on."""
+    available = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    return min(quota, available) if quota else available
+
+
+def default_workers(cpus):
+    # A worker serves one request at a time and spends much of it waiting on the database.
+    return math.ceil(cpus * 2) + 1
+
+
+def warm_urls():
+    """Build the resolver's reverse lookups and compile every URL pattern."""
+    resolver = get_resolver()
+    resolver.reverse_dict  # noqa: B018 populates the resolver
+    _compile(resolver.url_patterns)
+
+
+def _compile(patterns):
+    for entry in patterns:
+        entry.pattern.regex  # noqa: B018 compiled on first access
+        if hasattr(entry, 'url_patterns'):
+            _compile(entry.url_patterns)
+
+
+class PreforkServer(WSGIServer):
+    """Django's WSGI server, with its listening socket shared by forked workers."""
+
+    request_queue_size = 1024
+    # handle_request() returns at least this often, so an idle worker notices SIGTERM.
+    timeout = 1
+
+    def server_activate(self):
+        super().server_activate()
+        # Every worker waits on the socket; those that lose the race to accept() go back to waiting.
+        self.socket.setblocking(False)
+
+    def finish_request(self, request, client_address):
+        super().finish_request(request, client_address)
+        self.handled += 1
+
+
+class ServerHandler(basehttp.ServerHandler):
+    def sendfile(self):
+        """Send a FileResponse's file with os.sendfile(): Content-Length bytes from its current position.
+
+        The file never passes through Python; media ranges come positioned at
+        their first byte.
+        """
+        try:
+            fileno = self.result.filelike.fileno()
+        except (AttributeError, OSError, ValueError):
+            return False
+        length = self.headers.get('Content-Length')
+        if length is None:
+            return False
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+        offset = os.lseek(fileno, 0, os.SEEK_CUR)
+        with open(fileno, 'rb', closefd=False) as file:
+            self.bytes_sent += self.request_handler.connection.sendfile(file, offset, int(length))
+        return True
+
+
+class RequestHandler(WSGIRequestHandler):
+    # A slow client cannot hold a worker for longer than this, in seconds.
+    timeout = 30
+
+    def handle_one_request(self):
+        """WSGIRequestHandler.handle_one_request(), with the ServerHandler that can sendfile()."""
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ())
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the WSGI app with pre-forked workers: the app, URL resolver and templates are loaded "
+        "once before forking, each worker connects to the databases before it accepts requests, and "
+        "workers are replaced after --max-requests. SIGTERM or SIGINT stops gracefully; SIGHUP "
+        "replaces every worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='0.0.0.0:13000', help="host:port to listen on.")
+        parser.add_argument(
+            '--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', 0)) or None,
+            help="Defaults to WEB_CONCURRENCY, else 2 per CPU of the container's quota, plus one.",
+        )
+        parser.add_argument('--max-requests', type=int, default=1000, help="Replace a worker after this many; 0 never.")
+        parser.add_argument('--max-requests-jitter', type=int, default=100,
+                            help="Up to this many more per worker, so they are not all replaced at once.")
+        parser.add_argument('--graceful-timeout', type=float, default=30,
+                            help="Seconds workers get to finish their request and background tasks when stopping.")
+        parser.add_argument('--timeout', type=float, default=RequestHandler.timeout,
+                            help="Seconds a client may take to send its request or read the response.")
+
+    def handle(self, *args, **options):
+        host, _, port = options['bind'].rpartition(':')
+        if not host or not port.isdigit():
+            raise CommandError("--bind must be host:port.")
+        host = host.strip('[]')
+        cpus = cpu_limit()
+        workers = options['workers'] or default_workers(cpus)
+        if workers < 1 or options['max_requests'] < 0 or options['max_requests_jitter'] < 0:
+            raise CommandError("--workers must be at least 1 and the request limits cannot be negative.")
+        if settings.DEBUG:
+            self.stderr.write("DEBUG is on, so every worker keeps a log of its queries; set DJANGO_DEBUG=0.")
+
+        # Everything loaded here is shared copy-on-write by the workers.
+        application = get_internal_wsgi_application()
+        warm_urls()
+        # Connections opened so far must not be shared with the children.
+        connections.close_all()
+        RequestHandler.timeout = options['timeout']
+        server = PreforkServer((host, int(port)), RequestHandler, ipv6=':' in host)
+        server.set_app(application)
+        # Move what is loaded into the permanent generation, so collections in the
+        # workers do not touch (and copy) the shared pages.
+        gc.collect()
+        gc.freeze()
+
+        self.options = options
+        self.server = server
+        self.workers = {}
+        self.failed_starts = 0
+        self.respawn_at = 0
+        self.stopping = False
+        self.replacing = False
+        self.stdout.write(
+            f"Listening on {host}:{server.server_port} with {workers} workers "
+            f"({cpus:g} CPUs, pid {os.getpid()})."
+        )
+        self.stdout.flush()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.replace_workers)
+        try:
+            self.supervise(workers)
+        finally:
+            self.shutdown()
+            server.server_close()
+        self.stdout.write("Stopped.")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def replace_workers(self, signum, frame):
+        self.replacing = True
+
+    def supervise(self, count):
+        while not self.stopping:
+            if self.replacing:
+                self.replacing = False
+                logger.info("Replacing %s workers.", len(self.workers))
+                self.signal_workers(signal.SIGTERM)
+            while len(self.workers) < count and not self.stopping and time.monotonic() >= self.respawn_at:
+                self.spawn()
+            self.reap()
+            time.sleep(0.1)
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return
+        status = 0
+        try:
+            self.work()
+        except BaseException:
+            logger.exception("Worker %s failed.", os.getpid())
+            status = 1
+        finally:
+            # os._exit() skips the wait for the background tasks; what they have
+            # queued, such as image variants and timeline fan-out, would be lost.
+            tasks.shutdown(timeout=self.options['graceful_timeout'])
+            stop_pipelines()
+            os._exit(status)
+
+    def reap(self):
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            started = self.workers.pop(pid, None)
+            code = os.waitstatus_to_exitcode(status)
+            if code:
+                logger.warning("Worker %s exited with %s.", pid, code)
+            if started is None or self.stopping:
+                continue
+            if code and time.monotonic() - started < STARTUP_SECONDS:
+                self.failed_start()
+            else:
+                self.failed_starts = 0
+
+    def failed_start(self):
+        self.failed_starts += 1
+        if self.failed_starts >= MAX_FAILED_STARTS:
+            raise CommandError(f"Workers failed to start {self.failed_starts} times in a row; giving up.")
+        delay = min(RESPAWN_DELAY * 2 ** self.failed_starts, RESPAWN_MAX_DELAY)
+        logger.warning("Worker failed to start; starting the next in %.1fs.", delay)
+        self.respawn_at = time.monotonic() + delay
+
+    def signal_workers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                self.workers.pop(pid, None)
+
+    def shutdown(self):
+        self.stopping = True
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + self.options['graceful_timeout']
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        if self.workers:
+            logger.warning("Killing %s workers still busy after %ss.", len(self.workers), self.options['graceful_timeout'])
+            self.signal_workers(signal.SIGKILL)
+            while self.workers:
+                pid, _ = os.waitpid(-1, 0)
+                self.workers.pop(pid, None)
+
+    def work(self):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        # Ctrl-C reaches the whole process group; the master decides when workers stop.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+        self.connect()
+        limit = self.options['max_requests']
+        if limit:
+            limit += random.randint(0, self.options['max_requests_jitter'])
+        master = os.getppid()
+        server = self.server
+        server.handled = 0
+        while not stopping and not (limit and server.handled >= limit) and os.getppid() == master:
+            server.handle_request()
+        if limit and server.handled >= limit:
+            logger.info("Worker %s replaced after %s requests.", os.getpid(), server.handled)
+        connections.close_all()
+
+    def connect(self):
+        # Persistent connections opened now spare the first requests the handshake;
+        # without CONN_MAX_AGE the first request would close them again.
+        for alias in connections:
+            if not connections[alias].settings_dict['CONN_MAX_AGE']:
+                continue
+            try:
+                connections[alias].ensure_connection()
+            except DatabaseError as e:
+                logger.warning("Worker %s could not connect to %s: %s", os.getpid(), alias, e)
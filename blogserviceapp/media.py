@@ -0,0 +1,181 @@
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.http import parse_http_date_safe
+
+# Python only knows these from 3.11 and 3.13 on; the image variants are written in them.
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('image/avif', '.avif')
+
+# images._save_variant() names derivatives {stem}.{sha256[:16]}.{spec sha256[:8]}.{variant}.{ext},
+# so their bytes never change under a name.
+CONTENT_ADDRESSED = re.compile(r'\.[0-9a-f]{16}\.[0-9a-f]{8}\.[^./]+\.[^./]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def resolve(name):
+    """Return the path of the regular file ``name`` under MEDIA_ROOT and its stat, or raise Http404."""
+    name = posixpath.normpath(name).lstrip('/')
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        st = os.stat(path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404("No such media file.")
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404("No such media file.")
+    return name, path, st
+
+
+def media_etag(st):
+    # Strong, and the ETag nginx gives the same file, so it does not change when
+    # the x-accel-redirect backend hands the body to nginx.
+    return f'"{int(st.st_mtime):x}-{st.st_size:x}"'
+
+
+def cache_control(name):
+    if CONTENT_ADDRESSED.search(name):
+        return IMMUTABLE
+    return f"public, max-age={settings.MEDIA_SERVING['MAX_AGE']}"
+
+
+def content_type(name):
+    guessed, encoding = mimetypes.guess_type(name)
+    # Like FileResponse: a compressed file is sent as it is, not decoded by the browser.
+    if encoding:
+        return {'gzip': 'application/gzip', 'bzip2': 'application/x-bzip', 'xz': 'application/x-xz'}.get(
+            encoding, 'application/octet-stream'
+        )
+    return guessed or 'application/octet-stream'
+
+
+def requested_range(request, size, etag, last_modified):
+    """Return the ``(first, last)`` bytes a GET asked for, or None to send the whole file.
+
+    Only a single range is served; a multi-range or malformed request gets
+    the whole file, as RFC 9110 allows, and so does one whose If-Range no
+    longer matches.
+    """
+    header = request.META.get('HTTP_RANGE')
+    if not header or request.method != 'GET':
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            # Only a strong ETag may validate a range.
+            if if_range != etag:
+                return None
+        elif parse_http_date_safe(if_range) != last_modified:
+            return None
+    match = BYTE_RANGE.match(header.replace(' ', ''))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        if last and int(last) < first:
+            return None
+        last = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # The last N bytes.
+        suffix = int(last)
+        if not suffix:
+            raise RangeNotSatisfiable
+        first, last = max(size - suffix, 0), size - 1
+    else:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable
+    return first, last
+
+
+class RangeFile:
+    """The bytes ``first`` to ``last`` of an open file.
+
+    ``fileno()`` is positioned at ``first``, so a WSGI server that sends the
+    file with ``sendfile()`` for the response's Content-Length sends exactly
+    the range; the others read it in blocks.
+    """
+
+    def __init__(self, file, first, last):
+        self.file = file
+        self.file.seek(first)
+        self.remaining = last - first + 1
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_response(request, name, path, st, etag):
+    """Stream the file from the app, through the WSGI server's ``wsgi.file_wrapper``."""
+    try:
+        byte_range = requested_range(request, st.st_size, etag, int(st.st_mtime))
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{st.st_size}'
+        return response
+    try:
+        file = open(path, 'rb')
+    except OSError:
+        raise Http404("No such media file.")
+    if byte_range is None:
+        return FileResponse(file, content_type=content_type(name))
+    first, last = byte_range
+    response = FileResponse(RangeFile(file, first, last), status=206, content_type=content_type(name))
+    response['Content-Length'] = last - first + 1
+    response['Content-Range'] = f'bytes {first}-{last}/{st.st_size}'
+    return response
+
+
+def accel_redirect_response(request, name, path, st, etag):
+    # nginx sends the file from the internal location and answers the Range itself.
+    response = HttpResponse(content_type=content_type(name))
+    response['X-Accel-Redirect'] = settings.MEDIA_SERVING['ACCEL_REDIRECT_PREFIX'] + quote(name)
+    return response
+
+
+def sendfile_response(request, name, path, st, etag):
+    # mod_xsendfile and lighttpd send the file at this path and answer the Range themselves.
+    response = HttpResponse(content_type=content_type(name))
+    response['X-Sendfile'] = path
+    return response
+
+
+BACKENDS = {
+    'file': file_response,
+    'x-accel-redirect': accel_redirect_response,
+    'x-sendfile': sendfile_response,
+}
+
+
+def get_backend():
+    backend = settings.MEDIA_SERVING['BACKEND']
+    try:
+        return BACKENDS[backend]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"MEDIA_SERVING['BACKEND'] is {backend!r}; expected one of {', '.join(BACKENDS)}."
+        )
@@ -0,0 +1,88 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def remove_duplicate_blocks(apps, schema_editor):
+    BlockedUser = apps.get_model('blogserviceapp', 'BlockedUser')
+    duplicates = (
+        BlockedUser.objects.values('id_user', 'blocked_user')
+        .annotate(keep=models.Min('id'), rows=models.Count('id'))
+        .filter(rows__gt=1)
+    )
+    for edge in duplicates.iterator():
+        BlockedUser.objects.filter(
+            id_user=edge['id_user'], blocked_user=edge['blocked_user']
+        ).exclude(id=edge['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blogserviceapp', '0002_message_blockeduser'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_blocks, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='blockeduser',
+            index=models.Index(fields=['blocked_user', 'id_user'], name='blockeduser_reverse_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post_id', 'date', 'id'], name='comment_post_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['author', 'send_data'], name='message_author_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-date', '-id'], name='post_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['category_id', '-date', '-id'], name='post_category_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user_id', '-date', '-id'], name='post_user_feed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='blockeduser',
+            constraint=models.UniqueConstraint(fields=('id_user', 'blocked_user'), name='unique_block_edge'),
+        ),
+        migrations.AlterField(
+            model_name='blockeduser',
+            name='blocked_user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='blocked_by_users', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='blockeduser',
+            name='id_user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='blocking_users', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='post_id',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='blogserviceapp.post'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='authored_messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='category_id',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='blogserviceapp.category'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='user_id',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
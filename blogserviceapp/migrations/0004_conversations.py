@@ -0,0 +1,120 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_conversations(apps, schema_editor):
+    Message = apps.get_model('blogserviceapp', 'Message')
+    Conversation = apps.get_model('blogserviceapp', 'Conversation')
+    ConversationParticipant = apps.get_model('blogserviceapp', 'ConversationParticipant')
+
+    conversations = {}
+    messages = Message.objects.filter(conversation__isnull=True).prefetch_related('sender').order_by('send_data', 'id')
+    for message in messages.iterator(chunk_size=2000):
+        recipients = sorted(user.pk for user in message.sender.all())
+        if not recipients:
+            continue
+        low, high = sorted((message.author_id, recipients[0]))
+        conversation = conversations.get((low, high))
+        if conversation is None:
+            conversation, _ = Conversation.objects.get_or_create(user_low_id=low, user_high_id=high)
+            conversations[(low, high)] = conversation
+            for user_id, other_id in {(low, high), (high, low)}:
+                ConversationParticipant.objects.get_or_create(
+                    conversation=conversation, user_id=user_id, defaults={'other_user_id': other_id}
+                )
+        Message.objects.filter(pk=message.pk).update(conversation=conversation)
+        conversation.last_message_id = message.pk
+        conversation.last_message_at = message.send_data
+        conversation.message_count += 1
+
+    for conversation in conversations.values():
+        conversation.save(update_fields=['last_message', 'last_message_at', 'message_count'])
+        ConversationParticipant.objects.filter(conversation=conversation).update(
+            last_message_at=conversation.last_message_at
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blogserviceapp', '0003_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ConversationParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='conversation',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='blogserviceapp.conversation'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='other_user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='blogserviceapp.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='user_high',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='user_low',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='blogserviceapp.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'send_data', 'id'], name='message_conversation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', '-last_message_at', '-id'], name='conversation_inbox_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversationparticipant',
+            constraint=models.UniqueConstraint(fields=('conversation', 'user'), name='unique_conversation_participant'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='unique_conversation_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.CheckConstraint(check=models.Q(('user_low__lte', models.F('user_high'))), name='conversation_pair_ordered'),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
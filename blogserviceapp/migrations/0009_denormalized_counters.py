@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def _count(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(n=Count('pk'))
+            .values('n'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def populate_counters(apps, schema_editor):
+    Category = apps.get_model('blogserviceapp', 'Category')
+    Post = apps.get_model('blogserviceapp', 'Post')
+    Comment = apps.get_model('blogserviceapp', 'Comment')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserCounters = apps.get_model('blogserviceapp', 'UserCounters')
+
+    Category.objects.update(post_count=_count(Post, 'category_id'))
+    Post.objects.update(comment_count=_count(Comment, 'post_id'))
+    users = User.objects.annotate(posts=_count(Post, 'user_id'), comments=_count(Comment, 'user_id'))
+    UserCounters.objects.bulk_create(
+        [
+            UserCounters(user_id=pk, post_count=posts, comment_count=comments)
+            for pk, posts, comments in users.values_list('pk', 'posts', 'comments').iterator()
+            if posts or comments
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blogserviceapp', '0008_change_stamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserCounters',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counters', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
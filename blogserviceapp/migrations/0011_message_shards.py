@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('blogserviceapp', '0010_account_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='shard',
+            field=models.CharField(default='default', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='blogserviceapp.message'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='author',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='authored_messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='messages', to='blogserviceapp.conversation'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sender',
+            field=models.ManyToManyField(db_constraint=False, related_name='sent_messages', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
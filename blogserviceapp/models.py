@@ -1,30 +1,179 @@
 from django.db import models
+from django.db.models import Exists, F, OuterRef, Q
 from django.contrib.auth.models import User
 
+class VisibleQuerySet(models.QuerySet):
+    author_field = 'user_id'
+
+    def visible_to(self, user):
+        author = OuterRef(self.author_field)
+        # Deleted accounts vanish at once; their rows are removed later, in the background.
+        queryset = self.filter(~Exists(AccountDeletion.objects.filter(user=author)))
+        if not user.is_authenticated:
+            return queryset
+        # One NOT EXISTS per block direction so each side can use its own index
+        # and the planner can pick a hash anti-join instead of a NOT IN filter.
+        blocked_by_user = BlockedUser.objects.filter(id_user=user.pk, blocked_user=author)
+        blocking_user = BlockedUser.objects.filter(id_user=author, blocked_user=user.pk)
+        return queryset.filter(~Exists(blocked_by_user), ~Exists(blocking_user))
+
+class MessageQuerySet(VisibleQuerySet):
+    author_field = 'author'
+
+class ParticipantQuerySet(VisibleQuerySet):
+    author_field = 'other_user'
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
+    post_count = models.PositiveIntegerField(default=0)
 
 class Post(models.Model):
     image = models.ImageField(upload_to='blog_images/')
+    image_variants = models.JSONField(default=dict, blank=True)
     title = models.CharField(max_length=255)
     description = models.TextField()
-    category_id = models.ForeignKey(Category, on_delete=models.CASCADE)
-    user_id = models.ForeignKey(User, on_delete=models.CASCADE)
+    category_id = models.ForeignKey(Category, on_delete=models.CASCADE, db_index=False)
+    user_id = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     date = models.DateField(auto_now_add=True)
+    # False until the post has been copied into home timelines; prolific authors' posts stay False.
+    fanned_out = models.BooleanField(default=False)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    objects = VisibleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='post_feed_idx'),
+            models.Index(fields=['-date', '-id'], condition=Q(fanned_out=False), name='post_pending_fanout_idx'),
+            models.Index(fields=['category_id', '-date', '-id'], name='post_category_feed_idx'),
+            models.Index(fields=['user_id', '-date', '-id'], name='post_user_feed_idx'),
+        ]
+
+    def image_url(self, variant='thumbnail'):
+        # Variants are generated in the background; serve the original until they exist.
+        path = self.image_variants.get(variant)
+        if path:
+            return self.image.storage.url(path)
+        return self.image.url if self.image else ''
 
 class Comment(models.Model):
     description = models.TextField()
-    post_id = models.ForeignKey(Post, on_delete=models.CASCADE)
+    post_id = models.ForeignKey(Post, on_delete=models.CASCADE, db_index=False)
     user_id = models.ForeignKey(User, on_delete=models.CASCADE)
     date = models.DateField(auto_now_add=True)
 
+    objects = VisibleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post_id', 'date', 'id'], name='comment_post_thread_idx'),
+        ]
+
 class Message(models.Model):
-    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='authored_messages')
-    sender = models.ManyToManyField(User, related_name='sent_messages')
+    # Messages live on the shard of their conversation (Conversation.shard) while users and
+    # conversations stay on default, so none of these references can be a database constraint.
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='authored_messages', db_index=False, db_constraint=False)
+    sender = models.ManyToManyField(User, related_name='sent_messages', db_constraint=False)
     description = models.TextField()
     send_data = models.DateTimeField(auto_now_add=True)
+    conversation = models.ForeignKey('Conversation', on_delete=models.DO_NOTHING, null=True, blank=True, related_name='messages', db_index=False, db_constraint=False)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', 'send_data'], name='message_author_sent_idx'),
+            models.Index(fields=['conversation', 'send_data', 'id'], name='message_conversation_idx'),
+        ]
+
+class Conversation(models.Model):
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='+', db_constraint=False)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    # The database alias holding this conversation's messages; see sharding.place().
+    shard = models.CharField(max_length=64, default='default')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_conversation_pair'),
+            models.CheckConstraint(check=Q(user_low__lte=F('user_high')), name='conversation_pair_ordered'),
+        ]
+
+class ConversationParticipant(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='participants', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations', db_index=False)
+    other_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ParticipantQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='unique_conversation_participant'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_message_at', '-id'], name='conversation_inbox_idx'),
+        ]
 
 class BlockedUser(models.Model):
-    blocked_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blocked_by_users')
-    id_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blocking_users')
\ No newline at end of file
+    blocked_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blocked_by_users', db_index=False)
+    id_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blocking_users', db_index=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['id_user', 'blocked_user'], name='unique_block_edge'),
+        ]
+        indexes = [
+            models.Index(fields=['blocked_user', 'id_user'], name='blockeduser_reverse_idx'),
+        ]
+
+class HomeTimeline(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='home_timeline')
+    active_at = models.DateTimeField()
+    backfilled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active_at'], name='hometimeline_active_idx'),
+        ]
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-date', '-post'], name='timeline_feed_idx'),
+            models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ]
+
+class ChangeStamp(models.Model):
+    key = models.CharField(max_length=100, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+class UserCounters(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='counters')
+    post_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+
+class AccountDeletion(models.Model):
+    # No database constraint: the tombstone outlives the user row it describes.
+    user = models.OneToOneField(
+        User, on_delete=models.DO_NOTHING, db_constraint=False, primary_key=True, related_name='deletion'
+    )
+    requested_at = models.DateTimeField(auto_now_add=True)
+    step = models.CharField(max_length=30, blank=True)
+    deleted_rows = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
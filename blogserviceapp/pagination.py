@@ -0,0 +1,190 @@
+import asyncio
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import JsonResponse
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, previous_cursor=None, request=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_url = _page_url(request, next_cursor) if next_cursor else None
+        self.previous_url = _page_url(request, previous_cursor) if previous_cursor else None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'k': values, 'd': direction}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, queryset, keys):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        values, direction = payload['k'], payload['d']
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        raise InvalidCursor("Malformed cursor.")
+
+    if direction not in ('n', 'p') or not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor("Malformed cursor.")
+
+    return [_to_python(queryset, key, value) for key, value in zip(keys, values)], direction
+
+
+def get_page_size(request):
+    default = settings.FEED_PAGE_SIZE
+    try:
+        size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, settings.FEED_MAX_PAGE_SIZE))
+
+
+def paginate(queryset, request, keys=('date', 'id'), descending=True):
+    window = _PageWindow(queryset, request, keys, descending)
+    return window.page(list(window.queryset))
+
+
+async def apaginate(queryset, request, keys=('date', 'id'), descending=True):
+    window = _PageWindow(queryset, request, keys, descending)
+    return window.page([item async for item in window.queryset])
+
+
+def paginate_many(querysets, request, keys=('date', 'id'), descending=True):
+    """Page through the merge of ``querysets``, which must all be ordered by ``keys``."""
+    windows = [_PageWindow(queryset, request, keys, descending) for queryset in querysets]
+    return _merge_windows(windows, [list(window.queryset) for window in windows])
+
+
+async def apaginate_many(querysets, request, keys=('date', 'id'), descending=True):
+    windows = [_PageWindow(queryset, request, keys, descending) for queryset in querysets]
+    rows = await asyncio.gather(*[_alist(window.queryset) for window in windows])
+    return _merge_windows(windows, rows)
+
+
+async def _alist(queryset):
+    return [item async for item in queryset]
+
+
+def _merge_windows(windows, rows):
+    # Each window already holds the best size + 1 rows of its source, so the
+    # merged page is the best size + 1 of their union.
+    keys = windows[0].keys
+    merged = {}
+    for item in (item for items in rows for item in items):
+        merged.setdefault(tuple(_key_values(item, keys)), item)
+    items = [merged[key] for key in sorted(merged, reverse=not windows[0].ascending)]
+    return windows[0].page(items[:windows[0].size + 1])
+
+
+class _PageWindow:
+    def __init__(self, queryset, request, keys, descending):
+        self.request = request
+        self.keys = keys
+        self.size = get_page_size(request)
+        self.cursor = request.GET.get('cursor')
+        self.forward = True
+
+        if self.cursor:
+            values, direction = decode_cursor(self.cursor, queryset, keys)
+            self.forward = direction == 'n'
+            queryset = queryset.filter(_seek(keys, values, before=(descending == self.forward)))
+
+        # Walking backwards reverses the ordering and flips the rows afterwards.
+        self.ascending = self.forward != descending
+        queryset = queryset.order_by(*[key if self.ascending else f'-{key}' for key in keys])
+        self.queryset = queryset[:self.size + 1]
+
+    def page(self, items):
+        has_more = len(items) > self.size
+        items = items[:self.size]
+        if not self.forward:
+            items.reverse()
+
+        if not items:
+            return KeysetPage(items, request=self.request)
+
+        has_next = has_more if self.forward else True
+        has_previous = bool(self.cursor) if self.forward else has_more
+        next_cursor = encode_cursor(_key_values(items[-1], self.keys), 'n') if has_next else None
+        previous_cursor = encode_cursor(_key_values(items[0], self.keys), 'p') if has_previous else None
+        return KeysetPage(items, next_cursor, previous_cursor, self.request)
+
+
+def wants_json(request):
+    if request.GET.get('format') == 'json':
+        return True
+    return 'application/json' in request.headers.get('Accept', '')
+
+
+def page_json_response(page, serialize):
+    return JsonResponse({
+        'results': [serialize(item) for item in page.items],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+        'next': page.next_url,
+        'previous': page.previous_url,
+    })
+
+
+def _seek(keys, values, before):
+    op = 'lt' if before else 'gt'
+    # The leading bound is redundant but lets the planner turn the seek into an index range.
+    condition = Q()
+    for i, key in enumerate(keys):
+        branch = Q(**{f'{key}__{op}': values[i]})
+        for prev_key, prev_value in zip(keys[:i], values[:i]):
+            branch &= Q(**{prev_key: prev_value})
+        condition |= branch
+    return Q(**{f"{keys[0]}__{op}e": values[0]}) & condition
+
+
+def _key_values(item, keys):
+    if isinstance(item, dict):
+        values = [item[key] for key in keys]
+    else:
+        values = [getattr(item, key) for key in keys]
+    return [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+
+
+def _to_python(queryset, key, value):
+    try:
+        field = queryset.model._meta.get_field(key)
+    except FieldDoesNotExist:
+        return value
+    try:
+        return field.to_python(value)
+    except ValidationError:
+        raise InvalidCursor("Malformed cursor.")
+
+
+def _page_url(request, cursor):
+    if request is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f"{request.path}?{params.urlencode()}"
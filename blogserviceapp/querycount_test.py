@@ -0,0 +1,161 @@
+"""Pin the number of queries every route runs, at two data sizes.
+
+Each route is requested once against a small and a large seeded world; the
+count must be the exact figure below for both, so a query that grows with the
+number of rows (an N+1, a lazy FK load in a template) fails the suite.
+"""
+import io
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .conversations import open_conversation, record_message
+from .counters import comment_created, post_created
+from .models import BlockedUser, Category, Comment, HomeTimeline, Message, Post
+from .timeline import backfill_timeline
+
+SIZES = [3, 30]
+
+
+def seed_world(size):
+    viewer = User.objects.create_user(username='viewer', password='pw')
+    friend = User.objects.create_user(username='friend', password='pw')
+    authors = [User.objects.create_user(username=f'author-{i}', password='pw') for i in range(size)]
+    category = Category.objects.create(name='Busy', description='')
+    Category.objects.bulk_create([Category(name=f'Category {i}', description='') for i in range(size)])
+
+    posts = []
+    for author in [friend, viewer, *authors]:
+        for i in range(3):
+            post = Post.objects.create(title=f'{author.username} {i}', description='', category_id=category, user_id=author)
+            post_created(post)
+            posts.append(post)
+    target = posts[0]
+    for author in [viewer, *authors]:
+        comment = Comment.objects.create(description=f'by {author.username}', post_id=target, user_id=author)
+        comment_created(comment)
+
+    # A third of the authors are blocked by the viewer, another third block the viewer.
+    third = max(size // 3, 1)
+    BlockedUser.objects.bulk_create(
+        [BlockedUser(id_user=viewer, blocked_user=author) for author in authors[:third]]
+        + [BlockedUser(id_user=author, blocked_user=viewer) for author in authors[third:2 * third]]
+    )
+
+    conversation = open_conversation(viewer, friend)
+    for i in range(size):
+        author, recipient = (viewer, friend) if i % 2 else (friend, viewer)
+        message = Message.objects.create(author=author, description=f'message {i}', conversation=conversation)
+        message.sender.set([recipient])
+        record_message(message, recipient)
+    for author in authors[2 * third:]:
+        other = open_conversation(viewer, author)
+        message = Message.objects.create(author=author, description='hello', conversation=other)
+        message.sender.set([viewer])
+        record_message(message, viewer)
+
+    HomeTimeline.objects.create(user=viewer, active_at=timezone.now())
+    backfill_timeline(viewer.pk)
+    return {
+        'viewer': viewer,
+        'friend': friend,
+        'stranger': authors[-1],
+        'blocked': authors[0],
+        'category': category,
+        'post': target,
+        'own_post': Post.objects.filter(user_id=viewer).first(),
+        'own_comment': Comment.objects.get(post_id=target, user_id=viewer),
+    }
+
+
+def image_upload():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (10, 20, 30)).save(buffer, format='PNG')
+    return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+
+def post_kwargs(world):
+    return {'category_pk': world['category'].pk, 'post_pk': world['post'].pk}
+
+
+# route name -> (method, url args/kwargs, request data, expected query count).
+# The message/blocked-user update and delete routes are left out: they fail
+# before reaching the database (URL kwarg mismatches), so there is nothing to
+# pin yet.
+ROUTES = {
+    'index': ('get', lambda w: [], None, 5),
+    'searched_user': ('get', lambda w: [w['friend'].pk], None, 5),
+    'request_user': ('get', lambda w: [], None, 3),
+    'search_posts': ('get', lambda w: [], {'q': 'author'}, 3),
+    'signup': ('get', lambda w: [], None, 0),
+    'login': ('get', lambda w: [], None, 2),
+    'edit_profile': ('get', lambda w: [], None, 6),
+    'delete_account': ('get', lambda w: [], None, 2),
+    'add_post': ('post', lambda w: [], lambda w: {
+        'title': 'New', 'description': 'D', 'category_id': w['category'].pk, 'image': image_upload(),
+    }, 16),
+    'update_post': ('patch', lambda w: [w['own_post'].pk], lambda w: {'title': 'Renamed'}, 7),
+    'delete_post': ('delete', lambda w: [w['own_post'].pk], None, 14),
+    'add_message': ('post', lambda w: [w['friend'].pk], lambda w: {'description': 'Hi'}, 14),
+    'read_message': ('get', lambda w: [w['friend'].pk], None, 7),
+    'inbox': ('get', lambda w: [], None, 4),
+    'add_blocked_user': ('post', lambda w: [w['stranger'].pk], None, 7),
+    'read_blocked_user': ('get', lambda w: [], None, 3),
+    'bulk_block_users': ('post', lambda w: [], lambda w: {'user_ids': [w['stranger'].pk, w['friend'].pk]}, 8),
+    'bulk_unblock_users': ('post', lambda w: [], lambda w: {'user_ids': [w['blocked'].pk, w['friend'].pk]}, 7),
+    'categories': ('get', lambda w: [], None, 5),
+    'posts_by_category': ('get', lambda w: [w['category'].pk], None, 6),
+    'comments_by_post': ('get', lambda w: post_kwargs(w), None, 6),
+    'add_comment': ('post', lambda w: post_kwargs(w), lambda w: {'description': 'Nice'}, 12),
+    'update_comment': ('patch', lambda w: {**post_kwargs(w), 'pk': w['own_comment'].pk}, lambda w: {'description': 'Edited'}, 7),
+    'delete_comment': ('delete', lambda w: {**post_kwargs(w), 'pk': w['own_comment'].pk}, None, 13),
+}
+
+JSON_METHODS = {'patch', 'delete'}
+
+# Requested without logging in; signed-in users are redirected away from these.
+ANONYMOUS_ROUTES = {'signup'}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('name', sorted(ROUTES))
+def test_route_query_count(client, settings, tmp_path, name, size):
+    settings.MEDIA_ROOT = tmp_path
+    world = seed_world(size)
+    if name not in ANONYMOUS_ROUTES:
+        client.force_login(world['viewer'])
+    method, url_args, data, expected = ROUTES[name]
+    url_args = url_args(world)
+    if isinstance(url_args, dict):
+        url = reverse(name, kwargs=url_args)
+    else:
+        url = reverse(name, args=url_args)
+    data = data(world) if callable(data) else data
+
+    request = getattr(client, method)
+    with CaptureQueriesContext(connection) as queries:
+        if method in JSON_METHODS or (method == 'post' and data and 'image' not in data):
+            response = request(url, data, content_type='application/json')
+        else:
+            response = request(url, data)
+    assert response.status_code < 400, response.content[:200]
+    assert len(queries) == expected, '\n'.join(query['sql'] for query in queries.captured_queries)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('size', SIZES)
+def test_account_deletion_request_query_count(client, size):
+    # The request only tombstones the account; the rows go in the background.
+    world = seed_world(size)
+    client.force_login(world['viewer'])
+    with CaptureQueriesContext(connection) as queries:
+        response = client.post(reverse('delete_account'))
+    assert response.status_code == 302
+    assert len(queries) == 13, '\n'.join(query['sql'] for query in queries.captured_queries)
@@ -0,0 +1,240 @@
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_routing = ContextVar('replica_routing', default=None)
+_shard_writes = ContextVar('message_shard_writes', default=None)
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+# A session missing from a lagging replica would log its user out.
+PRIMARY_ONLY_APPS = {'sessions'}
+
+# Stored on the shard of their conversation; everything else lives on default.
+SHARDED_MODELS = {'blogserviceapp.message', 'blogserviceapp.message_sender'}
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def message_shards():
+    return getattr(settings, 'MESSAGE_SHARDS', [DEFAULT_DB_ALIAS])
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+@contextmanager
+def shard_writes(alias):
+    """Send message writes that name no database, such as a serializer's ``create()``, to ``alias``."""
+    token = _shard_writes.set(alias)
+    try:
+        yield
+    finally:
+        _shard_writes.reset(token)
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+
+class MessageShardRouter:
+    """Keep messages and their recipient rows on the shard of their conversation.
+
+    Queries name the shard with ``using()``; saves and deletes follow the
+    instance they start from. Messages point at users and conversations on
+    default by id only, so those relations are allowed across databases.
+    """
+
+    def db_for_read(self, model, **hints):
+        if is_sharded(model):
+            return self.shard_for(hints.get('instance'))
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_sharded(model):
+            return self.shard_for(hints.get('instance'))
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(obj1) or is_sharded(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards take every schema change, so one migration history fits all databases, but
+        # not the data migrations (no model_name), which move rows that live on default.
+        if model_name is None and db != DEFAULT_DB_ALIAS and db in message_shards():
+            return False
+        return None
+
+    def shard_for(self, instance):
+        if instance is not None and is_sharded(instance) and instance._state.db:
+            return instance._state.db
+        return _shard_writes.get() or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """Send the reads made while serving a request to a healthy replica, round-robin per request.
+
+    Everything else uses the primary: writes, reads inside a transaction on
+    it, reads after the request has written to it, session reads, reads of
+    a client pinned by ``ReplicaPinMiddleware`` after a recent write, and
+    reads outside a request (background tasks and commands read what they
+    have just been told was committed).
+    """
+
+    def __init__(self):
+        self._next = itertools.count()
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or state.pinned or state.wrote or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # One replica per request, so its reads come from a single point in the replication stream.
+        if state.replica is None:
+            state.replica = self.pick_replica()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication.
+        if db in replicas():
+            return False
+        return None
+
+    def pick_replica(self):
+        aliases = replicas()
+        if not aliases:
+            return DEFAULT_DB_ALIAS
+        start = next(self._next)
+        for offset in range(len(aliases)):
+            alias = aliases[(start + offset) % len(aliases)]
+            if self.is_healthy(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def is_healthy(self, alias):
+        if self._down_until.get(alias, 0) > time.monotonic():
+            return False
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as e:
+            self.mark_down(alias, e)
+            return False
+        return True
+
+    def mark_down(self, alias, error=None):
+        cooldown = settings.REPLICA_ROUTING['COOLDOWN_SECONDS']
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + cooldown
+        logger.warning("Replica %s is unavailable, reading from the primary for %ss: %s", alias, cooldown, error)
+
+
+def _track_writes(execute, sql, params, many, context):
+    # get_or_create() and select_for_update() route to the primary without writing;
+    # only statements that change rows pin the client.
+    state = _routing.get()
+    if state is not None and not state.wrote and sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+        state.wrote = True
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install_write_tracker(sender, connection, **kwargs):
+    # On the connection itself, not around each request: sync code under an async view
+    # writes on its worker thread's connection, with a copy of the request's context.
+    if connection.alias == DEFAULT_DB_ALIAS and _track_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_track_writes)
+
+
+class ReplicaPinMiddleware:
+    """Pin a client's reads to the primary for ``STICKY_SECONDS`` after a request of theirs writes.
+
+    The pin is a cookie holding its expiry, so it follows the client across
+    workers and replicas of the app.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas():
+            return self.get_response(request)
+
+        config = settings.REPLICA_ROUTING
+        state = RoutingState(pinned=self.pinned(request.COOKIES.get(config['COOKIE']), config))
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.set_pin(response, state, config)
+
+    async def __acall__(self, request):
+        if not replicas():
+            return await self.get_response(request)
+
+        config = settings.REPLICA_ROUTING
+        state = RoutingState(pinned=self.pinned(request.COOKIES.get(config['COOKIE']), config))
+        token = _routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.set_pin(response, state, config)
+
+    def set_pin(self, response, state, config):
+        if state.wrote:
+            sticky = config['STICKY_SECONDS']
+            response.set_cookie(
+                config['COOKIE'], f'{time.time() + sticky:.3f}', max_age=math.ceil(sticky),
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+    def pinned(self, value, config):
+        try:
+            until = float(value)
+        except (TypeError, ValueError):
+            return False
+        # A forged expiry can only ask for the primary, and never for much longer than one
+        # window; the second of slack covers rounding and clock skew between app instances.
+        now = time.time()
+        return now < until <= now + config['STICKY_SECONDS'] + 1
@@ -0,0 +1,166 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from blogserviceapp.models import Post
+
+SEARCH_CONFIG = 'english'
+
+POST_TABLE = Post._meta.db_table
+FTS_TABLE = f'{POST_TABLE}_fts'
+
+POSTGRES_INSTALL = [
+    f"ALTER TABLE {POST_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    f"""
+    CREATE OR REPLACE FUNCTION {POST_TABLE}_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    f"DROP TRIGGER IF EXISTS {POST_TABLE}_search_vector_trigger ON {POST_TABLE}",
+    f"""
+    CREATE TRIGGER {POST_TABLE}_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON {POST_TABLE}
+    FOR EACH ROW EXECUTE PROCEDURE {POST_TABLE}_search_vector_update()
+    """,
+    f"""
+    UPDATE {POST_TABLE} SET search_vector =
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')
+    WHERE search_vector IS NULL
+    """,
+    f"CREATE INDEX IF NOT EXISTS post_search_vector_idx ON {POST_TABLE} USING GIN (search_vector)",
+]
+
+POSTGRES_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {POST_TABLE}_search_vector_trigger ON {POST_TABLE}",
+    f"DROP FUNCTION IF EXISTS {POST_TABLE}_search_vector_update()",
+    "DROP INDEX IF EXISTS post_search_vector_idx",
+    f"ALTER TABLE {POST_TABLE} DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_insert': f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {POST_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    f'{FTS_TABLE}_delete': f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {POST_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    f'{FTS_TABLE}_update': f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF title, description ON {POST_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+}
+
+
+def install_search_index(connection):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for statement in POSTGRES_INSTALL:
+                cursor.execute(statement)
+    elif connection.vendor == 'sqlite':
+        _install_sqlite_fts(connection)
+
+
+def uninstall_search_index(connection):
+    if connection.vendor == 'postgresql':
+        statements = POSTGRES_UNINSTALL
+    elif connection.vendor == 'sqlite':
+        statements = [f"DROP TRIGGER IF EXISTS {name}" for name in SQLITE_TRIGGERS]
+        statements.append(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def ensure_search_index(using='default', **kwargs):
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        _install_sqlite_fts(connection)
+
+
+def _install_sqlite_fts(connection):
+    # SQLite rebuilds a table on most ALTERs and drops its triggers with it, so this
+    # also runs after every migrate and reindexes when a trigger had gone missing.
+    with connection.cursor() as cursor:
+        tables = connection.introspection.table_names(cursor)
+        if POST_TABLE not in tables:
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"title, description, content='{POST_TABLE}', content_rowid='id', tokenize='porter unicode61')"
+        )
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [POST_TABLE]
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        if missing:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search_posts(queryset, query):
+    """Filter ``queryset`` to posts matching ``query`` and annotate a ``rank`` (higher is better)."""
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        return queryset.filter(
+            RawSQL(f"{POST_TABLE}.search_vector @@ {tsquery}", (query,), output_field=BooleanField())
+        ).annotate(
+            rank=RawSQL(f"ts_rank_cd({POST_TABLE}.search_vector, {tsquery})", (query,), output_field=FloatField())
+        )
+
+    if vendor == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+        return queryset.filter(
+            RawSQL(
+                f'{POST_TABLE}.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)',
+                (match,),
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            # bm25() is lower-is-better; weight title hits above description hits.
+            rank=RawSQL(
+                f'(SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = {POST_TABLE}.id)',
+                (match,),
+                output_field=FloatField(),
+            )
+        )
+
+    terms = _terms(query)
+    condition = Q()
+    for term in terms:
+        condition &= Q(title__icontains=term) | Q(description__icontains=term)
+    queryset = queryset.filter(condition) if terms else queryset.none()
+    return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def _terms(query):
+    return re.findall(r'\w+', query or '')
+
+
+def _fts5_query(query):
+    # Quote every term so user input can never be parsed as FTS5 query syntax.
+    return ' '.join('"%s"' % term for term in _terms(query))
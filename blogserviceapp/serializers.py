@@ -1,8 +1,37 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import IntegrityError
 from rest_framework import serializers
+from .categories import category_cache, get_category
 from .models import Post, Comment, Category, Message, BlockedUser, User
 
+class CachedCategoryField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            category = get_category(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if category is None:
+            self.fail('does_not_exist', pk_value=data)
+        return category
+
+@contextmanager
+def category_must_exist(category_pk):
+    """Answer 400 when a save fails because its category was deleted after this worker cached it."""
+    try:
+        yield
+    except IntegrityError:
+        if Category.objects.filter(pk=category_pk).exists():
+            raise
+        category_cache().clear()
+        raise serializers.ValidationError({
+            'category_id': [CachedCategoryField.default_error_messages['does_not_exist'].format(pk_value=category_pk)],
+        })
+
 class PostSerializer(serializers.ModelSerializer):
-    category_id = serializers.PrimaryKeyRelatedField(
+    category_id = CachedCategoryField(
         queryset=Category.objects.all(),
         many=False
     )
@@ -13,22 +42,27 @@ class PostSerializer(serializers.ModelSerializer):
 
 
 class BlockedUserSerializer(serializers.ModelSerializer):
-    blocked_users = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.none(), 
-        many=True 
-    )
+    # Adding a block takes the user from the URL; an update may point the block at another user.
+    blocked_user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False)
 
     class Meta:
         model = BlockedUser
-        fields = ['blocked_users']
+        fields = ['blocked_user']
 
     def __init__(self, *args, **kwargs):
-        request = kwargs.get('context', {}).get('request')
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
         if request:
             query = request.GET.get('q')
             if query:
-                self.fields['blocked_users'].queryset = User.objects.filter(username__icontains=query)
-        super().__init__(*args, **kwargs)
+                self.fields['blocked_user'].queryset = User.objects.filter(username__icontains=query)
+
+class BulkBlockSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_BLOCK_MAX_IDS,
+    )
 
 class CommentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+
+from django.db import NotSupportedError, connections, transaction
+
+from blogserviceapp.models import Conversation, Message
+from blogserviceapp.routers import message_shards
+
+logger = logging.getLogger(__name__)
+
+
+def place(low, high, shards=None):
+    """Return the shard for a new conversation between users ``low`` and ``high``.
+
+    Rendezvous hashing: every shard scores the pair and the highest score
+    wins, so adding a shard only claims the conversations that now score
+    highest there and removing one only moves its own.
+    """
+    key = f'{low}:{high}'
+    return max(shards or message_shards(), key=lambda alias: _score(alias, key))
+
+
+def _score(alias, key):
+    return hashlib.blake2b(f'{alias}/{key}'.encode(), digest_size=8).digest()
+
+
+def move_conversation(conversation_id, target, batch_size=500):
+    """Copy a conversation's messages to ``target``, point it there, then delete the originals.
+
+    The conversation row stays locked until it points at the copies, which
+    holds back new messages to it for that long. Returns the number of
+    messages moved, or None when there was nothing to move.
+    """
+    if not connections[target].features.can_return_rows_from_bulk_insert:
+        raise NotSupportedError(f"Moving messages to {target} needs bulk inserts that return ids.")
+
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().filter(pk=conversation_id).first()
+        if conversation is None or conversation.shard == target:
+            return None
+        source = conversation.shard
+        with transaction.atomic(using=target):
+            moved, last_message_id = _copy_messages(conversation, source, target, batch_size)
+        Conversation.objects.filter(pk=conversation_id).update(shard=target, last_message_id=last_message_id)
+
+    # A crash from here on leaves originals behind for sweep_strays().
+    _delete_messages(Message.objects.using(source).filter(conversation_id=conversation_id), batch_size)
+    logger.info("Moved conversation %s from %s to %s: %s messages.", conversation_id, source, target, moved)
+    return moved
+
+
+def _copy_messages(conversation, source, target, batch_size):
+    # The copies get new ids from the target's sequence; ids are only unique per shard.
+    recipients = Message.sender.through
+    messages = Message.objects.using(source).filter(conversation=conversation).order_by('pk')
+    moved, last, last_message_id = 0, 0, None
+    while True:
+        batch = list(messages.filter(pk__gt=last)[:batch_size])
+        if not batch:
+            return moved, last_message_id
+        copies = [
+            Message(author_id=message.author_id, description=message.description, conversation_id=conversation.pk)
+            for message in batch
+        ]
+        Message.objects.using(target).bulk_create(copies)
+        # auto_now_add stamped the copies with the current time; bulk_update() leaves the value alone.
+        for copy, message in zip(copies, batch):
+            copy.send_data = message.send_data
+        Message.objects.using(target).bulk_update(copies, ['send_data'])
+
+        new_ids = {message.pk: copy.pk for message, copy in zip(batch, copies)}
+        rows = recipients.objects.using(source).filter(message_id__in=new_ids).values_list('message_id', 'user_id')
+        recipients.objects.using(target).bulk_create(
+            [recipients(message_id=new_ids[message_id], user_id=user_id) for message_id, user_id in rows]
+        )
+        last_message_id = new_ids.get(conversation.last_message_id, last_message_id)
+        moved += len(batch)
+        last = batch[-1].pk
+
+
+def _delete_messages(queryset, batch_size):
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        Message.objects.using(queryset.db).filter(pk__in=ids).delete()
+
+
+def sweep_strays(alias, batch_size=500):
+    """Delete the messages on ``alias`` whose conversation lives on another shard.
+
+    They are originals or copies left by a move that stopped half way. Each
+    conversation is locked and checked again before its messages go, so a
+    move in progress keeps its copies. Returns the conversations swept.
+    """
+    messages = Message.objects.using(alias).filter(conversation__isnull=False)
+    swept, last = 0, 0
+    while True:
+        conversation_ids = list(
+            messages.filter(conversation_id__gt=last).order_by('conversation_id')
+            .values_list('conversation_id', flat=True).distinct()[:batch_size]
+        )
+        if not conversation_ids:
+            return swept
+        # A conversation missing here may be one whose first message is still being written.
+        elsewhere = (
+            Conversation.objects.filter(pk__in=conversation_ids).exclude(shard=alias).values_list('pk', flat=True)
+        )
+        for conversation_id in elsewhere:
+            with transaction.atomic():
+                shard = (
+                    Conversation.objects.select_for_update().filter(pk=conversation_id)
+                    .values_list('shard', flat=True).first()
+                )
+                if shard is None or shard == alias:
+                    continue
+                _delete_messages(messages.filter(conversation_id=conversation_id), batch_size)
+            logger.info("Swept conversation %s from %s; it lives on %s.", conversation_id, alias, shard)
+            swept += 1
+        last = conversation_ids[-1]
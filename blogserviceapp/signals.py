@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from blogserviceapp.categories import invalidate_categories
+from blogserviceapp.models import Category, Comment, Post
+from blogserviceapp.stamps import CATEGORIES_KEY, bump, category_posts_key, post_comments_key
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    bump(CATEGORIES_KEY, category_posts_key(instance.pk))
+    invalidate_categories()
+
+
+@receiver([post_save, post_delete], sender=Post)
+def post_changed(sender, instance, **kwargs):
+    # The comment listing 404s once its post is gone or has moved category.
+    bump(category_posts_key(instance.category_id_id), post_comments_key(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    if isinstance(kwargs.get('origin'), Post):
+        # Deleting a post cascades to its comments; post_changed has bumped both listings once.
+        return
+    keys = [post_comments_key(instance.post_id_id)]
+    # The category's post listing shows each post's comment count.
+    category_id = Post.objects.filter(pk=instance.post_id_id).values_list('category_id', flat=True).first()
+    if category_id is not None:
+        keys.append(category_posts_key(category_id))
+    bump(*keys)
@@ -0,0 +1,83 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Futures of the tasks queued or running on the pool, for shutdown() to wait on.
+_pending = set()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BACKGROUND_TASKS['WORKERS'],
+                    thread_name_prefix='blogservice-task',
+                )
+    return _executor
+
+
+def _forget_executor_after_fork():
+    # The pool's threads do not survive fork(); the child starts its own on first use.
+    global _executor, _executor_lock, _pending
+    _executor = None
+    _executor_lock = threading.Lock()
+    _pending = set()
+
+
+os.register_at_fork(after_in_child=_forget_executor_after_fork)
+
+
+def run_task(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed.", func.__name__)
+
+
+def _run_in_worker(func, *args, **kwargs):
+    try:
+        return run_task(func, *args, **kwargs)
+    finally:
+        # Worker threads own their DB connections; don't leave them open between tasks.
+        connections.close_all()
+
+
+def submit(func, *args, **kwargs):
+    """Run ``func`` on the worker pool once the current transaction commits."""
+    def enqueue():
+        if settings.BACKGROUND_TASKS.get('EAGER'):
+            run_task(func, *args, **kwargs)
+        else:
+            future = get_executor().submit(_run_in_worker, func, *args, **kwargs)
+            _pending.add(future)
+            future.add_done_callback(_pending.discard)
+
+    transaction.on_commit(enqueue)
+
+
+def shutdown(timeout=None):
+    """Stop the worker pool, giving its queued and running tasks up to ``timeout`` seconds.
+
+    A process leaving through ``os._exit()`` skips the interpreter's own wait
+    for the pool, so it calls this first. Returns how many tasks did not finish.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is None:
+        return 0
+    executor.shutdown(wait=False)
+    _, not_done = wait(set(_pending), timeout=timeout)
+    if not_done:
+        logger.warning("%s background tasks did not finish within %ss and were dropped.", len(not_done), timeout)
+    return len(not_done)
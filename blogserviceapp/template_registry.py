@@ -0,0 +1,52 @@
+from django.core.checks import Error, Tags, register
+from django.core.exceptions import ImproperlyConfigured
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+
+REQUIRED_TEMPLATES = (
+    '_pagination.html',
+    'blocked_users.html',
+    'delete_account.html',
+    'edit_profile.html',
+    'inbox.html',
+    'login.html',
+    'read_all_posts.html',
+    'read_categories.html',
+    'read_comments.html',
+    'read_messages.html',
+    'read_posts.html',
+    'read_request_posts.html',
+    'read_searched_posts.html',
+    'signup.html',
+)
+
+
+def find_template_errors():
+    errors = []
+    for template_name in REQUIRED_TEMPLATES:
+        try:
+            get_template(template_name)
+        except TemplateDoesNotExist:
+            errors.append(Error(
+                f"Template '{template_name}' does not exist.",
+                hint="Add it to the template directory or remove it from REQUIRED_TEMPLATES.",
+                id='blogserviceapp.E001',
+            ))
+        except TemplateSyntaxError as e:
+            errors.append(Error(
+                f"Template '{template_name}' failed to compile: {e}",
+                id='blogserviceapp.E002',
+            ))
+    return errors
+
+
+@register(Tags.templates)
+def check_required_templates(app_configs, **kwargs):
+    return find_template_errors()
+
+
+def warm_templates():
+    # Compiling every template once fills the cached loader before the first request.
+    errors = find_template_errors()
+    if errors:
+        raise ImproperlyConfigured("; ".join(error.msg for error in errors))
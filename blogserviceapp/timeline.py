@@ -0,0 +1,129 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from blogserviceapp.models import BlockedUser, HomeTimeline, Post, TimelineEntry
+from blogserviceapp.tasks import submit
+
+logger = logging.getLogger(__name__)
+
+FEED_KEYS = ('feed_date', 'feed_id')
+
+
+def home_feed(user):
+    """Return the querysets whose merge, ordered by ``FEED_KEYS``, is ``user``'s home feed.
+
+    A materialized timeline is read as a range scan of the user's entries plus
+    the small set of posts that have not been fanned out yet. Everyone else
+    gets the feed computed on read.
+    """
+    return feed_querysets(user, user.is_authenticated and _timeline_ready(user))
+
+
+def feed_querysets(user, materialized):
+    """The querysets behind ``home_feed()``, reading the user's timeline if ``materialized``."""
+    posts = Post.objects.visible_to(user)
+    if not materialized:
+        return [posts.annotate(feed_date=F('date'), feed_id=F('id'))]
+
+    # Blocks prune entries, but the anti-join still covers a fan-out racing a new block.
+    entries = posts.filter(timeline_entries__user=user).annotate(
+        feed_date=F('timeline_entries__date'),
+        feed_id=F('timeline_entries__post_id'),
+    )
+    pending = posts.filter(fanned_out=False).annotate(feed_date=F('date'), feed_id=F('id'))
+    return [entries, pending]
+
+
+def _timeline_ready(user):
+    config = settings.HOME_TIMELINE
+    now = timezone.now()
+    stale = now - timedelta(days=config['ACTIVE_DAYS'])
+    timeline, created = HomeTimeline.objects.get_or_create(user=user, defaults={'active_at': now})
+    if created:
+        submit(backfill_timeline, user.pk)
+        return False
+
+    if timeline.active_at < stale:
+        # Fan-out skipped this user while inactive; only the request that wins the update refills it.
+        if HomeTimeline.objects.filter(pk=timeline.pk, active_at__lt=stale).update(active_at=now, backfilled_at=None):
+            submit(backfill_timeline, user.pk)
+        return False
+
+    if timeline.active_at < now - timedelta(hours=1):
+        HomeTimeline.objects.filter(pk=timeline.pk).update(active_at=now)
+    return timeline.backfilled_at is not None
+
+
+def schedule_fan_out(post):
+    submit(fan_out_post, post.pk)
+
+
+def fan_out_post(post_id):
+    config = settings.HOME_TIMELINE
+    post = Post.objects.filter(pk=post_id).values('id', 'user_id', 'date').first()
+    if post is None:
+        return
+
+    author = post['user_id']
+    posted_today = Post.objects.filter(user_id=author, date=post['date']).count()
+    if posted_today > config['PROLIFIC_POSTS_PER_DAY']:
+        # Copying every post of a very prolific author is too costly; readers pick them up as pending posts.
+        logger.info("Skipping fan-out of post %s: author %s is prolific.", post_id, author)
+        return
+
+    stale = timezone.now() - timedelta(days=config['ACTIVE_DAYS'])
+    readers = (
+        HomeTimeline.objects.filter(active_at__gte=stale)
+        .filter(
+            ~Exists(BlockedUser.objects.filter(id_user=OuterRef('user'), blocked_user=author)),
+            ~Exists(BlockedUser.objects.filter(id_user=author, blocked_user=OuterRef('user'))),
+        )
+        .values_list('user_id', flat=True)
+    )
+    batch = []
+    for user_id in readers.iterator(chunk_size=config['BATCH_SIZE']):
+        batch.append(TimelineEntry(user_id=user_id, post_id=post_id, author_id=author, date=post['date']))
+        if len(batch) >= config['BATCH_SIZE']:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+    Post.objects.filter(pk=post_id).update(fanned_out=True)
+
+
+def backfill_timeline(user_id, author_ids=None):
+    """Copy the latest visible posts into ``user_id``'s timeline, optionally only from ``author_ids``."""
+    timeline = HomeTimeline.objects.filter(user_id=user_id).select_related('user').first()
+    if timeline is None:
+        return
+
+    posts = Post.objects.visible_to(timeline.user)
+    if author_ids is not None:
+        posts = posts.filter(user_id__in=author_ids)
+    posts = posts.order_by('-date', '-id').values_list('id', 'user_id', 'date')[:settings.HOME_TIMELINE['BACKFILL']]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, post_id=pk, author_id=author, date=date) for pk, author, date in posts],
+        ignore_conflicts=True,
+    )
+    if author_ids is None:
+        HomeTimeline.objects.filter(pk=timeline.pk).update(backfilled_at=timezone.now())
+
+
+def prune_blocked(user, other_ids):
+    """Drop the entries each side of a new block has of the other's posts."""
+    user_id = getattr(user, 'pk', user)
+    other_ids = [getattr(other, 'pk', other) for other in other_ids]
+    TimelineEntry.objects.filter(
+        Q(user_id=user_id, author_id__in=other_ids) | Q(user_id__in=other_ids, author_id=user_id)
+    ).delete()
+
+
+def restore_unblocked(user, other_ids):
+    user_id = getattr(user, 'pk', user)
+    other_ids = [getattr(other, 'pk', other) for other in other_ids]
+    submit(backfill_timeline, user_id, other_ids)
+    for other_id in other_ids:
+        submit(backfill_timeline, other_id, [user_id])
@@ -0,0 +1,159 @@
+import io
+import struct
+
+from django.conf import settings
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+
+# Non-file form fields share the request body with the image.
+FORM_FIELD_ALLOWANCE = 64 * 1024
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "The uploaded image is too large."
+    default_code = 'upload_too_large'
+
+
+class UnsupportedImage(APIException):
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    default_detail = "The uploaded file is not a supported image."
+    default_code = 'unsupported_image'
+
+
+def sniff_image_format(head):
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def webp_dimensions(head):
+    # Pillow's WebP plugin needs the whole file, so read the canvas size from the first chunk.
+    chunk = head[12:16]
+    if chunk == b'VP8X' and len(head) >= 30:
+        width = int.from_bytes(head[24:27], 'little') + 1
+        height = int.from_bytes(head[27:30], 'little') + 1
+        return width, height
+    if chunk == b'VP8 ' and len(head) >= 30 and head[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L' and len(head) >= 25 and head[20] == 0x2f:
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    return None
+
+
+class BoundedImageUploadHandler(TemporaryFileUploadHandler):
+    """Stream file parts to a temp file, rejecting them as soon as a limit is crossed.
+
+    The request body is never buffered: the magic bytes are checked on the
+    first chunk, the pixel dimensions as soon as the image header has
+    arrived, and the byte count on every chunk. A rejection stops reading
+    the body and is reported through ``request.upload_rejection``.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        limits = settings.POST_IMAGE_UPLOAD
+        self.max_bytes = limits['MAX_BYTES']
+        self.max_pixels = limits['MAX_PIXELS']
+        self.header_bytes = limits['HEADER_BYTES']
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.received = 0
+        self.head = b''
+        self.image_format = None
+        self.dimensions = None
+        if content_length is not None and content_length > self.max_bytes:
+            self.reject(UploadTooLarge())
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_bytes:
+            self.reject(UploadTooLarge())
+
+        if self.dimensions is None:
+            self.inspect_header(raw_data)
+
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.dimensions is None:
+            self.reject(UnsupportedImage("The image header could not be read."))
+        return super().file_complete(file_size)
+
+    def inspect_header(self, raw_data):
+        self.head += raw_data[:max(self.header_bytes - len(self.head), 0)]
+        if self.image_format is None and len(self.head) >= 12:
+            self.image_format = sniff_image_format(self.head)
+            if self.image_format is None:
+                self.reject(UnsupportedImage())
+        if self.image_format is None:
+            return
+
+        try:
+            dimensions = self.read_dimensions()
+        except Image.DecompressionBombError:
+            self.reject(UploadTooLarge("The image has too many pixels."))
+        if dimensions is None:
+            if len(self.head) >= self.header_bytes:
+                self.reject(UnsupportedImage("The image header could not be read."))
+            return
+
+        width, height = dimensions
+        if width * height > self.max_pixels:
+            self.reject(UploadTooLarge("The image has too many pixels."))
+        self.dimensions = (width, height)
+        self.head = b''
+
+    def read_dimensions(self):
+        if self.image_format == 'WEBP':
+            return webp_dimensions(self.head)
+        try:
+            # Image.open only parses the header; no pixel data is decoded or allocated.
+            with Image.open(io.BytesIO(self.head), formats=[self.image_format]) as image:
+                return image.size
+        except (OSError, SyntaxError, ValueError):
+            return None
+
+    def reject(self, error):
+        self.request.upload_rejection = error
+        if getattr(self, 'file', None) is not None:
+            self.file.close()
+        raise StopUpload(connection_reset=True)
+
+
+class BoundedImageUploadMixin:
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [BoundedImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        # Refuse before reading a single byte when the declared body is already too big.
+        if content_length > settings.POST_IMAGE_UPLOAD['MAX_BYTES'] + FORM_FIELD_ALLOWANCE:
+            raise UploadTooLarge()
+
+    def get_serializer(self, *args, **kwargs):
+        rejection = getattr(self.request._request, 'upload_rejection', None)
+        if rejection is not None:
+            raise rejection
+        return super().get_serializer(*args, **kwargs)
@@ -1,35 +1,24 @@
 from django.shortcuts import redirect, render
 from django.http import HttpResponse, Http404
-from django.template.loader import get_template
-from django.template import TemplateDoesNotExist
 from django.views.generic import CreateView, UpdateView, DeleteView
+from django.contrib.auth import logout
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.urls import reverse_lazy
 from django.contrib import messages
 from rest_framework import generics, permissions
+from blogserviceapp.accounts import request_account_deletion
 import logging
 
 logger = logging.getLogger(__name__)
 
-def check_template_exists(template_name, request):
-    try:
-        get_template(template_name)
-        logger.info(f"Template '{template_name}' found.")
-        return True
-    except TemplateDoesNotExist:
-        logger.error(f"Template '{template_name}' does not exist.")
-        return False
-
 class SignUpView(CreateView):
     form_class = UserCreationForm
     template_name = 'signup.html'
     success_url = reverse_lazy('login')
 
     def dispatch(self, request, *args, **kwargs):
-        if not check_template_exists(self.template_name, request):
-            return HttpResponse("Template not found.")
         if request.user.is_authenticated:
             messages.info(request, "You are already registered and logged in.")
             return redirect('add-post')
@@ -55,31 +44,32 @@ class EditProfileView(LoginRequiredMixin, UpdateView):
 
 class DeleteAccountView(LoginRequiredMixin, DeleteView):
     template_name = 'delete_account.html'
-    success_url = reverse_lazy('login_existing')
+    success_url = reverse_lazy('login')
 
     def get_object(self, queryset=None):
         if self.request.user.is_authenticated:
             return self.request.user
         raise Http404("You are not logged in.")
 
-    def delete(self, request, *args, **kwargs):
+    def form_valid(self, form):
+        # The account is hidden and disabled now; its rows are deleted in the background.
+        user = self.get_object()
         try:
-            response = super().delete(request, *args, **kwargs)
-            messages.success(request, "Account deleted successfully.")
-            return response
+            request_account_deletion(user)
         except Exception as e:
-            logger.error(f"An error occurred during account deletion: {str(e)}")
-            messages.error(request, f"An error occurred: {str(e)}")
+            logger.error("An error occurred during account deletion: %s", str(e))
+            messages.error(self.request, f"An error occurred: {str(e)}")
             return redirect('delete_account')
+        logger.info("User %s requested the deletion of their account.", user)
+        logout(self.request)
+        messages.success(self.request, "Account deleted successfully.")
+        return redirect(self.get_success_url())
 
 class CustomLoginView(LoginView):
     template_name = 'login.html'
     redirect_authenticated_user = True
 
     def form_valid(self, form):
-        if not check_template_exists(self.template_name, self.request):
-            return HttpResponse("Template not found.")
-        
         remember_me = form.cleaned_data.get('remember_me', False)
         if remember_me:
             self.request.session.set_expiry(1209600)  # 2 weeks in seconds
@@ -1,23 +1,17 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, HttpResponseNotFound
-from django.template.loader import get_template
+from django.http import HttpResponse
+from django.db import IntegrityError, transaction
 from rest_framework import generics, permissions
-from django.template import TemplateDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from blogserviceapp.models import BlockedUser, User
-from blogserviceapp.serializers import BlockedUserSerializer
+from blogserviceapp.serializers import BlockedUserSerializer, BulkBlockSerializer
+from blogserviceapp.blocks import block_users, invalidate_blocks, unblock_users
+from blogserviceapp.timeline import prune_blocked, restore_unblocked
 import logging
 
 logger = logging.getLogger(__name__)
 
-def check_template_exists(template_name, request):
-    try:
-        get_template(template_name)
-        logger.info(f"Template '{template_name}' found for user {request.user}.")
-        return True
-    except TemplateDoesNotExist:
-        logger.error(f"Template '{template_name}' does not exist for user {request.user}.")
-        return False
-
 class AddBlockedUserView(generics.CreateAPIView):
     serializer_class = BlockedUserSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -25,9 +19,16 @@ class AddBlockedUserView(generics.CreateAPIView):
     def perform_create(self, serializer):
         user_pk = self.kwargs.get('user_pk')
         user = get_object_or_404(User, pk=user_pk)
-        logger.info(f"User {self.request.user} is attempting to block user {user}.")
-        serializer.save(id_user=self.request.user, blocked_user=user)
-        logger.info(f"User {user} was successfully blocked by {self.request.user}.")
+        logger.info("User %s is attempting to block user %s.", self.request.user, user)
+        try:
+            with transaction.atomic():
+                serializer.save(id_user=self.request.user, blocked_user=user)
+        except IntegrityError:
+            logger.warning("User %s has already blocked user %s.", self.request.user, user)
+            raise ValidationError("This user is already blocked.")
+        invalidate_blocks(self.request.user, user)
+        prune_blocked(self.request.user, [user])
+        logger.info("User %s was successfully blocked by %s.", user, self.request.user)
 
 class UpdateBlockedUserView(generics.UpdateAPIView):
     serializer_class = BlockedUserSerializer
@@ -36,25 +37,54 @@ class UpdateBlockedUserView(generics.UpdateAPIView):
     def get_queryset(self):
         user_pk = self.kwargs.get('user_pk')
         user = get_object_or_404(User, pk=user_pk)
-        logger.info(f"Fetching blocked user entry for update: {self.request.user} blocking {user}.")
+        logger.info("Fetching blocked user entry for update: %s blocking %s.", self.request.user, user)
         return BlockedUser.objects.filter(id_user=self.request.user, blocked_user=user)
 
+    def perform_update(self, serializer):
+        previous = serializer.instance.blocked_user_id
+        blocked = serializer.save()
+        invalidate_blocks(self.request.user, previous, blocked.blocked_user_id)
+        if previous != blocked.blocked_user_id:
+            prune_blocked(self.request.user, [blocked.blocked_user_id])
+            restore_unblocked(self.request.user, [previous])
+
 class DeleteBlockedUserView(generics.DestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         user_pk = self.kwargs.get('user_pk')
         user = get_object_or_404(User, pk=user_pk)
-        logger.info(f"Fetching blocked user entry for deletion: {self.request.user} blocking {user}.")
+        logger.info("Fetching blocked user entry for deletion: %s blocking %s.", self.request.user, user)
         return BlockedUser.objects.filter(id_user=self.request.user, blocked_user=user)
 
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_blocks(self.request.user, instance.blocked_user_id)
+        restore_unblocked(self.request.user, [instance.blocked_user_id])
+
+class BulkBlockUsersView(generics.GenericAPIView):
+    serializer_class = BulkBlockSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    action = 'block'
+    apply = staticmethod(block_users)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ids = serializer.validated_data['user_ids']
+        logger.info("User %s is attempting to %s %s users.", request.user, self.action, len(user_ids))
+        results = self.apply(request.user, user_ids)
+        return Response({
+            'results': [{'user_id': user_id, 'status': status} for user_id, status in results.items()],
+        })
+
+class BulkUnblockUsersView(BulkBlockUsersView):
+    action = 'unblock'
+    apply = staticmethod(unblock_users)
+
 def blocked_users_view(request):
     template_name = 'blocked_users.html'
-    if not check_template_exists(template_name, request):
-        logger.warning(f"Template '{template_name}' not found for user {request.user}.")
-        return HttpResponseNotFound("Template not found.")
-    
     blocked_users = BlockedUser.objects.filter(blocked_user=request.user)
-    logger.info(f"User {request.user} accessed blocked users view with {blocked_users.count()} entries.")
+    logger.info("User %s accessed blocked users view.", request.user)
     
     return render(request, template_name, {'blocked_users': blocked_users})
\ No newline at end of file
@@ -1,34 +1,38 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseNotFound
-from django.template.loader import get_template
-from django.template import TemplateDoesNotExist
-from blogserviceapp.models import Category
+from django.http import HttpResponse
+from blogserviceapp.categories import get_categories
+from blogserviceapp.asyncutils import aget_user
+from blogserviceapp.stamps import CATEGORIES_KEY, conditional_listing
 import logging
 
 logger = logging.getLogger(__name__)
 
-def check_template_exists(template_name, request):
-    try:
-        get_template(template_name)
-        logger.info(f"Template '{template_name}' found for user {request.user}.")
-        return True
-    except TemplateDoesNotExist:
-        logger.error(f"Template '{template_name}' does not exist for user {request.user}.")
-        return False
-
+@conditional_listing(lambda: CATEGORIES_KEY)
 def category_view(request):
-    logger.info(f"User {request.user} accessed the category view.")
+    logger.info("User %s accessed the category view.", request.user)
     template_name = 'read_categories.html'
     
-    if not check_template_exists(template_name, request):
-        logger.warning(f"User {request.user} received a 404 because the template '{template_name}' was not found.")
-        return HttpResponseNotFound("Template not found.")
-    
     try:
-        categories = Category.objects.all()
-        logger.info(f"Categories retrieved successfully for user {request.user}.")
+        categories = get_categories()
+        logger.info("Categories retrieved successfully for user %s.", request.user)
     except Exception as e:
-        logger.error(f"Error retrieving categories for user {request.user}: {e}")
+        logger.error("Error retrieving categories for user %s: %s", request.user, e)
         return HttpResponse("An error occurred while retrieving categories.", status=500)
     
-    return render(request, template_name, {'categories': categories})
\ No newline at end of file
+    return render(request, template_name, {'categories': categories})
+
+@conditional_listing(lambda: CATEGORIES_KEY)
+async def category_view_async(request):
+    user = await aget_user(request)
+    logger.info("User %s accessed the category view.", user)
+    template_name = 'read_categories.html'
+
+    try:
+        categories = await sync_to_async(get_categories)()
+        logger.info("Categories retrieved successfully for user %s.", user)
+    except Exception as e:
+        logger.error("Error retrieving categories for user %s: %s", user, e)
+        return HttpResponse("An error occurred while retrieving categories.", status=500)
+
+    return render(request, template_name, {'categories': categories})
@@ -1,24 +1,19 @@
+import asyncio
 import logging
+from django.db import transaction
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
-from django.template.loader import get_template
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from rest_framework import generics, permissions
-from django.template import TemplateDoesNotExist
-from blogserviceapp.models import Post, Comment, BlockedUser
+from blogserviceapp.models import Post, Comment
 from blogserviceapp.serializers import CommentSerializer
+from blogserviceapp.pagination import InvalidCursor, apaginate, paginate, page_json_response, wants_json
+from blogserviceapp.asyncutils import aget_user
+from blogserviceapp.stamps import conditional_listing, post_comments_key
+from blogserviceapp import counters
 
 # Konfiguracja loggera
 logger = logging.getLogger(__name__)
 
-def check_template_exists(template_name, request):
-    try:
-        get_template(template_name)
-        logger.info(f"Template '{template_name}' found.")
-        return True
-    except TemplateDoesNotExist:
-        logger.error(f"Template '{template_name}' does not exist.")
-        return False
-
 class AddCommentView(generics.CreateAPIView):
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -27,10 +22,12 @@ class AddCommentView(generics.CreateAPIView):
         post_pk = self.kwargs.get('post_pk')
         try:
             post = get_object_or_404(Post, pk=post_pk)
-            serializer.save(user_id=self.request.user, post_id=post)
-            logger.info(f"User {self.request.user} created a comment on post {post_pk}.")
+            with transaction.atomic():
+                comment = serializer.save(user_id=self.request.user, post_id=post)
+                counters.comment_created(comment)
+            logger.info("User %s created a comment on post %s.", self.request.user, post_pk)
         except Exception as e:
-            logger.error(f"Error creating comment for post {post_pk} by user {self.request.user}: {e}")
+            logger.error("Error creating comment for post %s by user %s: %s", post_pk, self.request.user, e)
             raise
 
 class UpdateCommentView(generics.UpdateAPIView):
@@ -41,10 +38,10 @@ class UpdateCommentView(generics.UpdateAPIView):
         post_pk = self.kwargs.get('post_pk')
         try:
             post = get_object_or_404(Post, pk=post_pk)
-            logger.info(f"User {self.request.user} is updating a comment for post {post_pk}.")
+            logger.info("User %s is updating a comment for post %s.", self.request.user, post_pk)
             return Comment.objects.filter(user_id=self.request.user, post_id=post)
         except Exception as e:
-            logger.error(f"Error fetching comments for updating for post {post_pk} by user {self.request.user}: {e}")
+            logger.error("Error fetching comments for updating for post %s by user %s: %s", post_pk, self.request.user, e)
             raise
 
 class DeleteCommentView(generics.DestroyAPIView):
@@ -54,24 +51,57 @@ class DeleteCommentView(generics.DestroyAPIView):
         post_pk = self.kwargs.get('post_pk')
         try:
             post = get_object_or_404(Post, pk=post_pk)
-            logger.info(f"User {self.request.user} is deleting a comment for post {post_pk}.")
+            logger.info("User %s is deleting a comment for post %s.", self.request.user, post_pk)
             return Comment.objects.filter(user_id=self.request.user, post_id=post)
         except Exception as e:
-            logger.error(f"Error fetching comments for deletion for post {post_pk} by user {self.request.user}: {e}")
+            logger.error("Error fetching comments for deletion for post %s by user %s: %s", post_pk, self.request.user, e)
             raise
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            counters.comment_deleted(instance)
+            instance.delete()
     
+@conditional_listing(lambda category_pk, post_pk: post_comments_key(post_pk))
 def comments_by_post_view(request, category_pk, post_pk):
     template_name = 'read_comments.html'
-    if not check_template_exists(template_name, request):
-        logger.warning(f"User {request.user} requested a non-existent template '{template_name}'.")
-        return HttpResponse("Template not found.", status=404)
-
     try:
-        blocked_users = BlockedUser.objects.filter(id_user=request.user).values_list('blocked_user', flat=True)
         post = get_object_or_404(Post, pk=post_pk, category_id=category_pk)
-        comments = Comment.objects.filter(post_id=post).exclude(user_id__in=blocked_users)
-        logger.info(f"Comments for post {post_pk} retrieved by user {request.user}.")
-        return render(request, template_name, {'comments': comments})
+        comments = Comment.objects.visible_to(request.user).filter(post_id=post)
+        if wants_json(request):
+            comments = comments.values('id', 'description', 'post_id', 'user_id', 'date')
+        page = paginate(comments, request, keys=('date', 'id'), descending=False)
+        logger.info("Comments for post %s retrieved by user %s.", post_pk, request.user)
+        if wants_json(request):
+            return page_json_response(page, dict)
+        return render(request, template_name, {'comments': page.items, 'page': page})
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
     except Exception as e:
-        logger.error(f"Error retrieving comments for post {post_pk} by user {request.user}: {e}")
-        return HttpResponse("An error occurred while retrieving comments.", status=500)
\ No newline at end of file
+        logger.error("Error retrieving comments for post %s by user %s: %s", post_pk, request.user, e)
+        return HttpResponse("An error occurred while retrieving comments.", status=500)
+
+@conditional_listing(lambda category_pk, post_pk: post_comments_key(post_pk))
+async def comments_by_post_view_async(request, category_pk, post_pk):
+    user = await aget_user(request)
+    template_name = 'read_comments.html'
+    try:
+        comments = Comment.objects.visible_to(user).filter(post_id=post_pk)
+        if wants_json(request):
+            comments = comments.values('id', 'description', 'post_id', 'user_id', 'date')
+        post_exists, page = await asyncio.gather(
+            Post.objects.filter(pk=post_pk, category_id=category_pk).aexists(),
+            apaginate(comments, request, keys=('date', 'id'), descending=False),
+        )
+        logger.info("Comments for post %s retrieved by user %s.", post_pk, user)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+    except Exception as e:
+        logger.error("Error retrieving comments for post %s by user %s: %s", post_pk, user, e)
+        return HttpResponse("An error occurred while retrieving comments.", status=500)
+
+    if not post_exists:
+        raise Http404("Post not found.")
+    if wants_json(request):
+        return page_json_response(page, dict)
+    return render(request, template_name, {'comments': page.items, 'page': page})
@@ -0,0 +1,23 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from blogserviceapp.media import cache_control, get_backend, media_etag, resolve
+import logging
+
+logger = logging.getLogger(__name__)
+
+@require_safe
+def media_view(request, path):
+    backend = get_backend()
+    name, full_path, st = resolve(path)
+    etag = media_etag(st)
+    last_modified = int(st.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = backend(request, name, full_path, st, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control(name)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -1,24 +1,36 @@
+import asyncio
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, HttpResponseForbidden
-from django.template.loader import get_template
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from rest_framework import generics, permissions
 from rest_framework.exceptions import PermissionDenied
-from django.template import TemplateDoesNotExist
-from blogserviceapp.models import Message, User, BlockedUser
+from blogserviceapp.models import AccountDeletion, ConversationParticipant, Message, User
+from blogserviceapp.blocks import get_block_sets, is_blocked_between
+from blogserviceapp.conversations import (
+    attach_last_messages, conversation_messages, find_conversation, forget_message, mark_read, open_conversation,
+    record_message,
+)
+from blogserviceapp.routers import shard_writes
+from blogserviceapp.pagination import InvalidCursor, apaginate, paginate, page_json_response, wants_json
+from blogserviceapp.asyncutils import aget_user
 from blogserviceapp.serializers import MessageSerializer
-from django.db.models import Q
 import logging
 
 logger = logging.getLogger(__name__)
 
-def check_template_exists(template_name, request):
-    try:
-        get_template(template_name)
-        logger.info(f"Template '{template_name}' found for user {request.user}.")
-        return True
-    except TemplateDoesNotExist:
-        logger.error(f"Template '{template_name}' does not exist for user {request.user}.")
-        return False
+def _correspondents():
+    # Messages are read from a shard that has no tombstones to join against.
+    return User.objects.annotate(deleted=Exists(AccountDeletion.objects.filter(user=OuterRef('pk'))))
+
+def _visible_messages(conversation, viewer, other):
+    # Blocked pairs were turned away already; a deleted account's messages vanish at once, as in visible_to().
+    messages = conversation_messages(conversation)
+    if other.deleted:
+        messages = messages.filter(author=viewer)
+    return messages
 
 class AddMessageView(generics.CreateAPIView):
     serializer_class = MessageSerializer
@@ -28,17 +40,20 @@ class AddMessageView(generics.CreateAPIView):
         user_pk = self.kwargs.get('user_pk')
         user = get_object_or_404(User, pk=user_pk)
 
-        logger.info(f"User {self.request.user} is attempting to send a message to user {user_pk}.")
-
-        blocking_users = BlockedUser.objects.filter(id_user=self.request.user).values_list('blocked_user', flat=True)
-        blocked_users = BlockedUser.objects.filter(id_user=user).values_list('blocked_user', flat=True)
+        logger.info("User %s is attempting to send a message to user %s.", self.request.user, user_pk)
 
-        if user.pk in blocking_users or self.request.user.pk in blocked_users:
-            logger.warning(f"User {self.request.user} is blocked from sending a message to user {user_pk}.")
+        if is_blocked_between(self.request.user, user):
+            logger.warning("User %s is blocked from sending a message to user %s.", self.request.user, user_pk)
             raise PermissionDenied("You cannot send a message to this user.")
         
-        serializer.save(author=self.request.user, sender=user)
-        logger.info(f"Message successfully sent from user {self.request.user} to user {user_pk}.")
+        with transaction.atomic():
+            conversation = open_conversation(self.request.user, user)
+            with transaction.atomic(using=conversation.shard, savepoint=False), shard_writes(conversation.shard):
+                message = serializer.save(author=self.request.user, conversation=conversation)
+                # Not serializer.save(sender=...): the many-to-many manager joins auth_user, which the shard lacks.
+                Message.sender.through.objects.create(message=message, user=user)
+            record_message(message, user)
+        logger.info("Message successfully sent from user %s to user %s.", self.request.user, user_pk)
 
 class UpdateMessageView(generics.UpdateAPIView):
     serializer_class = MessageSerializer
@@ -48,16 +63,16 @@ class UpdateMessageView(generics.UpdateAPIView):
         user_pk = self.kwargs.get('user_pk')
         user = get_object_or_404(User, pk=user_pk)
 
-        logger.info(f"User {self.request.user} is attempting to update a message with user {user_pk}.")
+        logger.info("User %s is attempting to update a message with user %s.", self.request.user, user_pk)
 
-        blocking_users = BlockedUser.objects.filter(user=self.request.user).values_list('blocked_user', flat=True)
-        blocked_users = BlockedUser.objects.filter(user=user).values_list('blocked_user', flat=True)
-
-        if user.pk in blocking_users or self.request.user.pk in blocked_users:
-            logger.warning(f"User {self.request.user} is blocked from updating messages involving user {user_pk}.")
+        if is_blocked_between(self.request.user, user):
+            logger.warning("User %s is blocked from updating messages involving user %s.", self.request.user, user_pk)
             return Message.objects.none()
 
-        return Message.objects.filter(author=self.request.user, sender=user)
+        conversation = find_conversation(self.request.user, user)
+        if conversation is None:
+            return Message.objects.none()
+        return conversation_messages(conversation).filter(author=self.request.user)
 
 class DeleteMessageView(generics.DestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -66,40 +81,123 @@ class DeleteMessageView(generics.DestroyAPIView):
         user_pk = self.kwargs.get('user_pk')
         user = get_object_or_404(User, pk=user_pk)
 
-        logger.info(f"User {self.request.user} is attempting to delete messages with user {user_pk}.")
+        logger.info("User %s is attempting to delete messages with user %s.", self.request.user, user_pk)
 
-        blocking_users = BlockedUser.objects.filter(user=self.request.user).values_list('blocked_user', flat=True)
-        blocked_users = BlockedUser.objects.filter(user=user).values_list('blocked_user', flat=True)
+        if is_blocked_between(self.request.user, user):
+            logger.warning("User %s is blocked from deleting messages involving user %s.", self.request.user, user_pk)
+            return Message.objects.none()
 
-        if user.pk in blocking_users or self.request.user.pk in blocked_users:
-            logger.warning(f"User {self.request.user} is blocked from deleting messages involving user {user_pk}.")
+        conversation = find_conversation(self.request.user, user)
+        if conversation is None:
             return Message.objects.none()
+        return conversation_messages(conversation).filter(author=self.request.user)
 
-        return Message.objects.filter(author=self.request.user, sender=user)
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            forget_message(instance)
+            instance.delete()
 
 def message_to_sender_view(request, user_pk):
-    logger.info(f"User {request.user} is viewing messages with user {user_pk}.")
+    logger.info("User %s is viewing messages with user %s.", request.user, user_pk)
     template_name = 'read_messages.html'
-    if not check_template_exists(template_name, request):
-        return HttpResponse("Template not found.", status=404)
+    user = get_object_or_404(_correspondents(), pk=user_pk)
+
+    if is_blocked_between(request.user, user):
+        logger.warning("User %s is blocked from viewing messages with user %s.", request.user, user_pk)
+        return HttpResponseForbidden("You cannot view messages from this user.")
     
-    user = get_object_or_404(User, pk=user_pk)
+    try:
+        conversation = find_conversation(request.user, user)
+        if conversation is not None:
+            messages = _visible_messages(conversation, request.user, user)
+        else:
+            messages = Message.objects.none()
+        if wants_json(request):
+            messages = messages.values('id', 'author_id', 'description', 'send_data')
+        page = paginate(messages, request, keys=('send_data', 'id'))
+        if conversation is not None:
+            mark_read(conversation, request.user)
+        logger.info("Messages retrieved successfully for user %s with user %s.", request.user, user_pk)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+    except Exception as e:
+        logger.error("Error while retrieving messages for user %s with user %s: %s", request.user, user_pk, e)
+        return HttpResponse("An error occurred while retrieving messages.", status=500)
+
+    if wants_json(request):
+        return page_json_response(page, dict)
+    return render(request, template_name, {'messages': page.items, 'page': page})
 
-    blocking_users = BlockedUser.objects.filter(id_user=request.user).values_list('blocked_user_id', flat=True)
-    blocked_users = BlockedUser.objects.filter(blocked_user=user).values_list('id_user_id', flat=True)
+async def message_to_sender_view_async(request, user_pk):
+    viewer = await aget_user(request)
+    logger.info("User %s is viewing messages with user %s.", viewer, user_pk)
+    template_name = 'read_messages.html'
 
-    if user.pk in blocking_users or request.user.pk in blocked_users:
-        logger.warning(f"User {request.user} is blocked from viewing messages with user {user_pk}.")
+    user, block_sets, conversation = await asyncio.gather(
+        _correspondents().filter(pk=user_pk).afirst(),
+        sync_to_async(get_block_sets)(viewer),
+        sync_to_async(find_conversation)(viewer, user_pk),
+    )
+    if user is None:
+        raise Http404("User not found.")
+    if user.pk in block_sets.blocking or user.pk in block_sets.blocked_by:
+        logger.warning("User %s is blocked from viewing messages with user %s.", viewer, user_pk)
         return HttpResponseForbidden("You cannot view messages from this user.")
-    
+
     try:
-        messages = Message.objects.filter(
-            (Q(author=request.user) & Q(sender=user)) |
-            (Q(author=user) & Q(sender=request.user))
-        ).order_by('send_data')
-        logger.info(f"Messages retrieved successfully for user {request.user} with user {user_pk}.")
+        if conversation is not None:
+            messages = _visible_messages(conversation, viewer, user)
+        else:
+            messages = Message.objects.none()
+        if wants_json(request):
+            messages = messages.values('id', 'author_id', 'description', 'send_data')
+        page = await apaginate(messages, request, keys=('send_data', 'id'))
+        if conversation is not None:
+            await sync_to_async(mark_read)(conversation, viewer)
+        logger.info("Messages retrieved successfully for user %s with user %s.", viewer, user_pk)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
     except Exception as e:
-        logger.error(f"Error while retrieving messages for user {request.user} with user {user_pk}: {e}")
+        logger.error("Error while retrieving messages for user %s with user %s: %s", viewer, user_pk, e)
         return HttpResponse("An error occurred while retrieving messages.", status=500)
 
-    return render(request, template_name, {'messages': messages})
\ No newline at end of file
+    if wants_json(request):
+        return page_json_response(page, dict)
+    return render(request, template_name, {'messages': page.items, 'page': page})
+
+@login_required
+def inbox_view(request):
+    logger.info("User %s is viewing their inbox.", request.user)
+    template_name = 'inbox.html'
+
+    try:
+        conversations = (
+            ConversationParticipant.objects
+            .filter(user=request.user, last_message_at__isnull=False)
+            # Deleted and blocked partners' conversations cannot be opened; don't list them.
+            .visible_to(request.user)
+            .select_related('other_user', 'conversation')
+        )
+        page = paginate(conversations, request, keys=('last_message_at', 'id'))
+        attach_last_messages([participant.conversation for participant in page.items])
+        logger.info("Inbox retrieved successfully for user %s.", request.user)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+    except Exception as e:
+        logger.error("Error while retrieving the inbox for user %s: %s", request.user, e)
+        return HttpResponse("An error occurred while retrieving conversations.", status=500)
+
+    if wants_json(request):
+        return page_json_response(page, _conversation_json)
+    return render(request, template_name, {'conversations': page.items, 'page': page})
+
+def _conversation_json(participant):
+    last_message = participant.conversation.last_message
+    return {
+        'conversation_id': participant.conversation_id,
+        'other_user': {'id': participant.other_user_id, 'username': participant.other_user.username},
+        'unread_count': participant.unread_count,
+        'message_count': participant.conversation.message_count,
+        'last_message_at': participant.last_message_at,
+        'last_message': last_message.description if last_message else None,
+    }
\ No newline at end of file
@@ -1,117 +1,239 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.db import transaction
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
-from django.template.loader import get_template
-from django.template import TemplateDoesNotExist
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from rest_framework import generics, permissions
-from blogserviceapp.models import Post, Category, BlockedUser, User
-from blogserviceapp.serializers import PostSerializer
+from blogserviceapp.models import Post, Category, User
+from blogserviceapp.blocks import is_blocked_between
+from blogserviceapp.serializers import PostSerializer, category_must_exist
+from blogserviceapp.pagination import (
+    InvalidCursor, apaginate, apaginate_many, paginate, paginate_many, page_json_response, wants_json,
+)
+from blogserviceapp.asyncutils import aget_user
+from blogserviceapp.search import search_posts
+from blogserviceapp.images import discard_post_derivatives, schedule_post_derivatives
+from blogserviceapp.timeline import FEED_KEYS, home_feed, schedule_fan_out
+from blogserviceapp.uploads import BoundedImageUploadMixin
+from blogserviceapp.stamps import bump, category_posts_key, conditional_listing
+from blogserviceapp import counters
 import logging
 
 logger = logging.getLogger(__name__)
 
-def check_template_exists(template_name, request):
-    try:
-        get_template(template_name)
-        logger.info(f"Template '{template_name}' found for user {request.user}.")
-        return True
-    except TemplateDoesNotExist:
-        logger.error(f"Template '{template_name}' does not exist for user {request.user}.")
-        return False
-
-class AddPostView(generics.CreateAPIView):
+POST_JSON_FIELDS = (
+    'id', 'title', 'description', 'image', 'image_variants', 'category_id', 'user_id', 'date', 'comment_count',
+)
+
+# What read_posts.html renders, for the sync and async category listings alike.
+CATEGORY_LISTING_FIELDS = ("id", "image", "title", "description", "date", "comment_count")
+
+class AddPostView(BoundedImageUploadMixin, generics.CreateAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def perform_create(self, serializer):
-        logger.info(f"User {self.request.user} is creating a post.")
+        logger.info("User %s is creating a post.", self.request.user)
         try:
-            serializer.save(user_id=self.request.user)
-            logger.info(f"Post created successfully by user {self.request.user}.")
+            # The foreign key is checked when the transaction commits.
+            with category_must_exist(serializer.validated_data['category_id'].pk), transaction.atomic():
+                post = serializer.save(user_id=self.request.user)
+                counters.post_created(post)
+            schedule_post_derivatives(post)
+            schedule_fan_out(post)
+            logger.info("Post created successfully by user %s.", self.request.user)
         except Exception as e:
-            logger.error(f"Error while creating post by user {self.request.user}: {e}")
+            logger.error("Error while creating post by user %s: %s", self.request.user, e)
             raise
 
-class UpdatePostView(generics.UpdateAPIView):
+class UpdatePostView(BoundedImageUploadMixin, generics.UpdateAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        logger.info(f"User {self.request.user} is accessing posts for updating.")
+        logger.info("User %s is accessing posts for updating.", self.request.user)
         return Post.objects.filter(user_id=self.request.user)
 
+    def perform_update(self, serializer):
+        previous_category = serializer.instance.category_id_id
+        category = serializer.validated_data.get('category_id')
+        with category_must_exist(category.pk if category else previous_category), transaction.atomic():
+            if 'image' in serializer.validated_data:
+                discard_post_derivatives(serializer.instance.image_variants)
+                post = serializer.save(image_variants={})
+                schedule_post_derivatives(post)
+            else:
+                post = serializer.save()
+            counters.post_moved(post, previous_category)
+        if post.category_id_id != previous_category:
+            bump(category_posts_key(previous_category))
+
 class DeletePostView(generics.DestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        logger.info(f"User {self.request.user} is accessing posts for deletion.")
+        logger.info("User %s is accessing posts for deletion.", self.request.user)
         return Post.objects.filter(user_id=self.request.user)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            counters.post_deleted(instance)
+            instance.delete()
     
+@conditional_listing(lambda category_pk: category_posts_key(category_pk))
 def posts_by_category_view(request, category_pk):
-    logger.info(f"User {request.user} requested posts in category {category_pk}.")
+    logger.info("User %s requested posts in category %s.", request.user, category_pk)
     template_name = 'read_posts.html'
-    if not check_template_exists(template_name, request):
-        return HttpResponse("Template not found.", status=404)
-
     try:
-        blocked_users = BlockedUser.objects.filter(id_user=request.user).values_list('blocked_user', flat=True)
         category = get_object_or_404(Category, pk=category_pk)
-        posts = Post.objects.filter(category_id=category).exclude(user_id__in=blocked_users).values("image", "title", "description")
-        logger.info(f"Posts for category {category_pk} retrieved successfully for user {request.user}.")
+        posts = Post.objects.visible_to(request.user).filter(category_id=category)
+        page = _paginate_posts(posts, request, CATEGORY_LISTING_FIELDS)
+        logger.info("Posts for category %s retrieved successfully for user %s.", category_pk, request.user)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
     except Exception as e:
-        logger.error(f"Error retrieving posts for category {category_pk} by user {request.user}: {e}")
+        logger.error("Error retrieving posts for category %s by user %s: %s", category_pk, request.user, e)
         return HttpResponse("An error occurred while retrieving posts.", status=500)
-    
-    return render(request, template_name, {'posts': posts})
+
+    return _render_posts(request, template_name, page)
 
 def posts_readed_view(request):
-    logger.info(f"User {request.user} requested all readable posts.")
+    logger.info("User %s requested all readable posts.", request.user)
     template_name = 'read_all_posts.html'
-    if not check_template_exists(template_name, request):
-        return HttpResponse("Template not found.", status=404)
-
     try:
-        blocked_users = BlockedUser.objects.filter(id_user=request.user).values_list('blocked_user', flat=True)
-        posts = Post.objects.exclude(user_id__in=blocked_users)
-        logger.info(f"All posts retrieved successfully for user {request.user}.")
+        page = _paginate_home_feed(home_feed(request.user), request)
+        logger.info("All posts retrieved successfully for user %s.", request.user)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
     except Exception as e:
-        logger.error(f"Error retrieving all posts for user {request.user}: {e}")
+        logger.error("Error retrieving all posts for user %s: %s", request.user, e)
         return HttpResponse("An error occurred while retrieving posts.", status=500)
 
-    return render(request, template_name, {'posts': posts})
+    return _render_posts(request, template_name, page, _feed_post_json)
 
 def posts_by_request_user(request):
-    logger.info(f"User {request.user} requested their own posts.")
+    logger.info("User %s requested their own posts.", request.user)
     template_name = 'read_request_posts.html'
-    if not check_template_exists(template_name, request):
-        return HttpResponse("Template not found.", status=404)
-
     try:
         posts = Post.objects.filter(user_id=request.user)
-        logger.info(f"Posts by user {request.user} retrieved successfully.")
+        page = _paginate_posts(posts, request)
+        logger.info("Posts by user %s retrieved successfully.", request.user)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
     except Exception as e:
-        logger.error(f"Error retrieving posts by user {request.user}: {e}")
+        logger.error("Error retrieving posts by user %s: %s", request.user, e)
         return HttpResponse("An error occurred while retrieving your posts.", status=500)
 
-    return render(request, template_name, {'posts': posts})
+    return _render_posts(request, template_name, page)
 
 def posts_by_searched_user(request, user_pk):
-    logger.info(f"User {request.user} requested posts by searched user {user_pk}.")
+    logger.info("User %s requested posts by searched user %s.", request.user, user_pk)
     template_name = 'read_searched_posts.html'
-    if not check_template_exists(template_name, request):
-        return HttpResponse("Template not found.", status=404)
-
     try:
-        blocked_users = BlockedUser.objects.filter(id_user=request.user).values_list('blocked_user', flat=True)
         user = get_object_or_404(User, pk=user_pk)
 
-        if user.pk not in blocked_users:
-            posts = Post.objects.filter(user_id=user)
-            logger.info(f"Posts by user {user_pk} retrieved successfully for user {request.user}.")
+        if not is_blocked_between(request.user, user):
+            posts = Post.objects.visible_to(request.user).filter(user_id=user)
+            logger.info("Posts by user %s retrieved successfully for user %s.", user_pk, request.user)
         else:
-            posts = []
-            logger.warning(f"User {request.user} is blocked from viewing posts by user {user_pk}.")
+            posts = Post.objects.none()
+            logger.warning("User %s is blocked from viewing posts by user %s.", request.user, user_pk)
+        page = _paginate_posts(posts, request)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+    except Exception as e:
+        logger.error("Error retrieving posts by user %s for user %s: %s", user_pk, request.user, e)
+        return HttpResponse("An error occurred while retrieving posts.", status=500)
+
+    return _render_posts(request, template_name, page)
+
+@conditional_listing(lambda category_pk: category_posts_key(category_pk))
+async def posts_by_category_view_async(request, category_pk):
+    user = await aget_user(request)
+    logger.info("User %s requested posts in category %s.", user, category_pk)
+    template_name = 'read_posts.html'
+    try:
+        posts = Post.objects.visible_to(user).filter(category_id=category_pk)
+        category, page = await asyncio.gather(
+            Category.objects.filter(pk=category_pk).afirst(),
+            _apaginate_posts(posts, request, CATEGORY_LISTING_FIELDS),
+        )
+        logger.info("Posts for category %s retrieved successfully for user %s.", category_pk, user)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+    except Exception as e:
+        logger.error("Error retrieving posts for category %s by user %s: %s", category_pk, user, e)
+        return HttpResponse("An error occurred while retrieving posts.", status=500)
+
+    if category is None:
+        raise Http404("Category not found.")
+    return _render_posts(request, template_name, page)
+
+async def posts_readed_view_async(request):
+    user = await aget_user(request)
+    logger.info("User %s requested all readable posts.", user)
+    template_name = 'read_all_posts.html'
+    try:
+        querysets = await sync_to_async(home_feed)(user)
+        page = await _apaginate_home_feed(querysets, request)
+        logger.info("All posts retrieved successfully for user %s.", user)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
     except Exception as e:
-        logger.error(f"Error retrieving posts by user {user_pk} for user {request.user}: {e}")
+        logger.error("Error retrieving all posts for user %s: %s", user, e)
         return HttpResponse("An error occurred while retrieving posts.", status=500)
 
-    return render(request, template_name, {'posts': posts})
\ No newline at end of file
+    return _render_posts(request, template_name, page, _feed_post_json)
+
+def search_posts_view(request):
+    query = request.GET.get('q', '').strip()
+    logger.info("User %s searched posts for '%s'.", request.user, query)
+    template_name = 'read_searched_posts.html'
+
+    try:
+        posts = search_posts(Post.objects.visible_to(request.user), query)
+        if wants_json(request):
+            posts = posts.values(*POST_JSON_FIELDS, 'rank')
+        page = paginate(posts, request, keys=('rank', 'id'))
+        logger.info("Search for '%s' returned %s posts for user %s.", query, len(page), request.user)
+    except InvalidCursor:
+        return HttpResponseBadRequest("Invalid cursor.")
+    except Exception as e:
+        logger.error("Error searching posts for '%s' by user %s: %s", query, request.user, e)
+        return HttpResponse("An error occurred while searching posts.", status=500)
+
+    if wants_json(request):
+        return page_json_response(page, dict)
+    return render(request, template_name, {'posts': page.items, 'page': page, 'query': query})
+
+def _paginate_posts(posts, request, fields=None):
+    if wants_json(request):
+        fields = POST_JSON_FIELDS
+    if fields:
+        posts = posts.values(*fields)
+    return paginate(posts, request, keys=('date', 'id'))
+
+async def _apaginate_posts(posts, request, fields=None):
+    if wants_json(request):
+        fields = POST_JSON_FIELDS
+    if fields:
+        posts = posts.values(*fields)
+    return await apaginate(posts, request, keys=('date', 'id'))
+
+def _paginate_home_feed(querysets, request):
+    if wants_json(request):
+        querysets = [posts.values(*POST_JSON_FIELDS, *FEED_KEYS) for posts in querysets]
+    return paginate_many(querysets, request, keys=FEED_KEYS)
+
+async def _apaginate_home_feed(querysets, request):
+    if wants_json(request):
+        querysets = [posts.values(*POST_JSON_FIELDS, *FEED_KEYS) for posts in querysets]
+    return await apaginate_many(querysets, request, keys=FEED_KEYS)
+
+def _feed_post_json(post):
+    return {field: post[field] for field in POST_JSON_FIELDS}
+
+def _render_posts(request, template_name, page, serialize=dict):
+    if wants_json(request):
+        return page_json_response(page, serialize)
+    return render(request, template_name, {'posts': page.items, 'page': page})
\ No newline at end of file
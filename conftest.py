@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_process_caches():
+    from blogserviceapp.blocks import block_graph
+    from blogserviceapp.categories import category_cache
+
+    block_graph().clear()
+    category_cache().clear()
+    yield
+    block_graph().clear()
+    category_cache().clear()
+
+
+@pytest.fixture(autouse=True)
+def enforce_query_budgets(settings):
+    settings.REQUEST_METRICS = {**settings.REQUEST_METRICS, 'RAISE_ON_BUDGET': True}